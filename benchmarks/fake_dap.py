@@ -0,0 +1,231 @@
+import asyncio
+import gzip
+import json
+import os
+import random
+import shutil
+import string
+import uuid
+
+from datetime import datetime, timezone
+from dap.api import DOWNLOAD_CONCURRENCY
+from dap.dap_types import DownloadTableDataResult, GetTableDataResult, Object, VersionedSchema
+
+from cd2datamanager.dap_client import DapClient
+
+
+class SyntheticDataset:
+
+    # Column types cycle through the DAP types the schema generator maps to SQL
+    column_types = [
+        {"type": "integer", "format": "int64"},
+        {"type": "string"},
+        {"type": "number"},
+        {"type": "boolean"},
+        {"type": "string", "format": "date-time"}
+    ]
+
+    def __init__(self, root, tables = 4, rows = 100000, parts = 4, columns = 10, value_width = 24, seed = 42):
+        self.root = os.path.abspath(root)
+        self.table_count = tables
+        self.rows = rows
+        self.parts = max(1, parts)
+        self.columns = max(1, columns)
+        self.value_width = value_width
+        self.seed = seed
+
+    @property
+    def name(self) -> str:
+        return f"t{self.table_count}_r{self.rows}_p{self.parts}_c{self.columns}_w{self.value_width}_s{self.seed}"
+
+    @property
+    def directory(self) -> str:
+        return f"{self.root}/{self.name}"
+
+    @property
+    def tables(self) -> list:
+        return [f"bench_table_{index:02d}" for index in range(self.table_count)]
+
+    def part_files(self, table) -> list:
+        return [f"{self.directory}/{table}/part-{part:05d}.tsv.gz" for part in range(self.parts)]
+
+    @property
+    def compressed_size(self) -> int:
+        return sum(os.path.getsize(part_file) for table in self.tables for part_file in self.part_files(table))
+
+    @property
+    def total_rows(self) -> int:
+        return self.rows * self.table_count
+
+    def column_type(self, index) -> dict:
+        return self.column_types[index % len(self.column_types)]
+
+    def schema(self, table) -> dict:
+        value_properties = {}
+        for index in range(self.columns):
+            definition = dict(self.column_type(index))
+            if definition == {"type": "string"}:
+                definition["maxLength"] = max(255, self.value_width)
+
+            value_properties[f"column_{index:03d}"] = definition
+
+        return {
+            "type": "object",
+            "properties": {
+                "key": {"type": "object", "properties": {"id": {"type": "integer", "format": "int64"}}, "required": ["id"]},
+                "value": {"type": "object", "title": table, "description": "Synthetic benchmark table", "properties": value_properties, "required": []},
+                "meta": {"type": "object", "properties": {"ts": {"type": "string", "format": "date-time"}}}
+            }
+        }
+
+    def header(self) -> bytes:
+        fields = ["key.id"] + [f"value.column_{index:03d}" for index in range(self.columns)] + ["meta.ts"]
+        return ("\t".join(fields) + "\n").encode("UTF-8")
+
+    def value(self, generator, index) -> str:
+        definition = self.column_type(index)
+        if definition.get("format", None) == "date-time":
+            return f"2024-0{generator.randint(1, 9)}-1{generator.randint(0, 9)}T0{generator.randint(0, 9)}:1{generator.randint(0, 9)}:00.000Z"
+
+        if definition["type"] == "integer":
+            return str(generator.randint(0, 2 ** 40))
+
+        if definition["type"] == "number":
+            return f"{generator.random() * 1000:.4f}"
+
+        if definition["type"] == "boolean":
+            return generator.choice(["true", "false"])
+
+        return "".join(generator.choices(string.ascii_letters, k=self.value_width))
+
+    def build(self) -> "SyntheticDataset":
+        # Generated once per parameter set and reused - generating is not part of any measurement
+        marker = f"{self.directory}/dataset.json"
+        if os.path.exists(marker):
+            return self
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        generator = random.Random(self.seed)
+
+        # A pool of distinct rows keeps generation fast while still giving gzip realistic input
+        row_pool = ["\t".join(self.value(generator, index) for index in range(self.columns)) for _ in range(min(self.rows, 1000) or 1)]
+
+        for table in self.tables:
+            os.makedirs(f"{self.directory}/{table}", exist_ok=True)
+            part_rows = -(-self.rows // self.parts)
+
+            for part, part_file in enumerate(self.part_files(table)):
+                first_row = part * part_rows
+                last_row = min(self.rows, first_row + part_rows)
+
+                with gzip.open(part_file, "wb", compresslevel=6) as part_output:
+                    part_output.write(self.header())
+                    for start in range(first_row, last_row, 10000):
+                        block = [f"{row}\t{row_pool[row % len(row_pool)]}\t2024-01-01T00:00:00.000Z\n" for row in range(start, min(last_row, start + 10000))]
+                        part_output.write("".join(block).encode("UTF-8"))
+
+        with open(marker, "w", encoding="UTF-8") as marker_file:
+            json.dump({"tables": self.tables, "rows": self.rows, "parts": self.parts, "columns": self.columns, "value_width": self.value_width}, marker_file)
+
+        return self
+
+
+class FakeStreamReader:
+
+    def __init__(self, file_path):
+        self._file_path = file_path
+
+    async def iter_chunked(self, size):
+        with open(self._file_path, "rb") as source:
+            while chunk := source.read(size):
+                yield chunk
+
+
+class FakeDAPSession:
+
+    # Serves the synthetic dataset through the DAPSession calls the tool makes - every API call and every object
+    # request pays the latency, like the URL lookup and the storage request DAP makes for each part
+    def __init__(self, dataset, latency_seconds = 0.0):
+        self._dataset = dataset
+        self._latency_seconds = latency_seconds
+        self._objects = {}
+
+    async def _latency(self):
+        if self._latency_seconds > 0:
+            await asyncio.sleep(self._latency_seconds)
+
+    async def get_tables(self, namespace) -> list:
+        await self._latency()
+        return self._dataset.tables
+
+    async def get_table_schema(self, namespace, table) -> VersionedSchema:
+        await self._latency()
+        return VersionedSchema(schema=self._dataset.schema(table), version=1)
+
+    async def download_table_data(self, namespace, table, query, output_directory, decompress = False) -> DownloadTableDataResult:
+        await self._latency()
+
+        job_id = str(uuid.uuid4())
+        job_directory = f"{output_directory}/job_{job_id}"
+        os.makedirs(job_directory, exist_ok=True)
+
+        # DAP resolves and downloads the parts one object at a time, a few at once
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        downloaded_files = await asyncio.gather(*[self._download_part(semaphore, part_file, job_directory) for part_file in self._dataset.part_files(table)])
+
+        return DownloadTableDataResult(1, datetime.now(timezone.utc), job_id, list(downloaded_files))
+
+    async def _download_part(self, semaphore, part_file, job_directory) -> str:
+        async with semaphore:
+            # The URL lookup, then the request for the object itself
+            await self._latency()
+            await self._latency()
+
+            target_file = f"{job_directory}/{os.path.basename(part_file)}"
+            await asyncio.get_running_loop().run_in_executor(None, shutil.copyfile, part_file, target_file)
+            return target_file
+
+    async def get_table_data(self, namespace, table, query) -> GetTableDataResult:
+        await self._latency()
+
+        objects = []
+        for part_file in self._dataset.part_files(table):
+            object_id = str(uuid.uuid4())
+            self._objects[object_id] = part_file
+            objects.append(Object(id=object_id))
+
+        return GetTableDataResult(1, datetime.now(timezone.utc), str(uuid.uuid4()), objects)
+
+    async def get_resources(self, objects) -> dict:
+        await self._latency()
+        return {data_object.id: self._objects[data_object.id] for data_object in objects}
+
+    async def stream_resource(self, resource):
+        await self._latency()
+        yield FakeStreamReader(resource)
+
+
+class FakeDAPClient:
+
+    def __init__(self, dataset, latency_seconds = 0.0):
+        self._session = FakeDAPSession(dataset, latency_seconds)
+
+    async def __aenter__(self) -> FakeDAPSession:
+        return self._session
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+def offline_client(dataset, latency_seconds = 0.0):
+    # DapClient with the same constructor, reading from the synthetic dataset instead of CD2
+    class OfflineDapClient(DapClient):
+
+        def _load_yaml(self, yaml_path):
+            self.client_id = "offline"
+            self.client_secret = "offline"
+
+        def connect(self) -> FakeDAPClient:
+            return FakeDAPClient(dataset, latency_seconds)
+
+    return OfflineDapClient
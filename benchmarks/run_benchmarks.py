@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+import resource
+import threading
+import time
+import typer
+
+from typing_extensions import Annotated
+from tiberlogger.logger import Logger, LogLevel
+
+import cd2datamanager.main as main
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.workspace import Workspace
+from cd2datamanager.tsv_generator import TsvGenerator
+from cd2datamanager.schema_generator import SchemaGenerator
+from cd2datamanager.schema_writer import SchemaWriter
+from cd2datamanager.load_planner import LoadPlanner
+
+from benchmarks.fake_dap import SyntheticDataset, FakeDAPSession, offline_client
+
+app = typer.Typer()
+
+stages = ["schema", "download", "tsv", "sql", "process"]
+
+
+class RssSampler:
+
+    # Samples the resident set size of this process - ru_maxrss only ever grows, so it cannot isolate one stage
+    def __init__(self, interval = 0.01):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.peak = 0
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm", "r") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self._interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+class BenchmarkRunner:
+
+    def __init__(self, dataset, settings, latency_seconds = 0.0):
+        self.dataset = dataset
+        self.settings = settings
+        self.latency_seconds = latency_seconds
+        self.logger = Logger(settings.log_level)
+        self.results = []
+
+        self._client_class = offline_client(dataset, latency_seconds)
+        self._workspace = None
+        self._meta = None
+        self._tsv_details = None
+
+    def measure(self, stage, function, bytes_processed = None, rows = None):
+        with RssSampler() as sampler:
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+
+        bytes_processed = bytes_processed() if callable(bytes_processed) else bytes_processed
+        mb = 1024 * 1024
+
+        result = {
+            "stage": stage,
+            "seconds": round(seconds, 3),
+            "mb": round((bytes_processed or 0) / mb, 1),
+            "mb_per_second": round((bytes_processed or 0) / mb / seconds, 1) if seconds > 0 else None,
+            "rows": rows or 0,
+            "rows_per_second": round((rows or 0) / seconds) if seconds > 0 else None,
+            "peak_rss_mb": round(sampler.peak / mb, 1),
+            "peak_worker_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        }
+
+        self.results.append(result)
+        return result
+
+    def initialize_workspace(self):
+        self._workspace = Workspace(self.logger, self.settings)
+        self._workspace.initialize()
+
+    def sql_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self._workspace.sql) if entry.is_file())
+
+    async def _schema(self):
+        session = FakeDAPSession(self.dataset, self.latency_seconds)
+        for table in self.dataset.tables:
+            schema = await SchemaGenerator(self.logger, "canvas", self.settings, table).initialize(session)
+            schema.table_sql()
+
+    async def _download(self):
+        client = self._client_class(self.logger, self._workspace, self.settings)
+        self._meta = await client.get_tables()
+
+    async def _tsv(self):
+        # The same pipeline process() runs - tables are submitted to the worker processes one by one
+        tsv_generator = TsvGenerator(self.logger, self._workspace, self.settings)
+        tsv_generator.start()
+        for table, asset in self._meta["files"].items():
+            tsv_generator.submit(table, asset)
+
+        self._tsv_details = await tsv_generator.finish()
+
+    async def _sql(self):
+        schema_writer = SchemaWriter(self.logger, self._workspace, self.settings)
+        schema_writer.start()
+        try:
+            sources = {}
+            for table, table_schema in self._meta["schema"].items():
+                tsv_file = self._tsv_details.get(table, None)
+                sources[table] = await schema_writer.write_one(table_schema, tsv_file, table in self._meta["incremental"])
+
+        finally:
+            schema_writer.finish()
+
+        schema_writer.write_control_sql(sources, {table: LoadPlanner.cost(self._tsv_details.get(table, None)) for table in sources})
+
+    def _process(self):
+        self.initialize_workspace()
+
+        # process() builds its own DapClient - point it at the synthetic dataset for the run
+        dap_client = main.DapClient
+        main.DapClient = self._client_class
+        try:
+            asyncio.run(main.process(self.settings))
+        finally:
+            main.DapClient = dap_client
+
+    def run(self, selected_stages):
+        compressed_size = self.dataset.compressed_size
+        total_rows = self.dataset.total_rows
+
+        if "schema" in selected_stages:
+            self.measure("schema", lambda: asyncio.run(self._schema()))
+
+        if any(stage in selected_stages for stage in ["download", "tsv", "sql"]):
+            self.initialize_workspace()
+            self.measure("download", lambda: asyncio.run(self._download()), compressed_size, total_rows)
+
+        if any(stage in selected_stages for stage in ["tsv", "sql"]):
+            self.measure("tsv", lambda: asyncio.run(self._tsv()), compressed_size, total_rows)
+
+        if "sql" in selected_stages:
+            self.measure("sql", lambda: asyncio.run(self._sql()), self.sql_size, total_rows)
+
+        if "process" in selected_stages:
+            self.measure("process", self._process, compressed_size, total_rows)
+
+        return [result for result in self.results if result["stage"] in selected_stages]
+
+
+def print_results(results):
+    columns = ["stage", "seconds", "mb", "mb_per_second", "rows", "rows_per_second", "peak_rss_mb", "peak_worker_rss_mb"]
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(widths[column]) for column in columns))
+
+
+@app.command()
+def benchmark(
+        stage: Annotated[str, typer.Option(help=f"Stages to measure. Semi-colon or comma separated. Values: all, {', '.join(stages)}")] = "all",
+        tables: Annotated[int, typer.Option(help="Number of synthetic tables")] = 4,
+        rows: Annotated[int, typer.Option(help="Rows per table")] = 100000,
+        parts: Annotated[int, typer.Option(help="Gzip parts per table")] = 4,
+        columns: Annotated[int, typer.Option(help="Value columns per table")] = 10,
+        value_width: Annotated[int, typer.Option(help="Characters in every text value - sets the row width")] = 24,
+        latency_ms: Annotated[int, typer.Option(help="Simulated latency of every DAP API call and every object request in milliseconds")] = 0,
+        decompress_workers: Annotated[int, typer.Option(help="Decompress worker processes")] = constants.default_decompress_workers,
+        concurrent_limit: Annotated[int, typer.Option(help="Concurrent download threads")] = constants.default_concurrent_limit,
+        stream_tsv: Annotated[bool, typer.Option(help="Flag to stream the parts straight into the TSV files in the process stage")] = False,
+        data_root: Annotated[str, typer.Option(help="Location of the generated synthetic datasets - reused between runs")] = "./benchmark_data",
+        workspace_root: Annotated[str, typer.Option(help="Workspace used by the measured stages - cleared on every run")] = "./benchmark_workspace",
+        env_locale: Annotated[str, typer.Option(help="The locale setting for output strings and numbers")] = "en_US.UTF-8",
+        output: Annotated[str, typer.Option(help="Location of a JSON file to write the results to")] = None
+    ):
+    selected_stages = stages if stage == "all" else [name for name in stage.replace(',', ';').split(';') if name in stages]
+
+    dataset = SyntheticDataset(data_root, tables, rows, parts, columns, value_width).build()
+
+    settings = Settings(
+        concurrent_limit=concurrent_limit,
+        decompress_workers=decompress_workers,
+        stream_tsv=stream_tsv,
+        log_level=LogLevel.WARNING.name,
+        workspace_root=workspace_root,
+        env_locale=env_locale,
+        metrics_textfile=None,
+        settings_yaml_file=f"{workspace_root}/no_settings.yml")
+
+    results = BenchmarkRunner(dataset, settings, latency_ms / 1000).run(selected_stages)
+
+    print(f"Dataset {dataset.name} - {dataset.compressed_size / (1024 * 1024):,.1f} MB compressed, {dataset.total_rows:,} rows")
+    print_results(results)
+
+    if output is not None:
+        with open(output, "w", encoding="UTF-8") as output_file:
+            json.dump({"dataset": dataset.name, "results": results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,93 @@
+import asyncio
+import copy
+import os
+import yaml
+
+from cd2datamanager.download_budget import DownloadBudget
+from cd2datamanager.schema_cache import SchemaCache
+from cd2datamanager.workspace import Workspace
+
+
+class BatchRunner:
+
+    # Settings that belong to the batch as a whole and can not be changed per instance
+    batch_only_settings = ["batch_yaml_file", "batch_concurrent_limit", "settings_yaml_file", "log_level", "env_locale"]
+
+    def __init__(self, logger, settings):
+        self._logger = logger
+        self._settings = settings
+
+        self.tenants = self._load_yaml(settings.batch_yaml_file)
+        self.budget = DownloadBudget(logger, settings.batch_concurrent_limit)
+
+        # Every instance reads the same CD2 schemas - one cache under the batch workspace root serves them all
+        self.schema_cache = SchemaCache(logger, Workspace(logger, settings), settings)
+
+    def _load_yaml(self, yaml_path) -> dict:
+        with open(yaml_path, 'r') as yaml_file:
+            config = yaml.safe_load(yaml_file)
+
+        instances = config.get("instances", None) if config is not None else None
+        if not instances:
+            raise ValueError(f"No instances listed in batch file {yaml_path}")
+
+        tenants = {}
+        for instance in instances:
+            name = instance["name"] # Want error if this is missing
+            if name in tenants:
+                raise ValueError(f"Instance {name} is listed more than once in batch file {yaml_path}")
+
+            tenants[name] = self.tenant_settings(name, instance, len(instances))
+
+        self._logger.detail(f"Batch of {len(tenants)} Canvas instances: {', '.join(tenants)}")
+        return tenants
+
+    def tenant_settings(self, name, instance, tenant_count):
+        settings = copy.copy(self._settings)
+        settings.batch_yaml_file = None
+
+        settings.dap_yaml_file = instance["dap_yaml"] # Want error if this is missing
+        settings.workspace_root = instance.get("workspace_root", f"{self._settings.workspace_root}/{name}")
+        settings.raw_workspace = instance.get("raw_workspace", None)
+        settings.tsv_workspace = instance.get("tsv_workspace", None)
+        settings.sql_workspace = instance.get("sql_workspace", None)
+
+        # The instances decompress side by side - split the worker processes between them
+        settings.decompress_workers = max(1, (self._settings.decompress_workers or 1) // tenant_count)
+
+        if self._settings.metrics_textfile is not None:
+            textfile_root, textfile_extension = os.path.splitext(self._settings.metrics_textfile)
+            settings.metrics_textfile = f"{textfile_root}_{name}{textfile_extension}"
+
+        for key, value in instance.items():
+            if key in ["name", "dap_yaml", "workspace_root", "raw_workspace", "tsv_workspace", "sql_workspace"]:
+                continue
+
+            if not hasattr(settings, key) or key in self.batch_only_settings:
+                raise ValueError(f"Unknown setting {key} for instance {name}")
+
+            setattr(settings, key, value)
+
+        return settings
+
+    async def run(self, process) -> list:
+        # One event loop for all the instances - downloads draw on the shared budget, schemas on the shared cache
+        results = await asyncio.gather(*(process(settings, self.budget, self.schema_cache) for settings in self.tenants.values()), return_exceptions=True)
+        return self.failed_tables(results)
+
+    def failed_tables(self, results) -> list:
+        failed_tables = []
+        for name, result in zip(self.tenants, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f"Instance {name} failed - {type(result).__name__}: {result}")
+                failed_tables.append(name)
+                continue
+
+            if len(result) > 0:
+                self._logger.error(f"Instance {name} completed with {len(result)} failed tables: {', '.join(result)}")
+            else:
+                self._logger.detail(f"Instance {name} completed")
+
+            failed_tables += [f"{name}.{table_name}" for table_name in result]
+
+        return failed_tables
@@ -3,10 +3,33 @@ from tiberlogger.logger import LogLevel
 default_root_workspace = "./workspace"
 default_semaphore_timeout_seconds = 120
 default_concurrent_limit = 10
+default_min_concurrent_limit = 1
+default_schema_concurrent_limit = 8
+default_batch_concurrent_limit = 20
+default_memory_budget_mb = 0
+default_sql_workers = 4
+concurrency_cooldown_seconds = 30
 default_max_download_attempts = 5
 default_max_lock_attempts = 5
 default_sleep_between_attempts_seconds = 1
+default_max_retry_delay_seconds = 300
+default_retry_budget = 50
+default_throttle_delay_seconds = 30
 default_thread_pause = .25
+default_decompress_workers = 2
+default_tsv_shard_size_mb = 0
+default_tsv_compression_level = 3
+default_tsv_compression_threads = 4
+default_profile_margin_percent = 25
+profile_max_varchar_length = 2048
+profile_row_size_budget = 32768
+
+output_format_tsv = "tsv"
+output_format_parquet = "parquet"
+output_format_jsonl = "jsonl"
+default_output_format = output_format_tsv
+default_parquet_row_group_rows = 100000
+default_parquet_compression = "snappy"
 
 default_namespace = "canvas"
 default_api_url = "https://api-gateway.instructure.com"
@@ -15,7 +38,65 @@ default_log_level = LogLevel.DETAIL
 
 default_settings_yaml = "./defaults.yml"
 default_dap_yaml="./canvas.yml"
+default_mysql_yaml = "./mysql.yml"
+
+default_mysql_host = "localhost"
+default_mysql_port = 3306
+default_load_concurrent_limit = 4
 
 tsv_detail_row_count = "row_count"
 tsv_detail_file = "file"
 tsv_detail_headers = "headers"
+tsv_detail_shards = "shards"
+tsv_detail_profile = "profile"
+tsv_detail_integrity = "integrity"
+tsv_meta_action_field = "meta.action"
+
+incremental_state_file = "incremental_state.yml"
+schema_cache_directory = "schema_cache"
+integrity_directory = "integrity"
+
+run_manifest_file = "run_manifest.json"
+run_report_json_file = "run_report.json"
+run_report_csv_file = "run_report.csv"
+manifest_stage_download = "download"
+manifest_stage_tsv = "tsv"
+manifest_stage_sql = "sql"
+load_session_prefix = "load_session_"
+load_plan_file = "load_plan.json"
+load_table_cost_bytes = 64 * 1024
+load_row_cost_bytes = 64
+load_compression_ratio = 4
+lifecycle_stage_schema = "schema"
+lifecycle_stage_download = "download"
+lifecycle_stage_tsv = "tsv"
+lifecycle_table_state_bytes = 1024 * 1024
+lifecycle_converted_row_bytes = 256
+incremental_staging_suffix = "__incremental"
+incremental_action_column = "cd2_action"
+
+tsv_copy_block_size = 4 * 1024 * 1024
+compressed_read_block_size = 1024 * 1024
+tsv_compression_block_size = 4 * 1024 * 1024
+stream_part_concurrency = 4
+stream_prefetch_blocks = 2
+tsv_fifo_extension = ".fifo"
+
+tsv_compression_none = "none"
+tsv_compression_gzip = "gzip"
+tsv_compression_zstd = "zstd"
+
+integrity_expected_parts = "expected_parts"
+integrity_parts = "parts"
+integrity_source = "source"
+integrity_bytes = "bytes"
+integrity_sha256 = "sha256"
+integrity_rows = "rows"
+integrity_error = "error"
+
+profile_max_length = "max_length"
+profile_nulls = "nulls"
+profile_values = "values"
+profile_integer_digits = "integer_digits"
+profile_scale = "scale"
+profile_is_decimal = "is_decimal"
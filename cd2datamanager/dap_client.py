@@ -1,25 +1,39 @@
 import asyncio
+import time
 import yaml
 
 import cd2datamanager.constants as constants
 
 from tqdm import tqdm
 from dap.api import DAPClient, DAPSession
-from dap.dap_types import Credentials, Format, SnapshotQuery, Mode
+from dap.dap_types import Credentials, Format, SnapshotQuery, IncrementalQuery, Mode, DownloadTableDataResult
+from dap.dap_error import SnapshotRequiredError
 
 from cd2datamanager.semaphore_control import SemaphoreControl
 from cd2datamanager.schema_generator import SchemaGenerator
+from cd2datamanager.schema_cache import SchemaCache
+from cd2datamanager.table_scheduler import TableScheduler
+from cd2datamanager.run_metrics import RunMetrics
+from cd2datamanager.retry_policy import RetryPolicy
 
 
 class DapClient:
 
-    def __init__(self, logger, workspace, settings):
+    def __init__(self, logger, workspace, settings, incremental_state=None, manifest=None, metrics=None, budget=None, schema_cache=None):
         self.url = constants.default_api_url
         self.namespace = constants.default_namespace
 
         self._logger = logger
         self._settings = settings
         self._workspace = workspace
+        self._incremental_state = incremental_state
+        self._manifest = manifest
+        self._metrics = metrics
+        self._retry_policy = RetryPolicy(logger, settings)
+        self._budget = budget
+        self._schema_cache = (schema_cache or SchemaCache(logger, workspace, settings)) if settings.schema_cache else None
+        self._schema_tasks = dict()
+        self._lifecycle = None
 
         self.client_id = None
         self.client_secret = None
@@ -66,54 +80,102 @@ class DapClient:
     def connect(self) -> DAPSession:
         return DAPClient(self.url, self.credentials)
 
-    async def get_tables(self) -> dict:
+    def record_failure(self, table_name, error, attempts):
+        self._retry_policy.record_failure(table_name, error, attempts)
+
+    def log_failures(self):
+        # Once every stage of the run has recorded its failures
+        self._retry_policy.log_summary()
+        if self._metrics is not None:
+            self._metrics.set("failed_tables", len(self._retry_policy.failures))
+
+    async def get_tables(self, on_table_downloaded=None, table_streamer=None, table_names=None, lifecycle=None) -> dict:
         self._logger.detail("Start tables downloaded")
-        job_table = dict()
-        table_schema = dict()
 
-        semaphore = SemaphoreControl(self._settings, self._logger)
+        # With a lifecycle the tables are dropped from these as soon as they complete
+        self._lifecycle = lifecycle
+        job_table = lifecycle.files if lifecycle is not None else dict()
+        table_schema = lifecycle.schema if lifecycle is not None else dict()
+        incremental_tables = lifecycle.incremental if lifecycle is not None else set()
+
+        semaphore = SemaphoreControl(self._settings, self._logger, self._budget)
+        schema_semaphore = asyncio.Semaphore(max(1, self._settings.schema_concurrent_limit or 1))
 
         async with self.connect() as session:
-            tables = await self.table_list(session)
+            tables = TableScheduler(self._logger, self._settings, self._manifest).order(table_names if table_names is not None else await self.table_list(session))
+            if lifecycle is not None:
+                lifecycle.schedule(tables)
+
             pbar = tqdm(total=len(tables)) if not self._logger.is_debug else None
 
             async with asyncio.TaskGroup() as tg:
-                [await self.build_task(tg, session, semaphore, table, pbar, job_table, table_schema) for table in tables]
+                # Schemas are fetched on their own small limit so they never hold up a download slot
+                if not self._settings.no_schema:
+                    self._schema_tasks = {table: tg.create_task(self.fetch_schema(session, schema_semaphore, table, table_schema, pbar)) for table in tables}
+
+                if not self._settings.schema_only:
+                    [await self.build_task(tg, session, semaphore, table, pbar, job_table, table_schema, on_table_downloaded, incremental_tables, table_streamer) for table in tables]
 
             if pbar is not None:
                 pbar.close()
 
+            # Keep the scheduled table order whatever order the schemas arrived in
+            for table in [table for table in tables if table in table_schema]:
+                table_schema[table] = table_schema.pop(table)
+
+            self._schema_tasks = dict()
+            self._lifecycle = None
+
+            # A table without data must not be dropped and recreated empty by the SQL scripts
+            failed_tables = [table_name for table_name in self._retry_policy.failures if table_name in table_schema]
+            [table_schema.pop(table_name) for table_name in failed_tables]
+
+            self._logger.detail(f"Download concurrency ended at {semaphore.limit} - peak {semaphore.peak_limit}, {semaphore.throttle_count} throttled and {semaphore.error_count} failed requests")
+            if self._metrics is not None:
+                self._metrics.set("download_concurrency_limit", semaphore.limit)
+                self._metrics.set("download_concurrency_peak", semaphore.peak_limit)
+                self._metrics.set("download_throttled_requests", semaphore.throttle_count)
+                self._metrics.set("download_failed_requests", semaphore.error_count)
+                self._metrics.set("download_retries", self._retry_policy.retries)
+
             self._logger.detail("Completed tables downloaded")
 
         return {
             'schema': table_schema,
-            'files': job_table
+            'files': job_table,
+            'incremental': incremental_tables,
+            'failed': self._retry_policy.failures
         }
 
-    async def build_task(self, tg, session, semaphore, table_name, pbar, job_table, schema):
+    async def build_task(self, tg, session, semaphore, table_name, pbar, job_table, schema, on_table_downloaded=None, incremental_tables=None, table_streamer=None):
+        if self._lifecycle is not None:
+            # Waits for memory to free up before the table is downloaded
+            await self._lifecycle.admit(table_name)
+
         attempt = 0
         while True:
             try:
+                wait_start = time.perf_counter()
                 await asyncio.wait_for(semaphore.acquire(), timeout=self._settings.semaphore_timeout_seconds)
                 self._logger.debug(f"Semaphore lock obtained for table {table_name} - attempt {attempt + 1}")
+                if self._metrics is not None:
+                    self._metrics.add(table_name, "download", semaphore_wait_seconds=time.perf_counter() - wait_start)
 
-                if not self._settings.no_schema:
-                    schema[table_name] = await SchemaGenerator(self._logger, self.namespace, self._settings, table_name).initialize(session)
-
-                if not self._settings.schema_only:
-                    tg.create_task(self.download_table(session, semaphore, table_name, pbar, job_table))
-                    await asyncio.sleep(self._settings.thread_pause)
-                else:
-                    await semaphore.release() # Release semaphore since we are not downloading the data
-                    if pbar is not None:
-                        pbar.update(1)
-
+                # The semaphore is the admission control - the next table starts as soon as a download slot frees up
+                tg.create_task(self.download_table(session, semaphore, table_name, pbar, job_table, on_table_downloaded, incremental_tables, schema, table_streamer))
                 break
 
             except asyncio.TimeoutError:
                 attempt += 1
+                if self._metrics is not None:
+                    self._metrics.add(table_name, "download", semaphore_wait_seconds=time.perf_counter() - wait_start)
+
                 if attempt >= self._settings.max_lock_attempts:
                     self._logger.error(f"Timed out waiting for semaphore lock for table {table_name} - semaphore count {semaphore.active_semaphores}")
+                    self._retry_policy.record_failure(table_name, asyncio.TimeoutError("Timed out waiting for a download slot"), attempt)
+                    if self._lifecycle is not None:
+                        await self._lifecycle.discard(table_name)
+
                     if pbar is not None:
                         pbar.update(1)
                     break
@@ -122,39 +184,136 @@ class DapClient:
                     self._logger.debug(f"Unable to obtain semaphore lock for {table_name} - attempt {attempt}")
                     await asyncio.sleep(self._settings.sleep_between_attempts_seconds)
 
-    async def download_table(self, session, semaphore, table_name, pbar, job_table):
+    async def fetch_schema(self, session, schema_semaphore, table_name, schema, pbar):
+        async with schema_semaphore:
+            schema_start = time.perf_counter()
+            schema[table_name] = await SchemaGenerator(self._logger, self.namespace, self._settings, table_name).initialize(session, self._schema_cache)
+
+        if self._lifecycle is not None:
+            self._lifecycle.schema_ready(table_name)
+
+        if self._metrics is not None:
+            self._metrics.add(table_name, "schema", seconds=time.perf_counter() - schema_start)
+
+        if self._settings.schema_only and pbar is not None:
+            pbar.update(1)
+
+    async def verify_schema_version(self, session, table_name, asset, schema):
+        # The download can finish before its schema arrives - wait for it before comparing versions
+        schema_task = self._schema_tasks.get(table_name, None)
+        if schema_task is not None:
+            await schema_task
+
+        schema_generator = schema.get(table_name, None) if schema is not None else None
+        if schema_generator is None or schema_generator.version == asset.schema_version:
+            return
+
+        self._logger.detail(f"Schema for {table_name} changed from version {schema_generator.version} to {asset.schema_version} - refreshing")
+        try:
+            await schema_generator.refresh(session, self._schema_cache)
+        except Exception as e:
+            self._logger.error(f"Failed to refresh schema for {table_name} - {e}")
+
+    def build_query(self, table_name):
+        since = self._incremental_state.since(self.namespace, table_name) if self._incremental_state is not None else None
+        if since is None:
+            return SnapshotQuery(format=Format.TSV, filter=None, mode=Mode.condensed)
+
+        self._logger.debug(f"Requesting changes to table {table_name} since {since.isoformat()}")
+        return IncrementalQuery(format=Format.TSV, filter=None, mode=Mode.condensed, since=since, until=None)
+
+    def downloaded_size(self, table_name, asset) -> int:
+        size = RunMetrics.file_size(asset.downloaded_files)
+        if size == 0 and self._manifest is not None:
+            # Streamed tables keep no raw files - the manifest holds the size that was streamed
+            size = self._manifest.expected_size(table_name) or 0
+
+        return size
+
+    async def stream_table_data(self, session, table_name, query, table_streamer):
+        table_data = await session.get_table_data(self.namespace, table_name, query)
+        asset = DownloadTableDataResult(table_data.schema_version, table_data.timestamp, table_data.job_id, [])
+
+        # Recorded before streaming so the TSV stage can be recorded against it
+        if self._manifest is not None:
+            self._manifest.record_download(table_name, asset, isinstance(query, IncrementalQuery))
+
+        await table_streamer(session, table_name, table_data)
+        return asset
+
+    async def download_table(self, session, semaphore, table_name, pbar, job_table, on_table_downloaded=None, incremental_tables=None, schema=None, table_streamer=None):
         self._logger.debug(f"Start downloading table {table_name}")
+        download_start = time.perf_counter()
         attempt = 0
+        asset = self._manifest.downloaded_asset(table_name) if self._manifest is not None else None
+        query = self.build_query(table_name)
 
-        while True:
+        if asset is not None:
+            self._logger.debug(f"Table {table_name} already downloaded - reusing files from the run manifest")
+            job_table[table_name] = asset
+            if self._manifest.is_incremental(table_name) and incremental_tables is not None:
+                incremental_tables.add(table_name)
+
+        while asset is None:
             try:
-                asset = await session.download_table_data(
-                    self.namespace,
-                    table_name,
-                    SnapshotQuery(format=Format.TSV, filter=None, mode=Mode.condensed),
-                    self._workspace.raw)
+                if table_streamer is not None:
+                    asset = await self.stream_table_data(session, table_name, query, table_streamer)
+                else:
+                    asset = await session.download_table_data(
+                        self.namespace,
+                        table_name,
+                        query,
+                        self._workspace.raw)
+
+                    if self._manifest is not None:
+                        self._manifest.record_download(table_name, asset, isinstance(query, IncrementalQuery))
+
+                if isinstance(query, IncrementalQuery) and incremental_tables is not None:
+                    incremental_tables.add(table_name)
 
                 self._logger.debug(f"Table {table_name} downloaded - attempt {attempt + 1}")
-                async with asyncio.Lock():
-                    try:
-                        job_table[table_name] = asset
-                    except Exception as e:
-                        self._logger.error(f"Failed to load table {table_name} meta data - {e}")
+                job_table[table_name] = asset
+                await semaphore.record_success(self.downloaded_size(table_name, asset))
 
                 break
 
             except Exception as e:
+                if isinstance(e, SnapshotRequiredError) and isinstance(query, IncrementalQuery):
+                    self._logger.warning(f"Table {table_name} requires a new snapshot - falling back from incremental query -> {e}")
+                    query = SnapshotQuery(format=Format.TSV, filter=None, mode=Mode.condensed)
+                    continue
+
+                await semaphore.record_error(e)
                 attempt += 1
-                if attempt >= self._settings.max_download_attempts:
+                if not self._retry_policy.should_retry(table_name, attempt, e):
                     self._logger.error(f"Error: Unable to download table {table_name} [Attempts {attempt}]\nError:\n{e}")
+                    self._retry_policy.record_failure(table_name, e, attempt)
                     break
 
-                else:
-                    self._logger.debug(f"Failed to download table {table_name} attempt {attempt} -> {e}")
-                    await asyncio.sleep(self._settings.sleep_between_attempts_seconds)
+                # Give the slot up while backing off so other tables keep downloading
+                await semaphore.release()
+                await self._retry_policy.wait(table_name, attempt, e)
+                await semaphore.acquire()
 
         await semaphore.release()
         if pbar is not None:
             pbar.update(1)
 
+        if self._metrics is not None:
+            self._metrics.add(
+                table_name,
+                "download",
+                seconds=time.perf_counter() - download_start,
+                bytes_out=RunMetrics.file_size(asset.downloaded_files) if asset is not None else None,
+                retries=attempt)
+
+        if asset is not None:
+            await self.verify_schema_version(session, table_name, asset, schema)
+
+        if asset is not None and on_table_downloaded is not None:
+            on_table_downloaded(table_name, asset)
+
+        if asset is None and self._lifecycle is not None:
+            await self._lifecycle.discard(table_name)
+
         self._logger.debug(f"Completed downloading table {table_name}")
@@ -0,0 +1,42 @@
+import asyncio
+
+
+class DownloadBudget:
+
+    # Download slots shared by every tenant of a batch - a free slot goes to the waiting tenant with the fewest slots in use
+    def __init__(self, logger, limit):
+        self._logger = logger
+        self.limit = max(1, limit)
+
+        self.active = {}
+        self.waiting = {}
+        self._condition = asyncio.Condition()
+
+    @property
+    def active_slots(self) -> int:
+        return sum(self.active.values())
+
+    def _is_turn(self, tenant) -> bool:
+        if self.active_slots >= self.limit:
+            return False
+
+        fewest = min(self.active.get(waiting_tenant, 0) for waiting_tenant, count in self.waiting.items() if count > 0)
+        return self.active.get(tenant, 0) <= fewest
+
+    async def acquire(self, tenant):
+        async with self._condition:
+            self.waiting[tenant] = self.waiting.get(tenant, 0) + 1
+            try:
+                await self._condition.wait_for(lambda: self._is_turn(tenant))
+            finally:
+                # A waiter that leaves - granted or timed out - changes whose turn it is
+                self.waiting[tenant] -= 1
+                self._condition.notify_all()
+
+            self.active[tenant] = self.active.get(tenant, 0) + 1
+            self._logger.debug(f"Shared download slot acquired - {self.active_slots} of {self.limit} in use")
+
+    async def release(self, tenant):
+        async with self._condition:
+            self.active[tenant] -= 1
+            self._condition.notify_all()
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os.path
+import re
+import cd2datamanager.constants as constants
+
+from concurrent.futures import ProcessPoolExecutor
+from cd2datamanager.settings import Settings
+from cd2datamanager.tsv_writer import TsvShardWriter, TsvHeader
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+class FormatConverter:
+
+    escape_sequences = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v", "\\": "\\"}
+    escape_pattern = re.compile(r"\\(.)")
+
+    def __init__(self, logger, workspace, settings):
+        self._logger = logger
+        self._workspace = workspace
+        self._settings = settings
+
+        self._executor = None
+
+    @property
+    def output_format(self) -> str:
+        return self._settings.output_format.lower()
+
+    @property
+    def workers(self) -> int:
+        return max(1, self._settings.decompress_workers or 1)
+
+    def output_file(self, table) -> str:
+        return os.path.abspath(f"{self._workspace.converted}/{table}.{self.output_format}")
+
+    def table_arguments(self, table, table_schema, tsv_file) -> tuple:
+        # Handed to the worker processes, so plain values only
+        return (
+            self.output_format,
+            [shard[constants.tsv_detail_file] for shard in TsvShardWriter.shard_details(tsv_file)],
+            self.output_file(table),
+            self.column_types(table_schema),
+            self._settings.parquet_row_group_rows,
+            self._settings.parquet_compression)
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def convert_one(self, table, table_schema, tsv_file):
+        # Converts a single table on the workers started by start() while other tables are still downloading
+        try:
+            details = await asyncio.get_running_loop().run_in_executor(self._executor, FormatConverter.convert_table, *self.table_arguments(table, table_schema, tsv_file))
+            self._logger.debug(f"Converted {table} - {Settings.readable_number(details[constants.tsv_detail_row_count])} rows into {details[constants.tsv_detail_file]}")
+            return details
+
+        except Exception as e:
+            self._logger.error(f"Error: Unable to convert table {table} to {self.output_format}\nError:\n{e}")
+            raise
+
+    def finish(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def column_types(schema) -> dict:
+        # Same SQL types the create scripts use, so every output format agrees on the column types
+        if schema is None or schema.schema_object is None:
+            return {}
+
+        return {name: column.sql_type for name, column in schema.column_model.items()}
+
+    @staticmethod
+    def arrow_type(sql_type):
+        import pyarrow
+
+        sql_type = (sql_type or "").upper()
+        if sql_type == "BIGINT":
+            return pyarrow.int64()
+
+        if sql_type == "INT":
+            return pyarrow.int32()
+
+        if sql_type == "TINYINT":
+            return pyarrow.bool_()
+
+        if sql_type == "DOUBLE":
+            return pyarrow.float64()
+
+        if sql_type == "DATETIME":
+            return pyarrow.timestamp("us", tz="UTC")
+
+        if sql_type.startswith("DECIMAL"):
+            precision, scale = [int(value) for value in sql_type[sql_type.index("(") + 1:sql_type.index(")")].split(",")]
+            return pyarrow.decimal128(precision, scale) if precision <= 38 else pyarrow.decimal256(precision, scale)
+
+        return pyarrow.string()
+
+    @staticmethod
+    def json_value(sql_type, value):
+        if value is None:
+            return None
+
+        sql_type = (sql_type or "").upper()
+        if sql_type in ("BIGINT", "INT"):
+            return int(value) if len(value) > 0 else None
+
+        if sql_type == "TINYINT":
+            return value.lower() == "true" if len(value) > 0 else None
+
+        if sql_type == "DOUBLE":
+            return float(value) if len(value) > 0 else None
+
+        # A float would round DECIMAL(63, 30) - keep the digits as they are
+        if sql_type.startswith("DECIMAL"):
+            return value if len(value) > 0 else None
+
+        if sql_type == "DATETIME":
+            return value if len(value) > 0 else None
+
+        return value
+
+    @staticmethod
+    def unescape(value):
+        if value == "\\N":
+            return None
+
+        if "\\" not in value:
+            return value
+
+        return FormatConverter.escape_pattern.sub(lambda match: FormatConverter.escape_sequences.get(match.group(1), match.group(1)), value)
+
+    @staticmethod
+    def read_rows(tsv_files):
+        # Streams the rows one at a time so memory does not grow with the table size
+        for index, tsv_file in enumerate(tsv_files):
+            with TsvCompression.open_reader(tsv_file) as source:
+                # Every shard repeats the header line - only the first one names the columns
+                header = TsvHeader.parse(source.readline().decode("UTF-8"))
+                if index == 0:
+                    yield [field.name for field in TsvHeader.fields(header)]
+
+                for line in source:
+                    yield [FormatConverter.unescape(value) for value in line.decode("UTF-8").rstrip("\r\n").split("\t")]
+
+    @staticmethod
+    def convert_table(output_format, tsv_files, output_file, column_types, row_group_rows, compression) -> dict:
+        # Runs inside the worker processes, so it can only use picklable arguments and no logger
+        rows = FormatConverter.read_rows(tsv_files)
+        columns = next(rows, [])
+
+        if output_format == constants.output_format_parquet:
+            row_count = FormatConverter.write_parquet(rows, columns, column_types, output_file, row_group_rows, compression)
+        elif output_format == constants.output_format_jsonl:
+            row_count = FormatConverter.write_jsonl(rows, columns, column_types, output_file)
+        else:
+            raise ValueError(f"Unsupported output format {output_format}")
+
+        return {
+            constants.tsv_detail_headers: columns,
+            constants.tsv_detail_file: output_file,
+            constants.tsv_detail_row_count: row_count
+        }
+
+    @staticmethod
+    def write_jsonl(rows, columns, column_types, output_file) -> int:
+        types = [column_types.get(column, None) for column in columns]
+
+        row_count = 0
+        with open(output_file, 'w', encoding="UTF-8", buffering=constants.tsv_copy_block_size) as jsonl_file:
+            for row in rows:
+                record = {column: FormatConverter.json_value(sql_type, value) for column, sql_type, value in zip(columns, types, row)}
+                jsonl_file.write(json.dumps({key: value for key, value in record.items() if value is not None}))
+                jsonl_file.write("\n")
+                row_count += 1
+
+        return row_count
+
+    @staticmethod
+    def write_parquet(rows, columns, column_types, output_file, row_group_rows, compression) -> int:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet output requires pyarrow - install it with 'pip install cd2datamanager[parquet]'") from e
+
+        schema = pyarrow.schema([(column, FormatConverter.arrow_type(column_types.get(column, None))) for column in columns])
+        typed_columns = [column for column in columns if schema.field(column).type != pyarrow.string()]
+
+        row_count = 0
+        with pyarrow.parquet.ParquetWriter(output_file, schema, compression=compression) as writer:
+            row_group = [[] for _ in columns]
+            for row in rows:
+                [row_group[index].append(value) for index, value in enumerate(row)]
+                row_count += 1
+
+                if len(row_group[0]) >= row_group_rows:
+                    FormatConverter.write_row_group(writer, schema, row_group, typed_columns)
+                    row_group = [[] for _ in columns]
+
+            if len(columns) > 0 and len(row_group[0]) > 0:
+                FormatConverter.write_row_group(writer, schema, row_group, typed_columns)
+
+        return row_count
+
+    @staticmethod
+    def write_row_group(writer, schema, row_group, typed_columns):
+        import pyarrow
+
+        arrays = []
+        for field, values in zip(schema, row_group):
+            if field.name in typed_columns:
+                # Typed columns treat an empty value as NULL, the same as the SQL loader
+                values = [value if value is not None and len(value) > 0 else None for value in values]
+
+            arrays.append(pyarrow.array(values, type=pyarrow.string()).cast(field.type))
+
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
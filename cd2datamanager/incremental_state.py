@@ -0,0 +1,58 @@
+import os
+import yaml
+
+from datetime import datetime, timezone
+
+
+class IncrementalState:
+
+    def __init__(self, logger, workspace):
+        self._logger = logger
+        self._state_file = workspace.incremental_state
+
+        self.watermarks = self._load_yaml(self._state_file)
+
+    def _load_yaml(self, yaml_path) -> dict:
+        if not os.path.exists(yaml_path):
+            self._logger.detail(f"No incremental state found at {yaml_path} - tables will be pulled as snapshots")
+            return dict()
+
+        with open(yaml_path, 'r') as yaml_file:
+            config = yaml.safe_load(yaml_file)
+
+        return config if config is not None else dict()
+
+    def since(self, namespace, table_name):
+        watermark = self.watermarks.get(namespace, {}).get(table_name, None)
+        if watermark is None:
+            return None
+
+        if not isinstance(watermark, datetime):
+            watermark = datetime.fromisoformat(str(watermark))
+
+        return watermark if watermark.tzinfo is not None else watermark.replace(tzinfo=timezone.utc)
+
+    def update(self, namespace, table_name, timestamp):
+        if timestamp is None:
+            return
+
+        self.watermarks.setdefault(namespace, {})[table_name] = timestamp.isoformat()
+
+    def update_from_run(self, namespace, timestamps, load_results = None):
+        # Only the tables that completed carry a timestamp
+        for table_name, timestamp in timestamps.items():
+            if load_results is not None and not load_results.get(table_name, {}).get('success', False):
+                self._logger.warning(f"Table {table_name} failed to load - incremental watermark not advanced")
+                continue
+
+            self.update(namespace, table_name, timestamp)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._state_file)), exist_ok=True)
+
+        temp_file = f"{self._state_file}.tmp"
+        with open(temp_file, 'w') as yaml_file:
+            yaml.safe_dump(self.watermarks, yaml_file, default_flow_style=False)
+
+        os.replace(temp_file, self._state_file)
+        self._logger.detail(f"Incremental state saved to {os.path.abspath(self._state_file)}")
@@ -0,0 +1,97 @@
+import json
+import os
+
+import cd2datamanager.constants as constants
+
+from datetime import datetime
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class IntegrityCheck:
+
+    # Checks the parts against what was recorded independently of the decompression - the job's object list, the gzip trailers
+    # and the downloaded sizes. The data is not read again
+    def __init__(self, logger, workspace, settings, manifest=None):
+        self._logger = logger
+        self._workspace = workspace
+        self._settings = settings
+        self._manifest = manifest
+
+        self.corrupt_tables = dict()
+
+    def integrity_file(self, table_name) -> str:
+        return f"{self._workspace.integrity}/{table_name}.json"
+
+    def verify(self, table_name, tsv_details, source_files = None) -> list:
+        integrity = tsv_details.get(constants.tsv_detail_integrity, None)
+        if integrity is None:
+            return []
+
+        parts = integrity[constants.integrity_parts]
+
+        part_count_problems = []
+        if len(parts) != integrity[constants.integrity_expected_parts]:
+            part_count_problems.append(f"{len(parts)} of {integrity[constants.integrity_expected_parts]} parts decompressed")
+
+        stream_problems = [f"Part {part[constants.integrity_source]} is corrupt - {part[constants.integrity_error]}" for part in parts if part[constants.integrity_error] is not None]
+
+        # Streamed parts never land on disk and DAP reports no object sizes, so there is nothing to compare their bytes with
+        size_problems = self.verify_sizes(table_name, parts, source_files) if source_files is not None else None
+
+        checks = [
+            self.check_result("part_count", "the objects CD2 listed for the job", part_count_problems),
+            self.check_result("gzip_stream", "the CRC and length trailer of every gzip member", stream_problems),
+            self.check_result("part_size", "the size on disk and the size recorded when the download completed", size_problems),
+            # The TSV row count is taken from the same rows the parts were counted from - only the load can confirm it
+            self.check_result("row_count", "the rows LOAD DATA reports - verified by --load-database", None)
+        ]
+
+        problems = part_count_problems + stream_problems + (size_problems or [])
+        self.write(table_name, tsv_details, integrity, checks, problems)
+
+        if len(problems) > 0:
+            self.corrupt_tables[table_name] = problems
+            self._logger.error(f"Table {table_name} failed the integrity check:")
+            [self._logger.error(f"{' '.ljust(6, ' ')}{problem}") for problem in problems]
+
+        return problems
+
+    @staticmethod
+    def check_result(check, compared_with, problems) -> dict:
+        return {
+            "check": check,
+            "compared_with": compared_with,
+            "status": "not_checked" if problems is None else "failed" if len(problems) > 0 else "ok"
+        }
+
+    def verify_sizes(self, table_name, parts, source_files) -> list:
+        # The recorded size is what landed on disk when the download completed
+        recorded_sizes = self._manifest.downloaded_sizes(table_name) if self._manifest is not None else {}
+        problems = []
+
+        for source_file, part in zip(source_files, parts):
+            file_size = os.path.getsize(source_file) if os.path.exists(source_file) else None
+            recorded_size = recorded_sizes.get(os.path.abspath(source_file), file_size)
+
+            if part[constants.integrity_bytes] != file_size or file_size != recorded_size:
+                problems.append(f"Part {part[constants.integrity_source]} read {part[constants.integrity_bytes]} bytes - {file_size} on disk, {recorded_size} downloaded")
+
+        return problems
+
+    def write(self, table_name, tsv_details, integrity, checks, problems):
+        os.makedirs(self._workspace.integrity, exist_ok=True)
+
+        with open(self.integrity_file(table_name), 'w', encoding="UTF-8") as json_file:
+            json.dump({
+                "table": table_name,
+                "checked": datetime.utcnow().isoformat(),
+                "status": "corrupt" if len(problems) > 0 else "ok",
+                "row_count": tsv_details[constants.tsv_detail_row_count],
+                "expected_parts": integrity[constants.integrity_expected_parts],
+                "checks": checks,
+                "parts": integrity[constants.integrity_parts],
+                "problems": problems
+            }, json_file, indent=2)
@@ -0,0 +1,71 @@
+import heapq
+import os
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.tsv_writer import TsvShardWriter
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+class LoadPlanner:
+
+    # Spreads the table scripts over the load sessions so they finish at about the same time - largest table first, always onto the least loaded session
+    def __init__(self, logger, settings):
+        self._logger = logger
+        self._settings = settings
+
+    @property
+    def session_count(self) -> int:
+        return max(1, self._settings.load_concurrent_limit or 1)
+
+    @staticmethod
+    def cost(tsv_file) -> int:
+        # Estimated in bytes loaded - the TSV bytes (uncompressed estimate) plus a per row and a per table overhead
+        if tsv_file is None:
+            return constants.load_table_cost_bytes
+
+        tsv_bytes = 0
+        for shard in TsvShardWriter.shard_details(tsv_file):
+            shard_file = shard[constants.tsv_detail_file]
+            shard_size = os.path.getsize(shard_file) if os.path.exists(shard_file) else 0
+            tsv_bytes += shard_size * constants.load_compression_ratio if TsvCompression.compression_of(shard_file) is not None else shard_size
+
+        return constants.load_table_cost_bytes + tsv_bytes + (tsv_file.get(constants.tsv_detail_row_count, None) or 0) * constants.load_row_cost_bytes
+
+    def plan(self, costs) -> list:
+        sessions = [[] for _ in range(min(self.session_count, max(1, len(costs))))]
+        session_loads = [(0, index) for index in range(len(sessions))]
+
+        # Ties are broken by table name, so the same data always gives the same plan
+        for table_name in sorted(costs, key=lambda name: (-costs[name], name)):
+            load, index = heapq.heappop(session_loads)
+            sessions[index].append(table_name)
+            heapq.heappush(session_loads, (load + costs[table_name], index))
+
+        return sessions
+
+    @staticmethod
+    def waves(sessions, costs) -> list:
+        # Wave n holds the n-th script of every session - they start together when the sessions are started together
+        waves = []
+        for session_index, session in enumerate(sessions):
+            start = 0
+            for wave_index, table_name in enumerate(session):
+                if wave_index >= len(waves):
+                    waves.append([])
+
+                waves[wave_index].append({
+                    "table": table_name,
+                    "session": session_index + 1,
+                    "cost": costs[table_name],
+                    "start": start,
+                    "finish": start + costs[table_name]
+                })
+                start += costs[table_name]
+
+        return waves
+
+    def log_plan(self, sessions, costs):
+        self._logger.detail(f"Load plan - {len(sessions)} sessions:")
+        for session_index, session in enumerate(sessions):
+            self._logger.detail(f"{' '.ljust(6, ' ')}Session {session_index + 1}: {len(session)} tables, {sum(costs[table_name] for table_name in session) // (1024 * 1024)} MB estimated")
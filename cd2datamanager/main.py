@@ -11,7 +11,12 @@ from cd2datamanager.tsv_generator import TsvGenerator
 from cd2datamanager.dap_client import DapClient
 from cd2datamanager.settings import Settings
 from cd2datamanager.workspace import Workspace
-from cd2datamanager.schema_writer import SchemaWriter
+from cd2datamanager.incremental_state import IncrementalState
+from cd2datamanager.run_manifest import RunManifest
+from cd2datamanager.run_metrics import RunMetrics
+from cd2datamanager.integrity_check import IntegrityError
+from cd2datamanager.batch_runner import BatchRunner
+from cd2datamanager.table_lifecycle import TableLifecycle
 
 
 app = Typer()
@@ -31,17 +36,42 @@ def display_title(logger):
 
 @app.command()
 def extract(
-        concurrent_limit: Annotated[int, typer.Option(help="Max concurrent download threads")] = constants.default_concurrent_limit,
+        concurrent_limit: Annotated[int, typer.Option(help="Concurrent download threads to start with")] = constants.default_concurrent_limit,
+        adaptive_concurrency: Annotated[bool, typer.Option(help="Flag to raise the download concurrency while throughput improves and lower it when the API throttles or downloads fail")] = True,
+        min_concurrent_limit: Annotated[int, typer.Option(help="Lowest download concurrency the adaptive limit backs off to")] = constants.default_min_concurrent_limit,
+        max_concurrent_limit: Annotated[int, typer.Option(help="Highest download concurrency the adaptive limit grows to - defaults to --concurrent-limit, so the limit only backs off")] = None,
+        schema_concurrent_limit: Annotated[int, typer.Option(help="Number of table schemas fetched at the same time. Schemas are fetched alongside the downloads")] = constants.default_schema_concurrent_limit,
         max_download_attempts: Annotated[int, typer.Option(help="Number of time to attempt to download a table if an error occurs before aborting or skipping table")] = constants.default_max_download_attempts,
         semaphore_timeout_seconds: Annotated[int, typer.Option(help="Number of seconds to wait for a semaphore lock before aborting or trying again")] = constants.default_semaphore_timeout_seconds,
         max_lock_attempts: Annotated[int, typer.Option(help="Number of attempts allowed for grabbing a semaphore lock before throwing error")] = constants.default_max_lock_attempts,
-        sleep_between_attempts_seconds: Annotated[int, typer.Option(help="Number of seconds to pause when a thread receives and error before attempting again")] = constants.default_sleep_between_attempts_seconds,
-        thread_pause: Annotated[int, typer.Option(help="Number of seconds to pause between download thread starts.")] = constants.default_thread_pause,
+        sleep_between_attempts_seconds: Annotated[int, typer.Option(help="Base number of seconds to back off before a download is attempted again. Doubles with every attempt and is randomized")] = constants.default_sleep_between_attempts_seconds,
+        max_retry_delay_seconds: Annotated[int, typer.Option(help="Longest back off between two download attempts")] = constants.default_max_retry_delay_seconds,
+        retry_budget: Annotated[int, typer.Option(help="Total number of download retries allowed across all tables in one run")] = constants.default_retry_budget,
+        thread_pause: Annotated[int, typer.Option(help="Deprecated and ignored - downloads start as soon as a download slot is free")] = constants.default_thread_pause,
+        decompress_workers: Annotated[int, typer.Option(help="Number of worker processes used to decompress the table files. 1 decompresses serially")] = constants.default_decompress_workers,
+        memory_budget_mb: Annotated[int, typer.Option(help="Memory in MB the tables between their download and their SQL script may hold. Further downloads wait until a table completes. 0 means no limit")] = constants.default_memory_budget_mb,
+        sql_workers: Annotated[int, typer.Option(help="Number of threads rendering and writing the table SQL scripts")] = constants.default_sql_workers,
+        stream_tsv: Annotated[bool, typer.Option(help="Flag to decompress the CD2 files into the TSV files while they download instead of keeping raw gzip copies")] = False,
+        redownload_corrupt: Annotated[bool, typer.Option(help="Flag to download tables that fail the integrity check once more before the SQL scripts are generated")] = True,
+        tsv_shard_size_mb: Annotated[int, typer.Option(help="Split each table TSV into shards of about this many MB so the shards can be loaded in parallel. 0 writes one file per table")] = constants.default_tsv_shard_size_mb,
+        tsv_shard_per_part: Annotated[bool, typer.Option(help="Flag to write one TSV shard per downloaded CD2 file instead of merging them")] = False,
+        tsv_compression: Annotated[str, typer.Option(help=f"Compress the TSV files as they are written. Values: {constants.tsv_compression_none}, {constants.tsv_compression_gzip}, {constants.tsv_compression_zstd}")] = constants.tsv_compression_none,
+        tsv_compression_level: Annotated[int, typer.Option(help="Compression level of the TSV files")] = constants.default_tsv_compression_level,
+        tsv_compression_threads: Annotated[int, typer.Option(help="Threads compressing each TSV file")] = constants.default_tsv_compression_threads,
+        profile_tsv: Annotated[bool, typer.Option(help="Flag to profile the column values while the TSV files are written and size the text and decimal columns from the data")] = False,
+        profile_margin_percent: Annotated[int, typer.Option(help="Head room in percent added to the profiled text lengths and decimal digits")] = constants.default_profile_margin_percent,
+        output_format: Annotated[str, typer.Option(help=f"Additional data file format written next to the TSV files. Values: {constants.output_format_tsv}, {constants.output_format_parquet}, {constants.output_format_jsonl}")] = constants.default_output_format,
+        parquet_row_group_rows: Annotated[int, typer.Option(help="Number of rows per Parquet row group. Bounds the memory used by the conversion")] = constants.default_parquet_row_group_rows,
+        parquet_compression: Annotated[str, typer.Option(help="Parquet compression codec. Values: snappy, gzip, zstd, brotli, lz4, none")] = constants.default_parquet_compression,
         log_level: Annotated[str, typer.Option(help=f"Logging detail level. Values: {', '.join([log_level.name for log_level in LogLevel])}")] = constants.default_log_level.name,
         schema_only: Annotated[bool, typer.Option(help="Flag to only include the SQL schema scripts. No data download")] = False,
         no_schema: Annotated[bool, typer.Option(help="Flag to not generate the SQL Schema scripts")] = False,
+        schema_cache: Annotated[bool, typer.Option(help="Flag to reuse the table schemas cached under the workspace root between runs")] = True,
+        refresh_schema: Annotated[bool, typer.Option(help="Flag to ignore the cached table schemas and fetch them all from CD2")] = False,
         include_sql_load: Annotated[bool, typer.Option(help="Flag as to include the SQL Load statements in the SQL scripts")] = True,
+        incremental: Annotated[bool, typer.Option(help="Flag to only pull the changes since the last successful run and generate merge scripts. Tables without a previous run are pulled as snapshots")] = False,
         import_warnings: Annotated[bool, typer.Option(help="Flag indicating if warnings and errors should display after imports")] = False,
+        resume: Annotated[bool, typer.Option(help="Flag to resume the previous run - keeps the workspace and skips the tables and stages already completed")] = False,
         workspace_root: Annotated[str, typer.Option(help="Root location for generated files")] = constants.default_root_workspace,
         tsv_workspace: Annotated[str, typer.Option(help="Location for the table TSV files. Overrides the default location under --workspace_root")] = None,
         sql_workspace: Annotated[str, typer.Option(help="Location for the table SQL and load script. Overrides the default location under --workspace_root")] = None,
@@ -49,21 +79,52 @@ def extract(
         env_locale: Annotated[str, typer.Option(help="he locale setting for output strings and numbers")] = "en_US.UTF-8",
         tables: Annotated[str, typer.Option(help="Tables to download from CD2. Semi-colon or comma seperated")] = None,
         excluded_tables: Annotated[str, typer.Option(help="List of tables to exclude from the CD2 download. Semi-colon or comma separated")] = None,
+        load_database: Annotated[bool, typer.Option(help="Flag to create the tables and load the data directly into MySQL after the SQL scripts are generated")] = False,
+        load_concurrent_limit: Annotated[int, typer.Option(help="Max concurrent MySQL sessions used to load tables")] = constants.default_load_concurrent_limit,
         dap_yaml: Annotated[str, typer.Option(help="Location of the YAML with the Canvas instance credentials")] = constants.default_dap_yaml,
+        mysql_yaml: Annotated[str, typer.Option(help="Location of the YAML with the MySQL connection settings used by --load-database")] = constants.default_mysql_yaml,
+        metrics_textfile: Annotated[str, typer.Option(help="Location of a Prometheus textfile collector file to write the run metrics to")] = None,
+        batch_yaml: Annotated[str, typer.Option(help="Location of a YAML file listing several Canvas instances to extract in one run")] = None,
+        batch_concurrent_limit: Annotated[int, typer.Option(help="Concurrent downloads shared by all the instances of a --batch-yaml run")] = constants.default_batch_concurrent_limit,
         settings_yaml: Annotated[str, typer.Option(help="Location of settings YAML File. YAML file override all switch options and defaults")] = constants.default_settings_yaml
     ):
     settings = Settings(
         concurrent_limit=concurrent_limit,
+        adaptive_concurrency=adaptive_concurrency,
+        min_concurrent_limit=min_concurrent_limit,
+        max_concurrent_limit=max_concurrent_limit,
+        schema_concurrent_limit=schema_concurrent_limit,
         max_download_attempts=max_download_attempts,
         semaphore_timeout_seconds=semaphore_timeout_seconds,
         max_lock_attempts=max_lock_attempts,
         sleep_between_attempts_seconds=sleep_between_attempts_seconds,
+        max_retry_delay_seconds=max_retry_delay_seconds,
+        retry_budget=retry_budget,
         thread_pause=thread_pause,
+        decompress_workers=decompress_workers,
+        memory_budget_mb=memory_budget_mb,
+        sql_workers=sql_workers,
+        stream_tsv=stream_tsv,
+        redownload_corrupt=redownload_corrupt,
+        tsv_shard_size_mb=tsv_shard_size_mb,
+        tsv_shard_per_part=tsv_shard_per_part,
+        tsv_compression=tsv_compression,
+        tsv_compression_level=tsv_compression_level,
+        tsv_compression_threads=tsv_compression_threads,
+        profile_tsv=profile_tsv,
+        profile_margin_percent=profile_margin_percent,
+        output_format=output_format,
+        parquet_row_group_rows=parquet_row_group_rows,
+        parquet_compression=parquet_compression,
         log_level=log_level,
         schema_only=schema_only,
         no_schema=no_schema,
+        schema_cache=schema_cache,
+        refresh_schema=refresh_schema,
         include_sql_load=include_sql_load,
+        incremental=incremental,
         import_warnings=import_warnings,
+        resume=resume,
         workspace_root=workspace_root,
         tsv_workspace=tsv_workspace,
         sql_workspace=sql_workspace,
@@ -71,30 +132,102 @@ def extract(
         env_locale=env_locale,
         tables=tables,
         excluded_tables=excluded_tables,
+        load_database=load_database,
+        load_concurrent_limit=load_concurrent_limit,
         dap_yaml_file=dap_yaml,
+        mysql_yaml_file=mysql_yaml,
+        metrics_textfile=metrics_textfile,
+        batch_yaml_file=batch_yaml,
+        batch_concurrent_limit=batch_concurrent_limit,
         settings_yaml_file = settings_yaml
     )
 
-    asyncio.run(process(settings))
+    failed_tables = asyncio.run(process_batch(settings) if settings.batch_yaml_file is not None else process(settings))
+    if len(failed_tables) > 0:
+        raise typer.Exit(code=1)
 
 
-async def process(settings):
+async def process_batch(settings) -> list:
+    logger = Logger(settings.log_level)
+    return await BatchRunner(logger, settings).run(process)
+
+
+async def process(settings, budget=None, schema_cache=None) -> list:
     logger = Logger(settings.log_level)
 
     workspace = Workspace(logger, settings)
     workspace.initialize()
 
-    client = DapClient(logger, workspace, settings)
-    meta = await client.get_tables()
+    manifest = RunManifest(logger, workspace, settings)
+    metrics = RunMetrics(logger, workspace, settings)
+
+    try:
+        return await run(logger, workspace, settings, manifest, metrics, budget, schema_cache)
+    finally:
+        metrics.write()
+
+
+async def run(logger, workspace, settings, manifest, metrics, budget=None, schema_cache=None) -> list:
+    incremental_state = IncrementalState(logger, workspace) if settings.incremental else None
+    client = DapClient(logger, workspace, settings, incremental_state, manifest, metrics, budget, schema_cache)
+
+    # Tables are handed to the decompression workers as soon as their download completes
+    tsv_generator = TsvGenerator(logger, workspace, settings, manifest, metrics) if not settings.schema_only else None
+
+    # Each table gets its SQL script and load as soon as its own TSV is ready, and is then dropped from memory
+    lifecycle = TableLifecycle(logger, workspace, settings, manifest, metrics, tsv_generator)
+    await lifecycle.start()
+
+    try:
+        if tsv_generator is not None:
+            tsv_generator.start(lifecycle.converted)
+
+        table_streamer = tsv_generator.stream if tsv_generator is not None and settings.stream_tsv else None
+        meta = await client.get_tables(lifecycle.downloaded, table_streamer, lifecycle=lifecycle)
+
+        if tsv_generator is not None:
+            await tsv_generator.finish()
+
+            if len(tsv_generator.corrupt_tables) > 0:
+                await redownload_corrupt(logger, settings, client, tsv_generator, manifest, lifecycle, table_streamer)
+
+        load_results = await lifecycle.finish()
+
+    finally:
+        await lifecycle.close()
+
+    if incremental_state is not None and not settings.schema_only:
+        incremental_state.update_from_run(client.namespace, lifecycle.timestamps, load_results)
+        incremental_state.save()
+
+    # Tables that failed after their download are reported like the tables that failed to download
+    for table_name, error in lifecycle.failures.items():
+        client.record_failure(table_name, error, 1)
+
+    client.log_failures()
+
+    failed_tables = list(meta['failed'])
+    if load_results is not None:
+        failed_tables += [table_name for table_name, result in load_results.items() if not result['success']]
+
+    return sorted(set(failed_tables))
+
+
+async def redownload_corrupt(logger, settings, client, tsv_generator, manifest, lifecycle, table_streamer):
+    corrupt_tables = sorted(tsv_generator.corrupt_tables)
+
+    if settings.redownload_corrupt:
+        logger.detail(f"Downloading {len(corrupt_tables)} tables with corrupt files again: {', '.join(corrupt_tables)}")
+        [manifest.discard(table_name) for table_name in corrupt_tables]
 
-    tsv_headers = None
-    if not settings.schema_only:
-        if ('files' in meta) and (len(meta['files']) > 0):
-            tsv_details = TsvGenerator(logger, workspace, settings).build(meta['files'])
+        tsv_generator.start(lifecycle.converted)
+        await client.get_tables(lifecycle.downloaded, table_streamer, corrupt_tables, lifecycle)
+        await tsv_generator.finish()
 
-    if not settings.no_schema:
-        if ('schema' in meta) and (len(meta['schema']) > 0):
-            (SchemaWriter(logger, workspace, settings).write(meta['schema'], tsv_details))
+    # Tables still corrupt are left out of the SQL scripts like tables that failed to download
+    for table_name, problems in tsv_generator.corrupt_tables.items():
+        client.record_failure(table_name, IntegrityError("; ".join(problems)), 2 if settings.redownload_corrupt else 1)
+        await lifecycle.discard(table_name)
 
 
 def entry_point():
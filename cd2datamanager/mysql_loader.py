@@ -0,0 +1,188 @@
+import asyncio
+import yaml
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.tsv_writer import TsvShardWriter
+from cd2datamanager.tsv_compression import TsvCompression, TsvFifo
+
+
+class MySqlLoader:
+
+    def __init__(self, logger, settings):
+        self._logger = logger
+        self._settings = settings
+
+        self.host = constants.default_mysql_host
+        self.port = constants.default_mysql_port
+        self.user = None
+        self.password = None
+        self.database = None
+
+        self._pool = None
+        self._semaphore = None
+        self._results = {}
+
+        self._load_yaml(settings.mysql_yaml_file)
+
+    def _load_yaml(self, yaml_path):
+        with open(yaml_path, 'r') as yaml_file:
+            config = yaml.safe_load(yaml_file)
+
+            if config is None:
+                return
+
+            self.user = config["user"] # Want error if this is missing
+            self.password = config.get("password", self.password)
+            self.database = config["database"] # Want error if this is missing
+            self.host = config.get("host", self.host)
+            self.port = config.get("port", self.port)
+
+    @property
+    def concurrent_limit(self) -> int:
+        return max(1, self._settings.load_concurrent_limit or 1)
+
+    async def create_pool(self):
+        try:
+            import aiomysql
+        except ImportError as e:
+            raise RuntimeError("The database load stage requires aiomysql - install it with 'pip install cd2datamanager[mysql]'") from e
+
+        return await aiomysql.create_pool(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            db=self.database,
+            minsize=1,
+            maxsize=self.concurrent_limit,
+            autocommit=True,
+            local_infile=True)
+
+    async def start(self):
+        self._logger.detail(f"Starting database load into {self.database} on {self.host}:{self.port} - {self.concurrent_limit} concurrent sessions")
+
+        self._results = {}
+        self._pool = await self.create_pool()
+        self._semaphore = asyncio.Semaphore(self.concurrent_limit)
+
+    async def load_one(self, schema, tsv_file = None, incremental = False) -> dict:
+        # Loads a single table over the pool opened by start() - tables can be handed over while others still download
+        await self.load_table(self._pool, self._semaphore, schema, tsv_file, self._results, incremental)
+        return self._results[schema.table_name]
+
+    async def finish(self) -> dict:
+        if self._pool is None:
+            return self._results
+
+        self._pool.close()
+        await self._pool.wait_closed()
+        self._pool = None
+
+        results = self._results
+        failed_tables = [table_name for table_name, result in results.items() if not result['success']]
+        if len(failed_tables) > 0:
+            self._logger.error(f"Database load failed or row counts did not match for {len(failed_tables)} tables: {', '.join(sorted(failed_tables))}")
+
+        self._logger.detail("Completed database load")
+        return results
+
+    async def load_table(self, pool, semaphore, schema, tsv_file, results, incremental = False):
+        table_name = schema.table_name
+        result = {
+            'success': False,
+            'expected_rows': tsv_file.get(constants.tsv_detail_row_count, None) if tsv_file is not None else None,
+            'loaded_rows': None
+        }
+        results[table_name] = result
+
+        self._logger.debug(f"Start loading table {table_name}")
+        try:
+            if incremental:
+                await self.merge_table(pool, semaphore, schema, tsv_file, result)
+            else:
+                await self.replace_table(pool, semaphore, schema, tsv_file, result)
+
+        except* Exception as eg:
+            for e in eg.exceptions:
+                self._logger.error(f"Error: Unable to load table {table_name}\nError:\n{e}")
+
+        self._logger.debug(f"Completed loading table {table_name}")
+
+    async def execute(self, pool, semaphore, statements) -> int:
+        # Every call takes its own session slot, so shards of one table share the limit with all other tables
+        row_count = 0
+        async with semaphore:
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    for statement in statements:
+                        row_count = await cursor.execute(statement)
+
+        return row_count
+
+    async def load_shards(self, pool, semaphore, schema, tsv_file, table_name = None, action_column = None) -> int:
+        shards = TsvShardWriter.shard_details(tsv_file)
+        if len(shards) > 1:
+            self._logger.debug(f"Loading {len(shards)} shards of table {schema.table_name} in parallel")
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(self.load_shard(pool, semaphore, schema, shard, table_name, action_column)) for shard in shards]
+
+        return sum(task.result() or 0 for task in tasks)
+
+    async def load_shard(self, pool, semaphore, schema, shard, table_name = None, action_column = None) -> int:
+        statements = [schema.load_statement(shard, table_name, action_column)]
+        if TsvCompression.compression_of(shard[constants.tsv_detail_file]) is None:
+            return await self.execute(pool, semaphore, statements)
+
+        async with TsvFifo(schema.load_source(shard)):
+            return await self.execute(pool, semaphore, statements)
+
+    async def replace_table(self, pool, semaphore, schema, tsv_file, result):
+        await self.execute(pool, semaphore, schema.table_statements())
+
+        if self._settings.schema_only:
+            result['success'] = True
+            return
+
+        load_error = schema.load_file_error(tsv_file)
+        if load_error is not None:
+            self._logger.error(f"Table {schema.table_name} created but not loaded - {load_error}")
+            return
+
+        result['loaded_rows'] = await self.load_shards(pool, semaphore, schema, tsv_file)
+        result['success'] = self.verify_row_count(schema.table_name, result['expected_rows'], result['loaded_rows'])
+
+    async def merge_table(self, pool, semaphore, schema, tsv_file, result):
+        load_error = schema.load_file_error(tsv_file)
+        if load_error is not None:
+            self._logger.error(f"Table {schema.table_name} changes not merged - {load_error}")
+            return
+
+        if schema.keys is None or len(schema.keys) <= 0:
+            self._logger.error(f"Table {schema.table_name} changes not merged - no primary key defined")
+            return
+
+        await self.execute(pool, semaphore, schema.staging_statements())
+
+        result['loaded_rows'] = await self.load_shards(pool, semaphore, schema, tsv_file, schema.staging_table_name, constants.incremental_action_column)
+        if not self.verify_row_count(schema.table_name, result['expected_rows'], result['loaded_rows']):
+            # A partial merge would lose the missing changes once the watermark moves on
+            self._logger.error(f"Table {schema.table_name} changes not merged - the staging table does not hold every change")
+            return
+
+        # Only a completed merge lets the incremental watermark advance
+        await self.execute(pool, semaphore, schema.merge_statements())
+        result['success'] = True
+
+    def verify_row_count(self, table_name, expected_rows, loaded_rows) -> bool:
+        if expected_rows is None:
+            self._logger.debug(f"Table {table_name} loaded {self._settings.readable_number(loaded_rows)} rows - no expected row count")
+            return True
+
+        if expected_rows != loaded_rows:
+            self._logger.error(f"Table {table_name} row count mismatch - expected {self._settings.readable_number(expected_rows)} rows, loaded {self._settings.readable_number(loaded_rows)} rows")
+            return False
+
+        self._logger.debug(f"Table {table_name} loaded {self._settings.readable_number(loaded_rows)} rows")
+        return True
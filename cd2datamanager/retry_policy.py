@@ -0,0 +1,183 @@
+import asyncio
+import random
+
+import cd2datamanager.constants as constants
+
+from aiohttp import ClientResponseError
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from dap.dap_error import (AccountDisabledError, AccountNotOnboardedError, AccountUnderMaintenanceError, AuthenticationError,
+                           GatewayTimeoutError, NotFoundError, OutOfRangeError, ProcessingError, RequestTypeForbiddenError,
+                           ServerError, ValidationError)
+
+
+class RetryPolicy:
+
+    retry_fatal = "fatal"
+    retry_throttled = "throttled"
+    retry_retryable = "retryable"
+
+    # Errors that fail the same way however often they are retried
+    fatal_errors = (AccountDisabledError, AccountNotOnboardedError, AuthenticationError, NotFoundError,
+                    OutOfRangeError, RequestTypeForbiddenError, ValidationError)
+
+    # Errors that clear up on their own - a failed job, maintenance or a gateway timeout
+    transient_errors = (AccountUnderMaintenanceError, GatewayTimeoutError, ProcessingError)
+
+    throttle_markers = ("too many requests", "rate limit", "throttl")
+
+    def __init__(self, logger, settings):
+        self._logger = logger
+        self._settings = settings
+
+        self.budget = settings.retry_budget
+        self.retries = 0
+        self.failures = {}
+
+    @property
+    def budget_left(self) -> int:
+        return max(0, self.budget - self.retries)
+
+    @staticmethod
+    def causes(error) -> list:
+        # The error and the errors it was raised from - DownloadError is raised over aiohttp's ClientResponseError
+        chain = []
+        while error is not None and error not in chain:
+            chain.append(error)
+            error = error.__cause__ or error.__context__
+
+        return chain
+
+    @staticmethod
+    def body_fields(body) -> dict:
+        # ServerError only keeps the JSON body of the response - its top level and its error object
+        if not isinstance(body, dict):
+            return {}
+
+        fields = {str(key).lower(): value for key, value in body.items()}
+        if isinstance(body.get("error", None), dict):
+            fields.update({str(key).lower(): value for key, value in body["error"].items()})
+
+        return fields
+
+    @staticmethod
+    def status_of(error):
+        if isinstance(error, ServerError):
+            fields = RetryPolicy.body_fields(error.body)
+            status = next((fields[key] for key in ["status", "statuscode", "status_code", "code"] if key in fields), None)
+        else:
+            status = getattr(error, "status", None) or getattr(error, "status_code", None)
+
+        try:
+            return int(status) if status is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def is_throttled(error) -> bool:
+        for cause in RetryPolicy.causes(error):
+            if RetryPolicy.status_of(cause) == HTTPStatus.TOO_MANY_REQUESTS.value:
+                return True
+
+            message = (str(cause.body) if isinstance(cause, ServerError) else str(cause)).lower()
+            if f"status code: {HTTPStatus.TOO_MANY_REQUESTS.value}" in message or any(marker in message for marker in RetryPolicy.throttle_markers):
+                return True
+
+        return False
+
+    @staticmethod
+    def classify(error) -> str:
+        if isinstance(error, RetryPolicy.fatal_errors):
+            return RetryPolicy.retry_fatal
+
+        if isinstance(error, RetryPolicy.transient_errors):
+            return RetryPolicy.retry_retryable
+
+        # The DAP API answers a throttled request with a plain ServerError and the file download with a ClientResponseError
+        if RetryPolicy.is_throttled(error):
+            return RetryPolicy.retry_throttled
+
+        return RetryPolicy.retry_retryable
+
+    @staticmethod
+    def retry_after(error):
+        for cause in RetryPolicy.causes(error):
+            headers = cause.headers if isinstance(cause, ClientResponseError) else getattr(cause, "headers", None)
+            value = headers.get("Retry-After", None) if headers is not None else None
+
+            if value is None and isinstance(cause, ServerError):
+                fields = RetryPolicy.body_fields(cause.body)
+                value = next((fields[key] for key in ["retry-after", "retryafter", "retry_after"] if key in fields), None)
+
+            if value is not None:
+                return RetryPolicy.parse_retry_after(value)
+
+        return None
+
+    @staticmethod
+    def parse_retry_after(value):
+        # Either a number of seconds or an HTTP date
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(str(value))
+        except (TypeError, ValueError):
+            return None
+
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def delay(self, attempt, error) -> float:
+        # Full jitter - spreads the retries of all the download slots instead of having them hit the gateway together
+        backoff = min(self._settings.max_retry_delay_seconds, self._settings.sleep_between_attempts_seconds * (2 ** (attempt - 1)))
+        delay = random.uniform(0, backoff)
+
+        if self.classify(error) == self.retry_throttled:
+            retry_after = self.retry_after(error)
+            delay = max(delay, retry_after if retry_after is not None else constants.default_throttle_delay_seconds)
+
+        return delay
+
+    def should_retry(self, table_name, attempt, error) -> bool:
+        category = self.classify(error)
+        if category == self.retry_fatal:
+            self._logger.debug(f"Table {table_name} failed with an error that will not clear on retry - {type(error).__name__}: {error}")
+            return False
+
+        if attempt >= self._settings.max_download_attempts:
+            return False
+
+        if self.budget_left <= 0:
+            self._logger.error(f"Retry budget of {self.budget} retries used up - not retrying table {table_name}")
+            return False
+
+        self.retries += 1
+        return True
+
+    async def wait(self, table_name, attempt, error):
+        delay = self.delay(attempt, error)
+        self._logger.debug(f"Failed to download table {table_name} attempt {attempt} [{self.classify(error)}] - retrying in {delay:,.1f} seconds -> {error}")
+        await asyncio.sleep(delay)
+
+    def record_failure(self, table_name, error, attempts):
+        self.failures[table_name] = {
+            "category": self.classify(error),
+            "error": f"{type(error).__name__}: {error}",
+            "attempts": attempts
+        }
+
+    def log_summary(self):
+        if len(self.failures) <= 0:
+            self._logger.detail(f"All tables completed - {self.retries} retries used")
+            return
+
+        # Download, integrity and conversion failures - the database load reports its own
+        self._logger.error(f"{len(self.failures)} tables failed - {self.retries} of {self.budget} retries used:")
+        for table_name, failure in sorted(self.failures.items()):
+            self._logger.error(f"{' '.ljust(6, ' ')}{table_name} [{failure['category']}, {failure['attempts']} attempts] {failure['error']}")
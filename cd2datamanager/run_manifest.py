@@ -0,0 +1,154 @@
+import json
+import os
+
+import cd2datamanager.constants as constants
+
+from datetime import datetime
+from dap.dap_types import DownloadTableDataResult
+from cd2datamanager.tsv_writer import TsvShardWriter
+
+
+class RunManifest:
+
+    def __init__(self, logger, workspace, settings):
+        self._logger = logger
+        self._settings = settings
+        self._manifest_file = workspace.run_manifest
+
+        previous_manifest = self._load_json(self._manifest_file)
+
+        # Snapshot sizes are carried over even when not resuming - they drive the download scheduling
+        self.sizes = previous_manifest.get("sizes", None) or dict()
+        self.tables = (previous_manifest.get("tables", None) or dict()) if settings.resume else dict()
+
+        if settings.resume:
+            self._logger.detail(f"Resuming run from manifest {self._manifest_file} - {len(self.tables)} tables recorded")
+
+    def _load_json(self, json_path) -> dict:
+        if not os.path.exists(json_path):
+            self._logger.debug(f"No run manifest found at {json_path}")
+            return dict()
+
+        try:
+            with open(json_path, 'r', encoding="UTF-8") as json_file:
+                manifest = json.load(json_file)
+
+        except Exception as e:
+            self._logger.warning(f"Ignoring unreadable run manifest {json_path} - {e}")
+            return dict()
+
+        return manifest if manifest is not None else dict()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._manifest_file)), exist_ok=True)
+
+        # Write to a temporary file and swap it in so a killed run never leaves a partial manifest
+        temp_file = f"{self._manifest_file}.tmp"
+        with open(temp_file, 'w', encoding="UTF-8") as json_file:
+            json.dump({"updated": datetime.utcnow().isoformat(), "sizes": self.sizes, "tables": self.tables}, json_file, indent=2)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+
+        os.replace(temp_file, self._manifest_file)
+
+    @staticmethod
+    def file_entry(file_path) -> dict:
+        return {
+            "path": os.path.abspath(file_path),
+            "size": os.path.getsize(file_path)
+        }
+
+    @staticmethod
+    def is_file_intact(file_entry) -> bool:
+        return file_entry is not None and os.path.exists(file_entry["path"]) and os.path.getsize(file_entry["path"]) == file_entry["size"]
+
+    def record_download(self, table_name, asset, incremental = False):
+        files = [self.file_entry(file_path) for file_path in asset.downloaded_files]
+        if not incremental and len(files) > 0:
+            self.sizes[table_name] = sum(file_entry["size"] for file_entry in files)
+
+        # A new download invalidates everything generated from the previous one
+        self.tables[table_name] = {
+            constants.manifest_stage_download: {
+                "files": files,
+                "schema_version": asset.schema_version,
+                "timestamp": asset.timestamp.isoformat() if asset.timestamp is not None else None,
+                "job_id": asset.job_id,
+                "incremental": incremental
+            }
+        }
+        self.save()
+
+    def downloaded_asset(self, table_name):
+        download = self.tables.get(table_name, {}).get(constants.manifest_stage_download, None)
+        if download is None:
+            return None
+
+        if not all(self.is_file_intact(file_entry) for file_entry in download["files"]):
+            self._logger.debug(f"Downloaded files for {table_name} are missing or changed - downloading again")
+            return None
+
+        # Streamed tables keep no raw files, so only a complete TSV counts as downloaded
+        if len(download["files"]) == 0 and self.tsv_details(table_name) is None:
+            self._logger.debug(f"Streamed TSV for {table_name} is missing or incomplete - downloading again")
+            return None
+
+        return DownloadTableDataResult(
+            download["schema_version"],
+            datetime.fromisoformat(download["timestamp"]) if download["timestamp"] is not None else None,
+            download["job_id"],
+            [file_entry["path"] for file_entry in download["files"]])
+
+    def downloaded_sizes(self, table_name) -> dict:
+        download = self.tables.get(table_name, {}).get(constants.manifest_stage_download, None)
+        return {file_entry["path"]: file_entry["size"] for file_entry in download["files"]} if download is not None else {}
+
+    def discard(self, table_name):
+        # Forget every stage of the table so it is downloaded again
+        if self.tables.pop(table_name, None) is not None:
+            self.save()
+
+    def record_size(self, table_name, size):
+        if self.is_incremental(table_name):
+            return
+
+        self.sizes[table_name] = size
+        self.save()
+
+    def expected_size(self, table_name):
+        return self.sizes.get(table_name, None)
+
+    def is_incremental(self, table_name) -> bool:
+        return self.tables.get(table_name, {}).get(constants.manifest_stage_download, {}).get("incremental", False)
+
+    def record_tsv(self, table_name, tsv_details):
+        if table_name not in self.tables:
+            return
+
+        self.tables[table_name][constants.manifest_stage_tsv] = {
+            "details": tsv_details,
+            "files": [self.file_entry(shard[constants.tsv_detail_file]) for shard in TsvShardWriter.shard_details(tsv_details)]
+        }
+        self.tables[table_name].pop(constants.manifest_stage_sql, None)
+        self.save()
+
+    def tsv_details(self, table_name):
+        tsv = self.tables.get(table_name, {}).get(constants.manifest_stage_tsv, None)
+        if tsv is None or not all(self.is_file_intact(file_entry) for file_entry in tsv.get("files", [])):
+            return None
+
+        return tsv["details"]
+
+    def record_sql(self, table_name, sql_file):
+        if table_name not in self.tables:
+            self.tables[table_name] = {}
+
+        self.tables[table_name][constants.manifest_stage_sql] = self.file_entry(sql_file)
+        self.save()
+
+    def sql_file(self, table_name):
+        sql = self.tables.get(table_name, {}).get(constants.manifest_stage_sql, None)
+        if sql is None or not self.is_file_intact(sql):
+            return None
+
+        return sql["path"]
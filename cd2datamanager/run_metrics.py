@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+import time
+
+from datetime import datetime
+
+
+class RunMetrics:
+
+    fields = ["seconds", "bytes_in", "bytes_out", "rows", "retries", "semaphore_wait_seconds"]
+    stages = ["schema", "download", "tsv", "sql"]
+
+    def __init__(self, logger, workspace, settings):
+        self._logger = logger
+        self._workspace = workspace
+        self._settings = settings
+
+        self.started = datetime.utcnow()
+        self._start_time = time.perf_counter()
+        self.tables = {}
+        self.run = {}
+
+    def add(self, table, stage, **values):
+        stage_metrics = self.tables.setdefault(table, {}).setdefault(stage, {})
+        for name, value in values.items():
+            if value is not None:
+                stage_metrics[name] = stage_metrics.get(name, 0) + value
+
+    def set(self, name, value):
+        self.run[name] = value
+
+    @staticmethod
+    def timed(function, *args) -> tuple:
+        # Runs inside the worker processes, so the time excludes waiting for a free worker
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+    @staticmethod
+    def file_size(files) -> int:
+        return sum(os.path.getsize(file_path) for file_path in files if file_path is not None and os.path.exists(file_path))
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self._start_time
+
+    def totals(self) -> dict:
+        totals = {}
+        for table_metrics in self.tables.values():
+            for stage, stage_metrics in table_metrics.items():
+                stage_totals = totals.setdefault(stage, {})
+                for name, value in stage_metrics.items():
+                    stage_totals[name] = stage_totals.get(name, 0) + value
+
+        return totals
+
+    def rows(self) -> list:
+        rows = []
+        for table, table_metrics in sorted(self.tables.items()):
+            for stage, stage_metrics in table_metrics.items():
+                rows.append({"table": table, "stage": stage, **{name: round(stage_metrics.get(name, 0), 3) for name in self.fields}})
+
+        return rows
+
+    def write(self):
+        report = {
+            "started": self.started.isoformat(),
+            "completed": datetime.utcnow().isoformat(),
+            "duration_seconds": round(self.duration, 3),
+            "run": self.run,
+            "stages": self.totals(),
+            "tables": self.tables
+        }
+
+        with open(self._workspace.run_report_json, 'w', encoding="UTF-8") as json_file:
+            json.dump(report, json_file, indent=2)
+
+        with open(self._workspace.run_report_csv, 'w', encoding="UTF-8", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=["table", "stage"] + self.fields)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+        if self._settings.metrics_textfile is not None:
+            self.write_textfile(self._settings.metrics_textfile)
+
+        self.log_summary(report["stages"])
+        self._logger.detail(f"Run report located at {os.path.abspath(self._workspace.run_report_json)}")
+
+    def log_summary(self, totals):
+        mb = 1024 * 1024
+        for stage in [stage for stage in self.stages if stage in totals] + [stage for stage in totals if stage not in self.stages]:
+            stage_totals = totals[stage]
+            self._logger.detail(f"{stage.ljust(8, ' ')} {stage_totals.get('seconds', 0):,.1f} seconds, "
+                                f"{stage_totals.get('bytes_in', 0) / mb:,.1f} MB in, {stage_totals.get('bytes_out', 0) / mb:,.1f} MB out, "
+                                f"{self._settings.readable_number(stage_totals.get('rows', 0))} rows, "
+                                f"{stage_totals.get('retries', 0)} retries, {stage_totals.get('semaphore_wait_seconds', 0):,.1f} seconds waiting")
+
+    @staticmethod
+    def label(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def write_textfile(self, textfile):
+        lines = []
+        for name in self.fields:
+            metric = f"cd2_stage_{name}"
+            lines.append(f"# HELP {metric} Canvas Data 2 {name.replace('_', ' ')} per table and stage of the last run")
+            lines.append(f"# TYPE {metric} gauge")
+            for row in self.rows():
+                lines.append(f"{metric}{{table=\"{self.label(row['table'])}\",stage=\"{self.label(row['stage'])}\"}} {row[name]}")
+
+        for name, value in self.run.items():
+            lines.append(f"# HELP cd2_run_{name} Canvas Data 2 {name.replace('_', ' ')} of the last run")
+            lines.append(f"# TYPE cd2_run_{name} gauge")
+            lines.append(f"cd2_run_{name} {value}")
+
+        lines.append("# HELP cd2_run_duration_seconds Wall time of the last run")
+        lines.append("# TYPE cd2_run_duration_seconds gauge")
+        lines.append(f"cd2_run_duration_seconds {self.duration:.3f}")
+        lines.append("# HELP cd2_run_completed_timestamp_seconds Unix time the last run completed")
+        lines.append("# TYPE cd2_run_completed_timestamp_seconds gauge")
+        lines.append(f"cd2_run_completed_timestamp_seconds {time.time():.0f}")
+
+        # The textfile collector may read at any time - swap the complete file in
+        temp_file = f"{textfile}.tmp"
+        with open(temp_file, 'w', encoding="UTF-8") as prom_file:
+            prom_file.write("\n".join(lines))
+            prom_file.write("\n")
+
+        os.replace(temp_file, textfile)
+        self._logger.debug(f"Metrics textfile written to {os.path.abspath(textfile)}")
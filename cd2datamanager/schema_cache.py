@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+
+from dap.dap_types import VersionedSchema
+
+
+class SchemaCache:
+
+    def __init__(self, logger, workspace, settings):
+        self._logger = logger
+        self._settings = settings
+        self._cache_path = workspace.schema_cache
+
+        # Schemas fetched or read during this process - shared by all the tenants of a batch
+        self._memory = {}
+        self._locks = {}
+
+    def cache_file(self, namespace, table_name) -> str:
+        return f"{self._cache_path}/{namespace}/{table_name}.json"
+
+    @property
+    def reads_disk(self) -> bool:
+        # A schema only run has no download to compare the cached version with - it always asks CD2 and refreshes the cache
+        return not self._settings.refresh_schema and not self._settings.schema_only
+
+    def lock(self, namespace, table_name) -> asyncio.Lock:
+        return self._locks.setdefault((namespace, table_name), asyncio.Lock())
+
+    def get(self, namespace, table_name):
+        if (namespace, table_name) in self._memory:
+            return self._memory[(namespace, table_name)]
+
+        if not self.reads_disk:
+            return None
+
+        cache_file = self.cache_file(namespace, table_name)
+        if not os.path.exists(cache_file):
+            return None
+
+        try:
+            with open(cache_file, 'r', encoding="UTF-8") as json_file:
+                cached = json.load(json_file)
+
+            self._logger.debug(f"Using cached schema version {cached['version']} for {table_name}")
+            self._memory[(namespace, table_name)] = VersionedSchema(schema=cached["schema"], version=cached["version"])
+            return self._memory[(namespace, table_name)]
+
+        except Exception as e:
+            self._logger.warning(f"Ignoring unreadable schema cache for {table_name} - {e}")
+            return None
+
+    def put(self, namespace, table_name, schema_object):
+        if schema_object is None:
+            return
+
+        self._memory[(namespace, table_name)] = schema_object
+        cache_file = self.cache_file(namespace, table_name)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        temp_file = f"{cache_file}.tmp"
+        with open(temp_file, 'w', encoding="UTF-8") as json_file:
+            json.dump({"version": schema_object.version, "schema": schema_object.schema}, json_file)
+
+        os.replace(temp_file, cache_file)
+        self._logger.debug(f"Cached schema version {schema_object.version} for {table_name}")
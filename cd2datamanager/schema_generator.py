@@ -3,6 +3,22 @@ from __future__ import annotations
 import os.path
 import cd2datamanager.constants as constants
 
+from cd2datamanager.tsv_writer import TsvShardWriter, TsvHeader
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+class SchemaColumn:
+
+    # One table column as the SQL generation needs it - worked out once per schema version
+    def __init__(self, name, definition, sql_type, required, enum_values, comment, loader):
+        self.name = name
+        self.definition = definition
+        self.sql_type = sql_type
+        self.required = required
+        self.enum_values = enum_values
+        self.comment = comment
+        self.loader = loader
+
 
 class SchemaGenerator:
 
@@ -13,35 +29,124 @@ class SchemaGenerator:
         self._logger = logger
         self._settings = settings
 
-        self.schema_object = None
+        self._schema_object = None
+        self._profile = None
+        self._parsed = None
         self.schema_json = None
 
+    @property
+    def schema_object(self):
+        return self._schema_object
+
+    @schema_object.setter
+    def schema_object(self, schema_object):
+        # A new schema version invalidates everything parsed from the previous one
+        self._schema_object = schema_object
+        self._parsed = None
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @profile.setter
+    def profile(self, profile):
+        # Column types are sized from the profiled data - rebuild them on next use
+        self._profile = profile
+        self._parsed = None
+
+    @property
+    def parsed(self) -> dict:
+        if self._parsed is None:
+            self._parsed = self.parse_schema()
+
+        return self._parsed
+
+    def parse_schema(self) -> dict:
+        if not self.is_valid_schema_object(self.schema_object):
+            return {"table_def": None, "fields": None, "keys": None, "meta": None, "required": set(), "columns": {}, "column_model": {}}
+
+        schema = self.schema_object.schema
+        table_def = self.transverse_schema_object(schema, "properties/value")
+        fields = self.transverse_schema_object(table_def, "properties") if table_def is not None else None
+        keys = self.transverse_schema_object(schema, "properties/key/properties")
+        meta = self.transverse_schema_object(schema, "properties/meta/properties")
+
+        required = set(self.transverse_schema_object(schema, "properties/key/required") or [])
+        required.update(self.transverse_schema_object(schema, "properties/value/required") or [])
+
+        columns = {**(keys or {}), **(fields or {}), **(meta or {})}
+        column_model = {name: self.build_column_model(name, definition, required) for name, definition in columns.items()}
+
+        # Incremental changes are merged into the table the snapshot created - a width sized from one download would truncate or reject the next
+        if self.profile is not None and not self._settings.incremental:
+            self.apply_profile(column_model)
+
+        return {"table_def": table_def, "fields": fields, "keys": keys, "meta": meta, "required": required, "columns": columns, "column_model": column_model}
+
+    def build_column_model(self, name, definition, required) -> SchemaColumn:
+        enum_values = self.enum_values(definition)
+
+        comment = definition.get("description", "")
+        if len(enum_values) > 0:
+            enum_comment = f"{', '.join(enum_values)}"
+            comment += f" [{enum_comment}]" if len(comment) > 0 else enum_comment
+
+        return SchemaColumn(name, definition, self.field_type(definition), name in required, enum_values, comment, self.loader_function(definition))
+
+    def apply_profile(self, column_model):
+        # Every VARCHAR counts against the MySQL row size limit - LONGTEXT is stored off the row, so stop tightening at the budget
+        row_size = 0
+        for column in column_model.values():
+            column_profile = self.profile.get(column.name, None)
+            if column_profile is None or column_profile[constants.profile_values] <= 0:
+                continue
+
+            if column.sql_type == "LONGTEXT":
+                length = self.with_margin(column_profile[constants.profile_max_length])
+                if length > constants.profile_max_varchar_length or row_size + length * 4 > constants.profile_row_size_budget:
+                    continue
+
+                row_size += length * 4
+                column.sql_type = f"VARCHAR({length})"
+
+            elif column.sql_type == "DECIMAL(63, 30)" and column_profile[constants.profile_is_decimal]:
+                scale = min(30, self.with_margin(column_profile[constants.profile_scale]))
+                integer_digits = self.with_margin(column_profile[constants.profile_integer_digits])
+                if integer_digits + scale > 65:
+                    continue
+
+                column.sql_type = f"DECIMAL({integer_digits + scale}, {scale})"
+
+    def with_margin(self, value) -> int:
+        return max(1, -(-value * (100 + self._settings.profile_margin_percent) // 100))
+
     @property
     def table_def(self) -> dict:
-        return self.transverse_schema_object(self.schema_object.schema, "properties/value") if self.is_valid_schema_object(self.schema_object) else None
+        return self.parsed["table_def"]
 
     @property
     def fields(self) -> dict:
-        return self.transverse_schema_object(self.table_def, "properties") if self.table_def is not None else None
+        return self.parsed["fields"]
 
     @property
     def keys(self) -> dict:
-        return self.transverse_schema_object(self.schema_object.schema, "properties/key/properties") if self.is_valid_schema_object(self.schema_object) else None
+        return self.parsed["keys"]
 
     @property
     def meta(self) -> dict:
-        return self.transverse_schema_object(self.schema_object.schema, "properties/meta/properties") if self.is_valid_schema_object(self.schema_object) else None
+        return self.parsed["meta"]
 
     @property
-    def required(self) -> list:
-        key_list = self.transverse_schema_object(self.schema_object.schema, "properties/key/required")
-        field_list = self.transverse_schema_object(self.schema_object.schema, "properties/value/required")
-
-        return key_list if not None else [] + field_list if not None else []
+    def required(self) -> set:
+        return self.parsed["required"]
 
     @property
     def columns(self):
-        return {**self.keys,  **self.fields, **self.meta}.items()
+        return self.parsed["columns"].items()
+
+    @property
+    def column_model(self) -> dict:
+        return self.parsed["column_model"]
 
     @staticmethod
     def is_valid_schema_object(schema_object):
@@ -64,10 +169,29 @@ class SchemaGenerator:
         else:
             return None
 
-    async def initialize(self, session) -> SchemaGenerator:
+    @property
+    def version(self):
+        return self.schema_object.version if self.is_valid_schema_object(self.schema_object) else None
+
+    async def initialize(self, session, schema_cache=None) -> SchemaGenerator:
+        if schema_cache is None:
+            return await self.refresh(session)
+
+        # The cache can be shared - the first caller fetches a schema and the others wait for it
+        async with schema_cache.lock(self.namespace, self.table_name):
+            self.schema_object = schema_cache.get(self.namespace, self.table_name)
+            if self.schema_object is not None:
+                return self
+
+            return await self.refresh(session, schema_cache)
+
+    async def refresh(self, session, schema_cache=None) -> SchemaGenerator:
         self._logger.debug(f"Gathering Schema for {self.table_name}")
         self.schema_object = await session.get_table_schema(self.namespace, self.table_name)
 
+        if schema_cache is not None:
+            schema_cache.put(self.namespace, self.table_name, self.schema_object)
+
         self._logger.debug(f"Completed Gathering Schema for {self.table_name}")
 
         return self
@@ -78,8 +202,8 @@ class SchemaGenerator:
     def _drop_sql(self):
         return f"DROP TABLE IF EXISTS `{self.table_name}`;\n\n"
 
-    def _table_sql(self) -> str:
-        sql = f"CREATE TABLE `{self.table_name}`\n(\n  {self.build_columns()}"
+    def _table_sql(self, table_name=None, all_nullable=False) -> str:
+        sql = f"CREATE TABLE `{table_name or self.table_name}`\n(\n  {self.build_columns(all_nullable)}"
 
         table_constraints = self.build_constraints()
         if len(table_constraints) > 0:
@@ -100,36 +224,29 @@ class SchemaGenerator:
 
         return sql
 
-    def build_columns(self) -> str:
-        sql = []
-
-        columns = self.columns
-        field_name_length = max(len(name) for name, definition in columns) + 4
+    def build_columns(self, all_nullable=False) -> str:
+        # Built once per table - the create and staging scripts and the load statements reuse it
+        columns_sql = self.parsed.setdefault("columns_sql", {})
+        if all_nullable not in columns_sql:
+            column_model = self.column_model
+            field_name_length = max(len(name) for name in column_model) + 4
 
-        [sql.append(self.build_column(name, definition, field_name_length).rstrip(' ')) for name, definition in columns]
-        return ",\n  ".join(sql)
+            columns_sql[all_nullable] = ",\n  ".join(self.build_column(column, field_name_length, all_nullable).rstrip(' ') for column in column_model.values())
 
-    def build_column(self, name, definition, name_length = 25) -> str:
-        sql_table_name = f"`{name}`"
-        sql = f"{sql_table_name.ljust(name_length, ' ')} {self.field_type(definition).ljust(20, ' ')} {self.null_not_null(name).ljust(11)}"
+        return columns_sql[all_nullable]
 
-        comment = ""
-        if "description" in definition:
-            comment = definition['description']
-
-        enum_values = self.enum_values(definition)
-        if len(enum_values) > 0:
-            enum_comment = f"{', '.join(enum_values)}"
-            comment += f" [{enum_comment}]" if len(comment) > 0 else enum_comment
+    def build_column(self, column, name_length = 25, all_nullable=False) -> str:
+        sql_table_name = f"`{column.name}`"
+        sql = f"{sql_table_name.ljust(name_length, ' ')} {column.sql_type.ljust(20, ' ')} {self.null_not_null(column.name, all_nullable).ljust(11)}"
 
-        if comment is not None and len(comment) > 0:
-            comment = comment.replace("'", "''")
+        if len(column.comment) > 0:
+            comment = column.comment.replace("'", "''")
             sql += f"COMMENT '{comment}'"
 
         return sql
 
-    def null_not_null(self, name):
-        return f"{'NOT ' if name in self.required else ''}NULL"
+    def null_not_null(self, name, all_nullable=False):
+        return f"{'NOT ' if not all_nullable and name in self.required else ''}NULL"
 
     def build_constraints(self) -> str:
         constraints = []
@@ -240,49 +357,86 @@ class SchemaGenerator:
         else:
             return []
 
+    def table_statements(self) -> list:
+        return [self._drop_sql().strip().rstrip(';'), self._table_sql()]
+
+    @staticmethod
+    def load_file_error(tsv_file):
+        if tsv_file is None or constants.tsv_detail_file not in tsv_file or tsv_file[constants.tsv_detail_file] is None or len(tsv_file[constants.tsv_detail_file]) <= 0:
+            return "File not found - unable to generate load script"
+
+        if constants.tsv_detail_headers not in tsv_file or tsv_file[constants.tsv_detail_headers] is None or len(tsv_file[constants.tsv_detail_headers]) <= 0:
+            return "No fields defined - unable to generate load script"
+
+        return None
+
     def load_file(self, tsv_file) -> str:
+        load_error = self.load_file_error(tsv_file)
+        if load_error is not None:
+            return f"## {load_error}"
 
-        if constants.tsv_detail_file not in tsv_file or len(tsv_file[constants.tsv_detail_file]) <= 0:
-            return "## File not found - unable to generate load script"
+        # Sharded tables get one load per shard so the shards can be loaded over parallel sessions
+        return "\n\n".join(self.load_shard(shard) for shard in TsvShardWriter.shard_details(tsv_file))
 
-        if constants.tsv_detail_headers not in tsv_file or len(tsv_file[constants.tsv_detail_headers]) <= 0:
-            return "## No fields defined - unable to generate load script"
+    @staticmethod
+    def load_source(tsv_file) -> str:
+        return os.path.abspath(f"{tsv_file[constants.tsv_detail_file]}")
 
-        tsv_file_abs = os.path.abspath(f"{tsv_file[constants.tsv_detail_file]}")
+    @staticmethod
+    def load_infile(tsv_file) -> str:
+        # Compressed files are loaded through a named pipe the decompression writes into
+        tsv_file_abs = SchemaGenerator.load_source(tsv_file)
+        return TsvCompression.fifo_file(tsv_file_abs) if TsvCompression.compression_of(tsv_file_abs) is not None else tsv_file_abs
+
+    @staticmethod
+    def load_prepare(tsv_file) -> str:
+        tsv_file_abs = SchemaGenerator.load_source(tsv_file)
+        return TsvCompression.fifo_command(tsv_file_abs) if TsvCompression.compression_of(tsv_file_abs) is not None else ""
+
+    def load_shard(self, tsv_file) -> str:
+        load_sql = list()
+        load_sql.append(self.load_prepare(tsv_file))
+        load_sql.append(self.load_statement(tsv_file))
+        load_sql.append(";\n")
+        if (self._settings.import_warnings):
+            load_sql.append("\nshow warnings;\n")
+
+        load_sql.append("\n\n")
+
+        if constants.tsv_detail_row_count in tsv_file and tsv_file[constants.tsv_detail_row_count] is not None:
+            load_sql.append(f"# Expecting {self._settings.readable_number(tsv_file[constants.tsv_detail_row_count])} rows")
+
+        return "".join(load_sql)
+
+    def load_statement(self, tsv_file, table_name=None, action_column=None) -> str:
+        tsv_file_abs = self.load_source(tsv_file)
         load_sql  = list()
         set_sql = list()
 
         load_sql.append("load data\n")
-        load_sql.append(f"local infile '{tsv_file_abs}'\n")
-        load_sql.append(f"into table `{self.table_name}` ")
+        load_sql.append(f"local infile '{self.load_infile(tsv_file)}'\n")
+        load_sql.append(f"into table `{table_name or self.table_name}` ")
         load_sql.append("fields terminated by '\t' ")
         load_sql.append("lines terminated by '\\n'")
         load_sql.append("ignore 1 rows\n")
         load_sql.append("(\n  ")
 
         column_fields = list()
-        table_columns = self.columns.mapping
-        for tsv_field in tsv_file[constants.tsv_detail_headers]:
-            field = tsv_field.split('.')[1]
-            table_field = table_columns[field] if field in table_columns else None
+        column_model = self.column_model
+        for tsv_field in TsvHeader.fields(tsv_file[constants.tsv_detail_headers]):
+            if action_column is not None and tsv_field.header == constants.tsv_meta_action_field:
+                column_fields.append(f"`{action_column}`")
+                continue
 
-            if table_field is None:
+            field = tsv_field.name
+            column = column_model.get(field, None)
+
+            if column is None:
                 self._logger.error(f"Field {field} is not part of table {self.table_name} in csv file {tsv_file_abs} ")
                 continue
 
-            case_function = self.handle_switch(
-                table_field["type"],
-                None,
-                {
-                    "integer": SchemaGenerator.loader_number_field,
-                    "string": SchemaGenerator.loader_string_field,
-                    "boolean": SchemaGenerator.loader_boolean_field,
-                    "number": SchemaGenerator.loader_number_field,
-                }
-            ) if "type" in table_field else None
-
-            if case_function is not None:
-                field = case_function(field, set_sql, table_field)
+            if column.loader is not None:
+                field = column.loader(field, set_sql, column.definition)
 
             column_fields.append(field if field.startswith('@') else f"`{field}`")
 
@@ -290,20 +444,79 @@ class SchemaGenerator:
 
         load_sql.append("\n)\n")
 
-        if set_sql is not None and len(set_sql) >= 0:
+        if set_sql is not None and len(set_sql) > 0:
             load_sql.append("SET ")
             load_sql.append(f",\n{' '.ljust(4, ' ')}".join(set_sql))
 
-        load_sql.append(";\n")
+        return "".join(load_sql)
+
+    @property
+    def staging_table_name(self) -> str:
+        return f"{self.table_name}{constants.incremental_staging_suffix}"
+
+    def merge_file(self, tsv_file) -> str:
+        load_error = self.load_file_error(tsv_file)
+        if load_error is not None:
+            return f"## {load_error}"
+
+        if self.keys is None or len(self.keys) <= 0:
+            return "## No primary key defined - unable to generate merge script"
+
+        statements = self.staging_statements()
+        statements.extend(self.load_prepare(shard) + self.load_statement(shard, self.staging_table_name, constants.incremental_action_column) for shard in TsvShardWriter.shard_details(tsv_file))
+        statements.extend(self.merge_statements())
+
+        merge_sql = list()
+        merge_sql.append(";\n\n".join(statements))
+        merge_sql.append(";\n")
         if (self._settings.import_warnings):
-            load_sql.append("\nshow warnings;\n")
+            merge_sql.append("\nshow warnings;\n")
 
-        load_sql.append("\n\n")
+        merge_sql.append("\n\n")
 
         if constants.tsv_detail_row_count in tsv_file and tsv_file[constants.tsv_detail_row_count] is not None:
-            load_sql.append(f"# Expecting {self._settings.readable_number(tsv_file[constants.tsv_detail_row_count])} rows")
+            merge_sql.append(f"# Expecting {self._settings.readable_number(tsv_file[constants.tsv_detail_row_count])} changed rows")
 
-        return "".join(load_sql)
+        return "".join(merge_sql)
+
+    def staging_statements(self) -> list:
+        return [
+            f"DROP TABLE IF EXISTS `{self.staging_table_name}`",
+            self._table_sql(self.staging_table_name, all_nullable=True),
+            f"ALTER TABLE `{self.staging_table_name}` ADD COLUMN `{constants.incremental_action_column}` CHAR(1) NULL"
+        ]
+
+    def merge_statements(self) -> list:
+        keys = list(self.keys)
+        columns = list(self.column_model)
+        action = f"COALESCE(`{constants.incremental_action_column}`, 'U')"
+
+        column_list = ", ".join(f"`{name}`" for name in columns)
+        update_list = f",\n{' '.ljust(4, ' ')}".join(f"`{name}` = changes.`{name}`" for name in columns if name not in keys)
+        key_join = " AND ".join(f"target.`{name}` = changes.`{name}`" for name in keys)
+
+        upsert_sql = f"INSERT INTO `{self.table_name}` ({column_list})\n"
+        upsert_sql += f"SELECT * FROM (SELECT {column_list} FROM `{self.staging_table_name}` WHERE {action} <> 'D') AS changes\n"
+        upsert_sql += f"ON DUPLICATE KEY UPDATE\n{' '.ljust(4, ' ')}{update_list if len(update_list) > 0 else ', '.join(f'`{name}` = changes.`{name}`' for name in keys)}"
+
+        delete_sql = f"DELETE target FROM `{self.table_name}` AS target\n"
+        delete_sql += f"INNER JOIN `{self.staging_table_name}` AS changes ON {key_join}\n"
+        delete_sql += f"WHERE changes.`{constants.incremental_action_column}` = 'D'"
+
+        return [upsert_sql, delete_sql, f"DROP TABLE IF EXISTS `{self.staging_table_name}`"]
+
+    @staticmethod
+    def loader_function(definition):
+        return SchemaGenerator.handle_switch(
+            definition["type"],
+            None,
+            {
+                "integer": SchemaGenerator.loader_number_field,
+                "string": SchemaGenerator.loader_string_field,
+                "boolean": SchemaGenerator.loader_boolean_field,
+                "number": SchemaGenerator.loader_number_field,
+            }
+        ) if "type" in definition else None
 
     @staticmethod
     def loader_number_field(field, set_sql, table_field) -> str:
@@ -1,100 +1,204 @@
+import asyncio
+import glob
+import json
 import os.path
+import time
 
+import cd2datamanager.constants as constants
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from tqdm import tqdm
+from cd2datamanager.load_planner import LoadPlanner
 
 
 class SchemaWriter:
 
-    def __init__(self, logger, workspace, settings):
+    def __init__(self, logger, workspace, settings, manifest=None, metrics=None):
         self.logger = logger
         self.workspace = workspace
         self.settings = settings
+        self.manifest = manifest
+        self.metrics = metrics
 
-    def write(self, schema, tsv_files = None):
-        self.logger.detail("Starting SQL File Generation")
-        self.logger.debug(f"Writing file to SQL Root {self.workspace.sql}")
+        # One timestamp for every script of the run
+        self.generated = datetime.utcnow()
+        self._executor = None
 
-        pbar = tqdm(total=len(schema)) if not self.logger.is_debug else None
+    @property
+    def workers(self) -> int:
+        return max(1, self.settings.sql_workers or 1)
 
-        source_files = []
-        for key, schema in schema.items():
-            tsv_file = tsv_files.get(key, None) if tsv_files is not None else None
-            source_files.append(self.write_table_sql(schema, pbar, tsv_file))
+    @property
+    def generated_text(self) -> str:
+        return self.generated.strftime('%m/%d/%Y %I:%M:%S %p Zulu')
 
-        self.write_control_sql(source_files)
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
 
-        if pbar is not None:
-            pbar.close()
+    async def write_one(self, schema, tsv_file, incremental = False) -> str:
+        # Renders and writes on the threads started by start() - the manifest and metrics stay on the event loop
+        resumed_file = self.resumed_file(schema.table_name)
+        if resumed_file is not None:
+            return resumed_file
 
-        self.logger.detail("Completed SQL File Generation")
+        workspace_file, seconds = await asyncio.get_running_loop().run_in_executor(self._executor, self.write_sql_file, schema, tsv_file, incremental)
+        return self.record(schema, tsv_file, workspace_file, seconds)
 
-    def write_table_sql(self, schema, pbar, tsv_file) -> str:
-        workspace_file = f"{self.workspace.sql}/{schema.table_name}.sql"
+    def finish(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
 
-        self.logger.debug(f"Starting creating sql file: {workspace_file}")
+    def resumed_file(self, table_name):
+        resumed_file = self.manifest.sql_file(table_name) if self.manifest is not None else None
+        if resumed_file is not None:
+            self.logger.debug(f"Sql file already created - reusing {resumed_file}")
 
-        with open(workspace_file, 'w', encoding="UTF-8") as sql_file:
-            sql_file.write(f"#\n# Sql Create for Table: {schema.table_name}\n")
-            sql_file.write(f"# Generated: {datetime.utcnow()}\n")
+        return resumed_file
 
-            if tsv_file is not None and self.settings.include_sql_load:
-                sql_file.write("# Including SQL Load script")
+    def write_sql_file(self, schema, tsv_file, incremental = False) -> tuple:
+        workspace_file = f"{self.workspace.sql}/{schema.table_name}.sql"
 
-            self.header_commen(sql_file)
-            sql_file.write(schema.table_sql())
-            sql_file.write("\n")
+        self.logger.debug(f"Starting creating sql file: {workspace_file}")
+        start = time.perf_counter()
+
+        # Built in memory and written in one go
+        self.write_file(workspace_file, self.table_sql(schema, tsv_file, incremental))
 
-            if tsv_file is not None and self.settings.include_sql_load:
-                sql_file.write("\n\n")
-                sql_file.write("# Sql Load\n\n")
-                sql_file.write(schema.load_file(tsv_file))
-                sql_file.write("\n")
+        return workspace_file, time.perf_counter() - start
 
-            self.finish_sql_file(sql_file)
+    def record(self, schema, tsv_file, workspace_file, seconds) -> str:
+        if self.manifest is not None:
+            self.manifest.record_sql(schema.table_name, workspace_file)
 
-        if pbar is not None:
-            pbar.update(1)
+        if self.metrics is not None:
+            self.metrics.add(
+                schema.table_name,
+                "sql",
+                seconds=seconds,
+                bytes_out=os.path.getsize(workspace_file),
+                rows=tsv_file.get(constants.tsv_detail_row_count, None) if tsv_file is not None else None)
 
         self.logger.debug(f"Completed creating sql file: {workspace_file}")
 
         return os.path.abspath(workspace_file)
 
-    def write_control_sql(self, sources):
+    def table_sql(self, schema, tsv_file, incremental = False) -> str:
+        include_load = tsv_file is not None and self.settings.include_sql_load
+
+        sql = list()
+        sql.append(f"#\n# Sql Create for Table: {schema.table_name}\n")
+        sql.append(f"# Generated: {self.generated}\n")
+
+        if include_load:
+            sql.append("# Including SQL Load script")
+
+        sql.append(self.header_comment())
+
+        if incremental:
+            # Incremental changes are merged into the existing table - never drop it
+            if include_load:
+                sql.append("# Sql Incremental Merge\n\n")
+                sql.append(schema.merge_file(tsv_file))
+                sql.append("\n")
+
+        else:
+            sql.append(schema.table_sql())
+            sql.append("\n")
+
+            if include_load:
+                sql.append("\n\n")
+                sql.append("# Sql Load\n\n")
+                sql.append(schema.load_file(tsv_file))
+                sql.append("\n")
+
+        sql.append(self.footer_comment())
+        return "".join(sql)
+
+    def write_control_sql(self, sources, costs = None):
         workspace_file = f"{self.workspace.sql}/load_all.sql"
 
         self.logger.debug("Staring creation of build all sql file")
 
-        with open(workspace_file, 'w', encoding="UTF-8") as sql_file:
-            sql_file.write("#\n")
-            sql_file.write("# build_all.sql\n")
-            self.header_commen(sql_file)
+        # The table scripts share no foreign keys, so they can run in any order and over any number of sessions
+        planner = LoadPlanner(self.logger, self.settings)
+        costs = {table_name: (costs or {}).get(table_name, constants.load_table_cost_bytes) for table_name in sources}
+        sessions = planner.plan(costs)
+        waves = planner.waves(sessions, costs)
 
-            for source_file in sources:
-                sql_file.write(f"select 'Executing {source_file}';\n")
-                sql_file.write(f"source {source_file}\n")
-                sql_file.write("\n")
+        # A single session runs the waves one after the other
+        self.write_file(workspace_file, self.control_sql("build_all.sql", [(f"# Wave {wave_index + 1}\n", [entry["table"] for entry in wave]) for wave_index, wave in enumerate(waves)], sources))
 
-            sql_file.write(f"select 'Completed -> {datetime.utcnow().strftime('%m/%d/%Y %I:%M:%S %p Zulu')}'")
-            self.finish_sql_file(sql_file)
+        session_files = self.write_session_sql(sessions, sources)
+        self.write_load_plan(session_files, sessions, waves, costs)
+        planner.log_plan(sessions, costs)
 
         self.logger.debug("Completed creation of build all sql file")
         self.logger.detail(f"build_all.sql file located at {os.path.abspath(workspace_file)}")
 
-    @staticmethod
-    def header_commen(sql_file):
-        sql_file.write("# Generated by Tiber Health Innovation's Canvas Data 2 Create Table Script Generator")
-        sql_file.write("# \n")
-        sql_file.write(f"# Generated: {datetime.utcnow().strftime('%m/%d/%Y %I:%M:%S %p Zulu')}")
-        sql_file.write("# \n")
-        sql_file.write("# This file is auto generated and edits will not be preserved.\n")
-        sql_file.write("# \n\n")
+    def write_session_sql(self, sessions, sources) -> list:
+        # Scripts left by an earlier run with more sessions would load tables twice
+        for old_file in glob.glob(f"{self.workspace.sql}/{constants.load_session_prefix}*.sql"):
+            os.remove(old_file)
+
+        session_files = []
+        for session_index, session in enumerate(sessions):
+            session_file = os.path.abspath(f"{self.workspace.sql}/{constants.load_session_prefix}{session_index + 1:02d}.sql")
+            self.write_file(session_file, self.control_sql(os.path.basename(session_file), [(None, session)], sources))
+            session_files.append(session_file)
+
+        return session_files
+
+    def write_load_plan(self, session_files, sessions, waves, costs):
+        with open(f"{self.workspace.sql}/{constants.load_plan_file}", 'w', encoding="UTF-8") as json_file:
+            json.dump({
+                "generated": self.generated.isoformat(),
+                "cost_unit": "estimated bytes loaded",
+                "sessions": [{
+                    "session": session_index + 1,
+                    "script": session_files[session_index],
+                    "tables": session,
+                    "cost": sum(costs[table_name] for table_name in session)
+                } for session_index, session in enumerate(sessions)],
+                "waves": [{"wave": wave_index + 1, "tables": wave} for wave_index, wave in enumerate(waves)]
+            }, json_file, indent=2)
+
+    def control_sql(self, title, sections, sources) -> str:
+        sql = list()
+        sql.append("#\n")
+        sql.append(f"# {title}\n")
+        sql.append(self.header_comment())
+
+        for comment, table_names in sections:
+            if comment is not None:
+                sql.append(comment)
+
+            for table_name in table_names:
+                sql.append(f"select 'Executing {sources[table_name]}';\n")
+                sql.append(f"source {sources[table_name]}\n")
+                sql.append("\n")
+
+        sql.append(f"select 'Completed -> {self.generated_text}'")
+        sql.append(self.footer_comment())
+        return "".join(sql)
 
     @staticmethod
-    def finish_sql_file(sql_file):
-        sql_file.write("\n")  # Add a blank line before script copyright
-        sql_file.write("## Generated by Tiber Health Innovation's Canvas Data 2 Create Table Script Generator ")
-        sql_file.write(f"-  (c) {datetime.utcnow().strftime('%Y')} - Tiber Health\n")
-        sql_file.write("\n")  # Add a blank line at the end of the file
-        sql_file.flush()
-        sql_file.close()
+    def write_file(workspace_file, sql):
+        with open(workspace_file, 'w', encoding="UTF-8") as sql_file:
+            sql_file.write(sql)
+
+    def header_comment(self) -> str:
+        return (
+            "# Generated by Tiber Health Innovation's Canvas Data 2 Create Table Script Generator"
+            "# \n"
+            f"# Generated: {self.generated_text}"
+            "# \n"
+            "# This file is auto generated and edits will not be preserved.\n"
+            "# \n\n")
+
+    def footer_comment(self) -> str:
+        return (
+            "\n"  # Add a blank line before script copyright
+            "## Generated by Tiber Health Innovation's Canvas Data 2 Create Table Script Generator "
+            f"-  (c) {self.generated.strftime('%Y')} - Tiber Health\n"
+            "\n")  # Add a blank line at the end of the file
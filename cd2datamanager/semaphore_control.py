@@ -1,31 +1,136 @@
-from asyncio import Lock, Semaphore
+import asyncio
+import time
+import cd2datamanager.constants as constants
+
+from cd2datamanager.retry_policy import RetryPolicy
 
 
 class SemaphoreControl:
 
-    def __init__(self, settings, logger):
+    # Additive increase, multiplicative decrease - the download limit grows by one slot per round of completed
+    # downloads while throughput keeps up, and is cut on throttling or when most of a round fails
+    def __init__(self, settings, logger, budget=None):
         self._settings = settings
         self._logger = logger
+        self._budget = budget
         self.active_semaphores = 0
 
-        self.semaphore = self.initialize_semaphores()
+        self.min_limit = max(1, min(settings.min_concurrent_limit or 1, settings.concurrent_limit))
+        self.max_limit = max(settings.concurrent_limit, settings.max_concurrent_limit or settings.concurrent_limit)
+        self.limit = settings.concurrent_limit
+        self.peak_limit = self.limit
+
+        self.throttle_count = 0
+        self.error_count = 0
+
+        self._condition = asyncio.Condition()
+        self._last_decrease = None
+        self._previous_throughput = None
+        self._start_round()
+
+        self._logger.debug(f"Setting download concurrency to {self.limit} threads - {'adaptive between ' + str(self.min_limit) + ' and ' + str(self.max_limit) if self.is_adaptive else 'fixed'}")
 
     @property
     def concurrent_limit(self) -> int:
-        return self._settings.concurrent_limit
+        return self.limit
+
+    @property
+    def is_adaptive(self) -> bool:
+        return self._settings.adaptive_concurrency and self.min_limit < self.max_limit
 
-    def initialize_semaphores(self) -> Semaphore:
-        self._logger.debug(f"Setting download concurrency to {self.concurrent_limit} threads")
-        return Semaphore(self.concurrent_limit)
+    def _start_round(self):
+        self._round_start = time.perf_counter()
+        self._round_bytes = 0
+        self._round_successes = 0
+        self._round_errors = 0
 
     async def acquire(self):
-        async with Lock():
-            await self.semaphore.acquire()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active_semaphores < self.limit)
             self.active_semaphores += 1
-            self._logger.debug(f"Semaphore acquired - active {self.active_semaphores}")
+            self._logger.debug(f"Semaphore acquired - active {self.active_semaphores} of {self.limit}")
+
+        if self._budget is None:
+            return
+
+        # In a batch the slot also needs one of the download slots shared by all tenants
+        try:
+            await self._budget.acquire(self)
+        except BaseException:
+            await self._release_slot()
+            raise
 
     async def release(self):
-        async with Lock():
-            self.semaphore.release()
+        if self._budget is not None:
+            await self._budget.release(self)
+
+        await self._release_slot()
+
+    async def _release_slot(self):
+        async with self._condition:
             self.active_semaphores -= 1
-            self._logger.debug(f"Semaphore released - active {self.active_semaphores}")
\ No newline at end of file
+            self._condition.notify_all()
+            self._logger.debug(f"Semaphore released - active {self.active_semaphores} of {self.limit}")
+
+    async def record_success(self, size = 0):
+        if not self.is_adaptive:
+            return
+
+        async with self._condition:
+            self._round_bytes += size or 0
+            self._round_successes += 1
+            self._end_round()
+
+    async def record_error(self, error):
+        self.error_count += 1
+        if not self.is_adaptive:
+            return
+
+        async with self._condition:
+            if RetryPolicy.is_throttled(error):
+                self.throttle_count += 1
+                self._decrease("the API is throttling requests")
+                self._previous_throughput = None
+                self._start_round()
+                return
+
+            self._round_errors += 1
+            self._end_round()
+
+    def _end_round(self):
+        # One round is as many finished download attempts as there are slots
+        if self._round_successes + self._round_errors < self.limit:
+            return
+
+        elapsed = max(time.perf_counter() - self._round_start, 0.001)
+        throughput = self._round_bytes / elapsed
+        error_rate = self._round_errors / (self._round_successes + self._round_errors)
+
+        if error_rate > 0.5:
+            self._decrease(f"{error_rate:.0%} of the last downloads failed")
+        elif self._previous_throughput is None or throughput >= self._previous_throughput * 0.9:
+            self._increase(throughput)
+        else:
+            self._logger.debug(f"Download throughput dropped to {throughput / (1024 * 1024):,.1f} MB/s - holding concurrency at {self.limit}")
+
+        self._previous_throughput = throughput
+        self._start_round()
+
+    def _increase(self, throughput):
+        if self.limit >= self.max_limit:
+            return
+
+        self.limit += 1
+        self.peak_limit = max(self.peak_limit, self.limit)
+        self._condition.notify_all()
+        self._logger.debug(f"Download throughput {throughput / (1024 * 1024):,.1f} MB/s - raising concurrency to {self.limit}, {self.active_semaphores} in flight")
+
+    def _decrease(self, reason):
+        # In-flight downloads fail together - only back off once per cool-down so a burst of errors counts once
+        now = time.perf_counter()
+        if self.limit <= self.min_limit or (self._last_decrease is not None and now - self._last_decrease < constants.concurrency_cooldown_seconds):
+            return
+
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._logger.detail(f"Lowering download concurrency to {self.limit} - {reason}, {self.active_semaphores} in flight")
@@ -10,16 +10,41 @@ class Settings:
 
     def __init__(self,
                  concurrent_limit=constants.default_concurrent_limit,
+                 adaptive_concurrency = True,
+                 min_concurrent_limit = constants.default_min_concurrent_limit,
+                 max_concurrent_limit = None,
+                 schema_concurrent_limit = constants.default_schema_concurrent_limit,
                  max_download_attempts=constants.default_max_download_attempts,
                  semaphore_timeout_seconds=constants.default_semaphore_timeout_seconds,
                  max_lock_attempts= constants.default_max_lock_attempts,
                  sleep_between_attempts_seconds = constants.default_sleep_between_attempts_seconds,
+                 max_retry_delay_seconds = constants.default_max_retry_delay_seconds,
+                 retry_budget = constants.default_retry_budget,
                  thread_pause = constants.default_thread_pause,
+                 decompress_workers = constants.default_decompress_workers,
+                 memory_budget_mb = constants.default_memory_budget_mb,
+                 sql_workers = constants.default_sql_workers,
+                 stream_tsv = False,
+                 redownload_corrupt = True,
+                 tsv_shard_size_mb = constants.default_tsv_shard_size_mb,
+                 tsv_shard_per_part = False,
+                 tsv_compression = constants.tsv_compression_none,
+                 tsv_compression_level = constants.default_tsv_compression_level,
+                 tsv_compression_threads = constants.default_tsv_compression_threads,
+                 profile_tsv = False,
+                 profile_margin_percent = constants.default_profile_margin_percent,
+                 output_format = constants.default_output_format,
+                 parquet_row_group_rows = constants.default_parquet_row_group_rows,
+                 parquet_compression = constants.default_parquet_compression,
                  log_level=constants.default_log_level.name,
                  schema_only = False,
                  no_schema = False,
+                 schema_cache = True,
+                 refresh_schema = False,
                  include_sql_load = True,
+                 incremental = False,
                  import_warnings = False,
+                 resume = False,
                  workspace_root = constants.default_root_workspace,
                  tsv_workspace = None,
                  sql_workspace = None,
@@ -27,24 +52,61 @@ class Settings:
                  env_locale = "en_US.UTF-8",
                  tables = None,
                  excluded_tables = None,
+                 load_database = False,
+                 load_concurrent_limit = constants.default_load_concurrent_limit,
                  dap_yaml_file=constants.default_dap_yaml,
+                 mysql_yaml_file=constants.default_mysql_yaml,
+                 metrics_textfile = None,
+                 batch_yaml_file = None,
+                 batch_concurrent_limit = constants.default_batch_concurrent_limit,
                  settings_yaml_file=constants.default_settings_yaml):
 
         self.concurrent_limit = concurrent_limit
+        self.adaptive_concurrency = adaptive_concurrency
+        self.min_concurrent_limit = min_concurrent_limit
+        self.max_concurrent_limit = max_concurrent_limit
+        self.schema_concurrent_limit = schema_concurrent_limit
         self.max_download_attempts = max_download_attempts
         self.semaphore_timeout_seconds = semaphore_timeout_seconds
         self.max_lock_attempts = max_lock_attempts
         self.sleep_between_attempts_seconds = sleep_between_attempts_seconds
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+        self.retry_budget = retry_budget
         self.thread_pause = thread_pause
+        self.decompress_workers = decompress_workers
+        self.memory_budget_mb = memory_budget_mb
+        self.sql_workers = sql_workers
+        self.stream_tsv = stream_tsv
+        self.redownload_corrupt = redownload_corrupt
+        self.tsv_shard_size_mb = tsv_shard_size_mb
+        self.tsv_shard_per_part = tsv_shard_per_part
+        self.tsv_compression = tsv_compression
+        self.tsv_compression_level = tsv_compression_level
+        self.tsv_compression_threads = tsv_compression_threads
+        self.profile_tsv = profile_tsv
+        self.profile_margin_percent = profile_margin_percent
+        self.output_format = output_format
+        self.parquet_row_group_rows = parquet_row_group_rows
+        self.parquet_compression = parquet_compression
         self.schema_only = schema_only
         self.include_sql_load = include_sql_load
+        self.incremental = incremental
         self.import_warnings = import_warnings
         self.no_schema = no_schema
+        self.schema_cache = schema_cache
+        self.refresh_schema = refresh_schema
+        self.metrics_textfile = metrics_textfile
+        self.batch_yaml_file = batch_yaml_file
+        self.batch_concurrent_limit = batch_concurrent_limit
         self.env_locale = env_locale
         self.tables = tables
         self.excluded_tables = excluded_tables
+        self.load_database = load_database
+        self.load_concurrent_limit = load_concurrent_limit
         self.dap_yaml_file = dap_yaml_file
+        self.mysql_yaml_file = mysql_yaml_file
 
+        self.resume = resume
         self.workspace_root = workspace_root
         self.tsv_workspace = tsv_workspace
         self.sql_workspace = sql_workspace
@@ -67,21 +129,52 @@ class Settings:
                 return
 
             self.concurrent_limit = config.get("concurrent_limit", self.concurrent_limit)
+            self.adaptive_concurrency = config.get("adaptive_concurrency", self.adaptive_concurrency)
+            self.min_concurrent_limit = config.get("min_concurrent_limit", self.min_concurrent_limit)
+            self.max_concurrent_limit = config.get("max_concurrent_limit", self.max_concurrent_limit)
+            self.schema_concurrent_limit = config.get("schema_concurrent_limit", self.schema_concurrent_limit)
             self.max_download_attempts = config.get("max_download_attempts", self.max_download_attempts)
             self.semaphore_timeout_seconds = config.get("semaphore_timeout_seconds", self.semaphore_timeout_seconds)
             self.max_lock_attempts = config.get("max_lock_attempts", self.max_lock_attempts)
             self.sleep_between_attempts_seconds = config.get("sleep_between_attempts_seconds", self.sleep_between_attempts_seconds)
+            self.max_retry_delay_seconds = config.get("max_retry_delay_seconds", self.max_retry_delay_seconds)
+            self.retry_budget = config.get("retry_budget", self.retry_budget)
             self.thread_pause = config.get("thread_pause", self.thread_pause)
+            self.decompress_workers = config.get("decompress_workers", self.decompress_workers)
+            self.memory_budget_mb = config.get("memory_budget_mb", self.memory_budget_mb)
+            self.sql_workers = config.get("sql_workers", self.sql_workers)
+            self.stream_tsv = config.get("stream_tsv", self.stream_tsv)
+            self.redownload_corrupt = config.get("redownload_corrupt", self.redownload_corrupt)
+            self.tsv_shard_size_mb = config.get("tsv_shard_size_mb", self.tsv_shard_size_mb)
+            self.tsv_shard_per_part = config.get("tsv_shard_per_part", self.tsv_shard_per_part)
+            self.tsv_compression = config.get("tsv_compression", self.tsv_compression)
+            self.tsv_compression_level = config.get("tsv_compression_level", self.tsv_compression_level)
+            self.tsv_compression_threads = config.get("tsv_compression_threads", self.tsv_compression_threads)
+            self.profile_tsv = config.get("profile_tsv", self.profile_tsv)
+            self.profile_margin_percent = config.get("profile_margin_percent", self.profile_margin_percent)
+            self.output_format = config.get("output_format", self.output_format)
+            self.parquet_row_group_rows = config.get("parquet_row_group_rows", self.parquet_row_group_rows)
+            self.parquet_compression = config.get("parquet_compression", self.parquet_compression)
             self.schema_only = config.get("schema_only", self.schema_only)
             self.schema_only = config.get("no_schema", self.schema_only)
+            self.schema_cache = config.get("schema_cache", self.schema_cache)
+            self.refresh_schema = config.get("refresh_schema", self.refresh_schema)
             self.include_sql_load = config.get("include_sql_load", self.include_sql_load)
+            self.incremental = config.get("incremental", self.incremental)
             self.import_warnings = config.get("import_warnings", self.import_warnings)
             self.env_locale = config.get("env_locale", self.env_locale)
             self.tables = config.get("tables", self.tables)
             self.excluded_tables = config.get("excluded_tables", self.excluded_tables)
+            self.load_database = config.get("load_database", self.load_database)
+            self.load_concurrent_limit = config.get("load_concurrent_limit", self.load_concurrent_limit)
 
             self.dap_yaml_file = config.get("dap_yaml_file", self.dap_yaml_file)
+            self.mysql_yaml_file = config.get("mysql_yaml_file", self.mysql_yaml_file)
+            self.metrics_textfile = config.get("metrics_textfile", self.metrics_textfile)
+            self.batch_yaml_file = config.get("batch_yaml_file", self.batch_yaml_file)
+            self.batch_concurrent_limit = config.get("batch_concurrent_limit", self.batch_concurrent_limit)
 
+            self.resume = config.get("resume", self.resume)
             self.workspace_root = config.get("workspace_root", self.workspace_root)
             self.tsv_workspace = config.get("csv_workspace", self.tsv_workspace)
             self.sql_workspace = config.get("sql_workspace", self.sql_workspace)
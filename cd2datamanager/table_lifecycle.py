@@ -0,0 +1,240 @@
+import asyncio
+
+import cd2datamanager.constants as constants
+
+from tqdm import tqdm
+from cd2datamanager.schema_writer import SchemaWriter
+from cd2datamanager.format_converter import FormatConverter
+from cd2datamanager.mysql_loader import MySqlLoader
+from cd2datamanager.load_planner import LoadPlanner
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+class TableLifecycle:
+
+    # Completes every table as soon as its schema and TSV files are ready and drops its state once its SQL is written
+    def __init__(self, logger, workspace, settings, manifest=None, metrics=None, tsv_generator=None):
+        self._logger = logger
+        self._workspace = workspace
+        self._settings = settings
+        self._tsv_generator = tsv_generator
+
+        self._schema_writer = SchemaWriter(logger, workspace, settings, manifest, metrics) if not settings.no_schema else None
+        self._converter = FormatConverter(logger, workspace, settings) if not settings.schema_only and settings.output_format.lower() != constants.output_format_tsv else None
+        self._loader = MySqlLoader(logger, settings) if settings.load_database and not settings.no_schema else None
+
+        # Filled by the DAP client and emptied table by table as they complete
+        self.schema = dict()
+        self.files = dict()
+        self.incremental = set()
+
+        self.sql_files = dict()
+        self.load_costs = dict()
+        self.timestamps = dict()
+        self.failures = dict()
+        self.completed_count = 0
+
+        self._stages = dict()
+        self._tsv_details = dict()
+        self._tasks = set()
+        self._pbar = None
+
+        self._admitted = dict()
+        self._memory_in_use = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def required_stages(self) -> set:
+        stages = set()
+        if not self._settings.no_schema:
+            stages.add(constants.lifecycle_stage_schema)
+
+        if not self._settings.schema_only:
+            stages.update([constants.lifecycle_stage_download, constants.lifecycle_stage_tsv])
+
+        return stages
+
+    @property
+    def memory_budget(self) -> int:
+        return max(0, self._settings.memory_budget_mb or 0) * 1024 * 1024
+
+    @property
+    def table_memory(self) -> int:
+        # Estimate of one table in flight - its state, the TSV block buffers and the compression and conversion buffers
+        memory = constants.lifecycle_table_state_bytes + constants.tsv_copy_block_size + constants.compressed_read_block_size
+
+        if self._settings.stream_tsv:
+            # The parts read ahead of the one being decoded
+            memory += constants.stream_part_concurrency * constants.stream_prefetch_blocks * constants.tsv_copy_block_size
+
+        if TsvCompression.is_compressed(self._settings.tsv_compression):
+            memory += constants.tsv_compression_block_size * 2 * max(1, self._settings.tsv_compression_threads or 1)
+
+        if self._converter is not None:
+            memory += self._settings.parquet_row_group_rows * constants.lifecycle_converted_row_bytes
+
+        return memory
+
+    async def start(self):
+        if self._schema_writer is not None:
+            self._schema_writer.start()
+
+        if self._converter is not None:
+            self._converter.start()
+
+        if self._loader is not None:
+            await self._loader.start()
+
+        self._pbar = tqdm(total=0, position=2, desc="Completing") if not self._logger.is_debug else None
+
+    def schedule(self, tables):
+        for table in tables:
+            if table in self._stages:
+                # Scheduled again to be downloaded once more - the schema is kept
+                self._stages[table] -= {constants.lifecycle_stage_download, constants.lifecycle_stage_tsv}
+                continue
+
+            self._stages[table] = set()
+            if self._pbar is not None:
+                self._pbar.total += 1
+                self._pbar.refresh()
+
+    async def admit(self, table):
+        if self.memory_budget <= 0 or table in self._admitted:
+            return
+
+        table_memory = self.table_memory
+        async with self._condition:
+            # One table is always let through, however small the budget
+            await self._condition.wait_for(lambda: self._memory_in_use <= 0 or self._memory_in_use + table_memory <= self.memory_budget)
+
+            self._admitted[table] = table_memory
+            self._memory_in_use += table_memory
+            self._logger.debug(f"Table {table} admitted - {self._memory_in_use // (1024 * 1024)} of {self.memory_budget // (1024 * 1024)} MB in use")
+
+    async def _release_memory(self, table):
+        table_memory = self._admitted.pop(table, 0)
+        if table_memory <= 0:
+            return
+
+        async with self._condition:
+            self._memory_in_use -= table_memory
+            self._condition.notify_all()
+
+    def schema_ready(self, table):
+        self._reached(table, constants.lifecycle_stage_schema)
+
+    def downloaded(self, table, asset):
+        if self._tsv_generator is not None:
+            self._tsv_generator.submit(table, asset)
+
+        self._reached(table, constants.lifecycle_stage_download)
+
+    def converted(self, table, tsv_details):
+        if self._tsv_generator is not None and table in self._tsv_generator.corrupt_tables:
+            # Waits for the download to be retried - give its memory back meanwhile
+            self._create_task(self._release_memory(table))
+            return
+
+        self._tsv_details[table] = tsv_details
+        self._reached(table, constants.lifecycle_stage_tsv)
+
+    def _reached(self, table, stage):
+        stages = self._stages.get(table, None)
+        if stages is None:
+            # Discarded before its schema arrived - do not hold on to it
+            self.schema.pop(table, None)
+            return
+
+        stages.add(stage)
+        if self.required_stages <= stages:
+            self._stages.pop(table)
+            self._create_task(self._complete(table))
+
+    def _create_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _complete(self, table):
+        table_schema = self.schema.get(table, None)
+        tsv_file = self._tsv_details.get(table, None)
+        incremental = table in self.incremental
+
+        try:
+            if self._settings.profile_tsv and table_schema is not None and tsv_file is not None:
+                # Size the text and decimal columns from the data before the table script or file is built
+                table_schema.profile = tsv_file.get(constants.tsv_detail_profile, None)
+
+            if self._converter is not None and tsv_file is not None:
+                try:
+                    await self._converter.convert_one(table, table_schema, tsv_file)
+                except Exception as e:
+                    # The SQL script is still written from the TSV files, but the table is reported as failed
+                    self.failures[table] = e
+
+            if self._schema_writer is not None and table_schema is not None:
+                self.sql_files[table] = await self._schema_writer.write_one(table_schema, tsv_file, incremental)
+                self.load_costs[table] = LoadPlanner.cost(tsv_file)
+
+            if self._loader is not None and table_schema is not None:
+                await self._loader.load_one(table_schema, tsv_file, incremental)
+
+            # A failed table keeps its incremental watermark, so the next run pulls its changes again
+            asset = self.files.get(table, None)
+            if asset is not None and table not in self.failures:
+                self.timestamps[table] = asset.timestamp
+
+            self.completed_count += 1
+
+        finally:
+            await self.release(table)
+
+        if self._pbar is not None:
+            self._pbar.update(1)
+
+    async def release(self, table):
+        self.schema.pop(table, None)
+        self.files.pop(table, None)
+        self._tsv_details.pop(table, None)
+        await self._release_memory(table)
+
+        self._logger.debug(f"Released table {table}")
+
+    async def discard(self, table):
+        # A failed or corrupt table gets no SQL script
+        self._stages.pop(table, None)
+        await self.release(table)
+
+    async def finish(self) -> dict:
+        try:
+            while len(self._tasks) > 0:
+                await asyncio.gather(*list(self._tasks))
+
+            # Tables that never got all their stages - their schema arrived for a failed download
+            for table in list(self._stages):
+                await self.discard(table)
+
+        finally:
+            load_results = await self.close()
+
+        if self._schema_writer is not None and len(self.sql_files) > 0:
+            self._schema_writer.write_control_sql(self.sql_files, self.load_costs)
+
+        self._logger.detail(f"Completed {self.completed_count} tables")
+        return load_results
+
+    async def close(self):
+        if self._schema_writer is not None:
+            self._schema_writer.finish()
+
+        if self._converter is not None:
+            self._converter.finish()
+
+        load_results = await self._loader.finish() if self._loader is not None else None
+
+        if self._pbar is not None:
+            self._pbar.close()
+            self._pbar = None
+
+        return load_results
@@ -0,0 +1,51 @@
+import heapq
+
+
+class TableScheduler:
+
+    def __init__(self, logger, settings, manifest=None):
+        self._logger = logger
+        self._settings = settings
+        self._manifest = manifest
+
+    @property
+    def slots(self) -> int:
+        return max(1, self._settings.concurrent_limit or 1)
+
+    def order(self, tables) -> list:
+        if self._manifest is None:
+            return list(tables)
+
+        sizes = {table: self._manifest.expected_size(table) for table in tables}
+
+        # Tables without a previous size could be any size, so they are started first alongside the largest known ones
+        unknown_tables = [table for table in tables if sizes[table] is None]
+        known_tables = sorted([table for table in tables if sizes[table] is not None], key=lambda table: sizes[table], reverse=True)
+
+        if len(known_tables) > 0:
+            self.log_plan(known_tables, sizes)
+
+        if len(unknown_tables) > 0:
+            self._logger.debug(f"No previous size for {len(unknown_tables)} tables - scheduling them first")
+
+        return unknown_tables + known_tables
+
+    def plan(self, tables, sizes) -> list:
+        # Longest processing time first - each table goes to the slot that frees up first
+        slot_loads = [(0, slot) for slot in range(self.slots)]
+        heapq.heapify(slot_loads)
+
+        for table in tables:
+            load, slot = heapq.heappop(slot_loads)
+            heapq.heappush(slot_loads, (load + sizes[table], slot))
+
+        return sorted(load for load, slot in slot_loads)
+
+    def log_plan(self, tables, sizes):
+        slot_loads = self.plan(tables, sizes)
+        total_size = sum(slot_loads)
+        mb = 1024 * 1024
+
+        self._logger.debug(f"Scheduling {len(tables)} tables largest first across {self.slots} download slots - "
+                           f"{total_size / mb:,.1f} MB expected, busiest slot {slot_loads[-1] / mb:,.1f} MB, "
+                           f"lightest slot {slot_loads[0] / mb:,.1f} MB")
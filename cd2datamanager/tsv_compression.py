@@ -0,0 +1,175 @@
+import asyncio
+import gzip
+import os
+import shutil
+
+import cd2datamanager.constants as constants
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelGzipWriter:
+
+    # pigz style - blocks are compressed on a thread pool (zlib releases the GIL) and written in order as gzip members
+    def __init__(self, file, level, threads):
+        self._file = file
+        self._level = level
+        self._threads = max(1, threads)
+        self._executor = ThreadPoolExecutor(max_workers=self._threads) if self._threads > 1 else None
+
+        self._buffer = bytearray()
+        self._pending = deque()
+
+    def write(self, block):
+        self._buffer += block
+        if len(self._buffer) >= constants.tsv_compression_block_size:
+            self._submit()
+
+    def _submit(self):
+        block = bytes(self._buffer)
+        self._buffer = bytearray()
+
+        if self._executor is None:
+            self._file.write(gzip.compress(block, compresslevel=self._level, mtime=0))
+            return
+
+        self._pending.append(self._executor.submit(gzip.compress, block, self._level, mtime=0))
+
+        # Bound the blocks held in memory to two per thread
+        while len(self._pending) > self._threads * 2:
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        try:
+            if len(self._buffer) > 0:
+                self._submit()
+
+            while len(self._pending) > 0:
+                self._file.write(self._pending.popleft().result())
+
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+
+            self._file.close()
+
+
+class TsvCompression:
+
+    extensions = {
+        constants.tsv_compression_gzip: ".gz",
+        constants.tsv_compression_zstd: ".zst"
+    }
+
+    decompress_commands = {
+        constants.tsv_compression_gzip: "gzip -dc",
+        constants.tsv_compression_zstd: "zstd -dc"
+    }
+
+    @staticmethod
+    def is_compressed(compression) -> bool:
+        return compression is not None and compression.lower() != constants.tsv_compression_none
+
+    @staticmethod
+    def validate(compression):
+        if not TsvCompression.is_compressed(compression):
+            return
+
+        if compression.lower() not in TsvCompression.extensions:
+            raise ValueError(f"Unknown TSV compression {compression} - use {constants.tsv_compression_none}, {', '.join(TsvCompression.extensions)}")
+
+        if compression.lower() == constants.tsv_compression_zstd:
+            TsvCompression.zstandard()
+
+    @staticmethod
+    def file_name(workspace_file, compression) -> str:
+        return f"{workspace_file}{TsvCompression.extensions[compression.lower()]}" if TsvCompression.is_compressed(compression) else workspace_file
+
+    @staticmethod
+    def compression_of(file_path):
+        return next((compression for compression, extension in TsvCompression.extensions.items() if file_path.endswith(extension)), None)
+
+    @staticmethod
+    def fifo_file(file_path) -> str:
+        return f"{os.path.splitext(file_path)[0]}{constants.tsv_fifo_extension}"
+
+    @staticmethod
+    def zstandard():
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("zstd TSV output requires zstandard - install it with 'pip install cd2datamanager[zstd]'") from e
+
+        return zstandard
+
+    @staticmethod
+    def open_writer(file_path, compression, level, threads):
+        output_file = open(file_path, 'wb')
+        if not TsvCompression.is_compressed(compression):
+            return output_file
+
+        if compression.lower() == constants.tsv_compression_zstd:
+            compressor = TsvCompression.zstandard().ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+            return compressor.stream_writer(output_file, closefd=True)
+
+        return ParallelGzipWriter(output_file, level, threads)
+
+    @staticmethod
+    def open_reader(file_path):
+        compression = TsvCompression.compression_of(file_path)
+        if compression == constants.tsv_compression_gzip:
+            return gzip.open(file_path, 'rb')
+
+        if compression == constants.tsv_compression_zstd:
+            return TsvCompression.zstandard().ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True, closefd=True)
+
+        return open(file_path, 'rb', buffering=constants.tsv_copy_block_size)
+
+    @staticmethod
+    def fifo_command(file_path) -> str:
+        # mysql client commands - the pipe is created before system returns, only the decompression runs in the background for LOAD DATA to read
+        fifo_file = TsvCompression.fifo_file(file_path)
+        decompress = TsvCompression.decompress_commands[TsvCompression.compression_of(file_path)]
+        return (
+            f"system rm -f '{fifo_file}' && mkfifo '{fifo_file}'\n"
+            f"system ( {decompress} '{file_path}' > '{fifo_file}'; rm -f '{fifo_file}' ) &\n")
+
+
+class TsvFifo:
+
+    # Feeds a compressed TSV through a named pipe for the length of one LOAD DATA LOCAL INFILE
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fifo_file = TsvCompression.fifo_file(file_path)
+        self._feeder = None
+
+    def _feed(self):
+        try:
+            with TsvCompression.open_reader(self.file_path) as reader, open(self.fifo_file, 'wb') as fifo:
+                shutil.copyfileobj(reader, fifo, constants.tsv_copy_block_size)
+        except BrokenPipeError:
+            pass # The load stopped reading - its error is reported by the load
+
+    async def __aenter__(self):
+        if os.path.exists(self.fifo_file):
+            os.remove(self.fifo_file)
+
+        os.mkfifo(self.fifo_file)
+        self._feeder = asyncio.get_running_loop().run_in_executor(None, self._feed)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # A load that failed before it opened the pipe leaves the feeder blocked - open the read end once to release it
+        while not self._feeder.done():
+            try:
+                os.close(os.open(self.fifo_file, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+
+            await asyncio.wait([self._feeder], timeout=0.1)
+
+        try:
+            await self._feeder
+        finally:
+            os.remove(self.fifo_file)
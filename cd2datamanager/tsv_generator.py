@@ -1,78 +1,258 @@
-import csv
-import gzip
-import io
+import asyncio
 import os.path
+import time
+import zlib
 import cd2datamanager.constants as constants
 
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from cd2datamanager.settings import Settings
+from cd2datamanager.tsv_writer import TsvShardWriter, TsvPartDecoder, TsvHeader
+from cd2datamanager.run_metrics import RunMetrics
+from cd2datamanager.integrity_check import IntegrityCheck
+from cd2datamanager.tsv_compression import TsvCompression
 
 
 class TsvGenerator:
 
-    def __init__(self, logger, workspace, settings):
+    def __init__(self, logger, workspace, settings, manifest=None, metrics=None):
         self._logger = logger
         self._workspace = workspace
+        self._settings = settings
+        self._manifest = manifest
+        self._metrics = metrics
+        self._integrity = IntegrityCheck(logger, workspace, settings, manifest)
 
-    def build(self, raw_meta) -> dict:
-        self._logger.detail(f"Start decompressing raw table files - {len(raw_meta)} files to decompress")
+        # Fail before anything is downloaded rather than in the first worker
+        TsvCompression.validate(settings.tsv_compression)
 
-        pbar = tqdm(total=len(raw_meta)) if not self._logger.is_debug else None
-        details = {}
+        self._executor = None
+        self._pending = []
+        self._streamed = {}
+        self._counted = set()
+        self._on_table_converted = None
+        self._pbar = None
 
-        for table, meta in raw_meta.items():
-            details[table] = self._decompress(table, meta, pbar)
+    @property
+    def workers(self) -> int:
+        return max(1, self._settings.decompress_workers or 1)
 
-        if pbar is not None:
-            pbar.close()
-
-        self._logger.detail(f"Completed decompressing RAW table files")
-        return details
+    @property
+    def corrupt_tables(self) -> dict:
+        return self._integrity.corrupt_tables
 
-    def _decompress(self, table, meta, pbar) -> dict:
-        workspace_file = os.path.abspath(f"{self._workspace.tsv}/{table}.tsv")
-        self._logger.debug(f"Starting decompressing {table} into {workspace_file}")
+    @property
+    def shard_size(self) -> int:
+        return max(0, self._settings.tsv_shard_size_mb or 0) * 1024 * 1024
 
-        tsv_details = {
-            constants.tsv_detail_headers: None,
-            constants.tsv_detail_file: workspace_file,
-            constants.tsv_detail_row_count: None
+    @property
+    def writer_options(self) -> dict:
+        # Handed to the worker processes, so plain values only
+        return {
+            "shard_size": self.shard_size,
+            "shard_per_part": self._settings.tsv_shard_per_part,
+            "profile": self._settings.profile_tsv,
+            "compression": self._settings.tsv_compression.lower(),
+            "compression_level": self._settings.tsv_compression_level,
+            "compression_threads": max(1, self._settings.tsv_compression_threads or 1)
         }
 
-        file_number = 0
-        row_counter = 0
-        with open(workspace_file, 'w', encoding="UTF-8") as tsv_file:
-            for datafile in meta.downloaded_files:
-                file_number += 1
-                with gzip.open(datafile, "rt", encoding="UTF-8") as compressed_file:
-                    if file_number >= 2:
-                        self._logger.debug(f"Decompressing {table} file #{file_number}")
-                        compressed_file.readline()
+    def start(self, on_table_converted=None):
+        self._logger.debug(f"Starting decompression pipeline with {self.workers} worker processes")
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._on_table_converted = on_table_converted
+        self._pending = []
+        self._streamed = {}
+        self._counted = set()
+        self._integrity.corrupt_tables = dict()
+        self._pbar = tqdm(total=0, position=1, desc="Decompressing") if not self._logger.is_debug else None
+
+    def submit(self, table, meta):
+        if table in self._streamed:
+            return
+
+        workspace_file = self.workspace_file(table)
+        self._logger.debug(f"Queueing decompression of {table} into {workspace_file}")
+
+        self._pending.append(asyncio.create_task(self._pipeline_decompress(table, workspace_file, list(meta.downloaded_files))))
+
+        if self._pbar is not None:
+            self._pbar.total += 1
+            self._pbar.refresh()
+
+    async def stream(self, session, table, table_data) -> dict:
+        # Decompresses the CD2 files while they download, so no raw gzip copy is written to disk
+        workspace_file = self.workspace_file(table)
+        self._logger.debug(f"Streaming {len(table_data.objects)} files of {table} into {workspace_file}")
+
+        # A retried table is only counted once
+        if self._pbar is not None and table not in self._counted:
+            self._counted.add(table)
+            self._pbar.total += 1
+            self._pbar.refresh()
+
+        loop = asyncio.get_running_loop()
+        writer = TsvShardWriter(workspace_file, **self.writer_options)
+        compressed_size = 0
+        decode_seconds = 0.0
+        parts = []
+
+        # The parts download side by side, but are decoded one after the other so their rows are never interleaved
+        semaphore = asyncio.Semaphore(constants.stream_part_concurrency)
+        queues = [asyncio.Queue(maxsize=constants.stream_prefetch_blocks) for _ in table_data.objects]
+        tasks = [asyncio.create_task(self._stream_part(session, semaphore, data_object, queue)) for data_object, queue in zip(table_data.objects, queues)]
+
+        try:
+            for data_object, queue in zip(table_data.objects, queues):
+                decoder = TsvPartDecoder(writer, TsvGenerator.process_headers, data_object.id)
+                while (chunk := await queue.get()) is not None:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+
+                    compressed_size += len(chunk)
+                    decode_start = time.perf_counter()
+                    await loop.run_in_executor(None, decoder.feed, chunk)
+                    decode_seconds += time.perf_counter() - decode_start
+
+                # A corrupt stream raises here and the download retries the whole table
+                decoder.close()
+                parts.append(decoder.part_details())
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            tsv_details = writer.close()
+
+        tsv_details[constants.tsv_detail_integrity] = {constants.integrity_expected_parts: len(table_data.objects), constants.integrity_parts: parts}
+
+        if self._manifest is not None:
+            self._manifest.record_size(table, compressed_size)
+
+        if self._metrics is not None:
+            self._metrics.add(table, "tsv", bytes_in=compressed_size)
+
+        self._streamed[table] = self._complete(table, tsv_details, self._pbar, seconds=decode_seconds)
+        self._converted(table, tsv_details)
+        return tsv_details
+
+    @staticmethod
+    async def _stream_part(session, semaphore, data_object, queue):
+        # Errors are handed to the decoding side through the queue so the download sees the original exception
+        try:
+            async with semaphore:
+                # Presigned URLs expire - each one is resolved right before its part is read
+                resource = (await session.get_resources([data_object]))[data_object.id]
+                async for stream in session.stream_resource(resource):
+                    async for chunk in stream.iter_chunked(constants.tsv_copy_block_size):
+                        await queue.put(chunk)
+
+            await queue.put(None)
+
+        except Exception as e:
+            await queue.put(e)
+
+    async def _pipeline_decompress(self, table, workspace_file, downloaded_files) -> tuple:
+        resumed_details = self._resumed_details(table)
+        if resumed_details is not None:
+            tsv_details = self._complete(table, resumed_details, self._pbar, False)
+        else:
+            tsv_details, seconds = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                RunMetrics.timed,
+                TsvGenerator.decompress_table,
+                workspace_file,
+                downloaded_files,
+                self.writer_options)
+
+            tsv_details = self._complete(table, tsv_details, self._pbar, seconds=seconds, source_files=downloaded_files)
+
+        self._converted(table, tsv_details)
+        return table, tsv_details
+
+    def _converted(self, table, tsv_details):
+        # Corrupt tables are reported too, so the caller can let go of them until they are downloaded again
+        if self._on_table_converted is not None:
+            self._on_table_converted(table, tsv_details)
 
-                    for line in compressed_file:
-                        row_counter += 1
-                        tsv_file.write(line)
-                        if row_counter == 1:
-                            tsv_details[constants.tsv_detail_headers] = self.process_headers(line)
+    async def finish(self) -> dict:
+        try:
+            details = dict(await asyncio.gather(*self._pending))
+            details.update(self._streamed)
 
-                    compressed_file.close()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._pending = []
+            self._streamed = {}
 
-            tsv_file.flush()
-            tsv_file.close()
+            if self._pbar is not None:
+                self._pbar.close()
+                self._pbar = None
+
+        self._logger.detail(f"Completed decompressing RAW table files - {len(details)} tables")
+        return details
+
+    def workspace_file(self, table) -> str:
+        return os.path.abspath(f"{self._workspace.tsv}/{table}.tsv")
+
+    def _resumed_details(self, table):
+        tsv_details = self._manifest.tsv_details(table) if self._manifest is not None else None
+        if tsv_details is not None:
+            self._logger.debug(f"Table {table} already decompressed - reusing {tsv_details[constants.tsv_detail_file]}")
+
+        return tsv_details
 
+    def _complete(self, table, tsv_details, pbar, record = True, seconds = None, source_files = None) -> dict:
         if pbar is not None:
             pbar.update(1)
 
-        row_counter -= 1 if tsv_details[constants.tsv_detail_headers] is not None else 0
-        tsv_details[constants.tsv_detail_row_count] = row_counter
-        self._logger.debug(f"Table {table} contains {Settings.readable_number(row_counter)} rows - including header row")
+        # A corrupt table is not recorded, so a resumed run decompresses it again
+        problems = self._integrity.verify(table, tsv_details, source_files) if record else []
+        if record and self._manifest is not None and len(problems) <= 0:
+            self._manifest.record_tsv(table, tsv_details)
+
+        if record and self._metrics is not None:
+            self._metrics.add(
+                table,
+                "tsv",
+                seconds=seconds,
+                bytes_in=RunMetrics.file_size(source_files) if source_files is not None else None,
+                bytes_out=RunMetrics.file_size([shard[constants.tsv_detail_file] for shard in TsvShardWriter.shard_details(tsv_details)]),
+                rows=tsv_details[constants.tsv_detail_row_count])
+
+        self._logger.debug(f"Table {table} contains {Settings.readable_number(tsv_details[constants.tsv_detail_row_count])} rows - excluding header row - in {len(TsvShardWriter.shard_details(tsv_details))} files")
         self._logger.debug(f"Completed decompressing {table}")
 
         return tsv_details
 
     @staticmethod
-    def process_headers(line) -> list:
-        csv_reader = csv.reader(io.StringIO(line.replace("\t", ",")))
-        results = [row for row in csv_reader]
+    def decompress_table(workspace_file, downloaded_files, writer_options = None) -> dict:
+        # Runs inside the worker processes, so it can only use picklable arguments and no logger
+        writer = TsvShardWriter(workspace_file, **(writer_options or {}))
+        parts = []
+
+        for datafile in downloaded_files:
+            decoder = TsvPartDecoder(writer, TsvGenerator.process_headers, os.path.basename(datafile))
+            try:
+                with open(datafile, "rb") as compressed_file:
+                    while chunk := compressed_file.read(constants.compressed_read_block_size):
+                        decoder.feed(chunk)
+
+                decoder.close()
+                parts.append(decoder.part_details())
+
+            except (EOFError, OSError, zlib.error) as e:
+                # Keep going so every corrupt part of the table is reported, not just the first
+                parts.append(decoder.part_details(e))
+                writer.end_part()
 
-        return results[0] if results is not None and len(results) > 0 else []
+        tsv_details = writer.close()
+        tsv_details[constants.tsv_detail_integrity] = {constants.integrity_expected_parts: len(downloaded_files), constants.integrity_parts: parts}
+
+        return tsv_details
+
+    @staticmethod
+    def process_headers(line) -> list:
+        return TsvHeader.parse(line)
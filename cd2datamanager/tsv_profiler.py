@@ -0,0 +1,73 @@
+import cd2datamanager.constants as constants
+
+
+class TsvProfiler:
+
+    # Tracks the widest value, the numeric digits and the nulls of every column while the TSV rows are written
+    def __init__(self):
+        self.columns = None
+        self._remainder = b""
+
+    def set_headers(self, fields):
+        self.columns = [field.name for field in fields]
+        column_count = len(self.columns)
+
+        self.max_length = [0] * column_count
+        self.nulls = [0] * column_count
+        self.values = [0] * column_count
+        self.integer_digits = [0] * column_count
+        self.scale = [0] * column_count
+        self.is_decimal = [True] * column_count
+
+    def feed(self, block):
+        if self.columns is None:
+            return
+
+        # Blocks are cut anywhere - carry the partial last row over to the next block
+        rows = block.split(b"\n")
+        rows[0] = self._remainder + rows[0]
+        self._remainder = rows.pop()
+
+        for row in rows:
+            self.profile_row(row)
+
+    def profile_row(self, row):
+        for index, value in enumerate(row.split(b"\t")[:len(self.columns)]):
+            if len(value) == 0 or value == b"\\N":
+                self.nulls[index] += 1
+                continue
+
+            self.values[index] += 1
+            if len(value) > self.max_length[index]:
+                self.max_length[index] = len(value)
+
+            if not self.is_decimal[index]:
+                continue
+
+            integer, _, fraction = value.lstrip(b"+-").partition(b".")
+            if (len(integer) > 0 and not integer.isdigit()) or (len(fraction) > 0 and not fraction.isdigit()) or len(integer) + len(fraction) == 0:
+                # Exponents and text can not be held in a sized DECIMAL
+                self.is_decimal[index] = False
+                continue
+
+            self.integer_digits[index] = max(self.integer_digits[index], len(integer.lstrip(b"0")))
+            self.scale[index] = max(self.scale[index], len(fraction.rstrip(b"0")))
+
+    def close(self) -> dict:
+        if self.columns is None:
+            return {}
+
+        if len(self._remainder) > 0:
+            self.profile_row(self._remainder)
+            self._remainder = b""
+
+        return {
+            name: {
+                constants.profile_max_length: self.max_length[index],
+                constants.profile_nulls: self.nulls[index],
+                constants.profile_values: self.values[index],
+                constants.profile_integer_digits: self.integer_digits[index],
+                constants.profile_scale: self.scale[index],
+                constants.profile_is_decimal: self.is_decimal[index] and self.values[index] > 0
+            } for index, name in enumerate(self.columns)
+        }
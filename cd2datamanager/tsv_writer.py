@@ -0,0 +1,245 @@
+import functools
+import hashlib
+import os.path
+import zlib
+import cd2datamanager.constants as constants
+
+from cd2datamanager.tsv_profiler import TsvProfiler
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+class TsvField:
+
+    # One header column of a CD2 TSV - key.id, value.name or meta.action split into its section and column name
+    def __init__(self, header):
+        section, _, name = header.partition('.')
+
+        self.header = header
+        self.section = section if len(name) > 0 else None
+        self.name = name if len(name) > 0 else section
+
+
+class TsvHeader:
+
+    @staticmethod
+    def parse(line) -> list:
+        # The header is plain tab separated text - column names never hold tabs, but may hold commas or quotes
+        line = line.rstrip("\r\n")
+        return line.split("\t") if len(line) > 0 else []
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _fields(headers) -> tuple:
+        return tuple(TsvField(header) for header in headers)
+
+    @staticmethod
+    def fields(headers) -> tuple:
+        # Split once per distinct header - every shard of a table shares it
+        return TsvHeader._fields(tuple(headers))
+
+
+class TsvShardWriter:
+
+    def __init__(self, workspace_file, shard_size = 0, shard_per_part = False, profile = False,
+                 compression = constants.tsv_compression_none, compression_level = constants.default_tsv_compression_level, compression_threads = 1):
+        self.workspace_file = workspace_file
+        self.shard_size = shard_size or 0
+        self.shard_per_part = shard_per_part
+        self.profiler = TsvProfiler() if profile else None
+
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+
+        self.header = None
+        self.headers = None
+        self.shards = []
+
+        self._file = None
+        self._shard_bytes = 0
+        self._roll_pending = False
+
+        self._open_shard()
+
+    @property
+    def is_sharded(self) -> bool:
+        return self.shard_size > 0 or self.shard_per_part
+
+    @property
+    def row_count(self) -> int:
+        return sum(shard[constants.tsv_detail_row_count] for shard in self.shards)
+
+    def shard_file(self, shard_number) -> str:
+        if not self.is_sharded:
+            return TsvCompression.file_name(self.workspace_file, self.compression)
+
+        root, extension = os.path.splitext(self.workspace_file)
+        return TsvCompression.file_name(f"{root}.{shard_number:04d}{extension}", self.compression)
+
+    def _open_shard(self):
+        if self._file is not None:
+            self._file.close()
+
+        shard_file = self.shard_file(len(self.shards) + 1)
+        self._file = TsvCompression.open_writer(shard_file, self.compression, self.compression_level, self.compression_threads)
+        self._shard_bytes = 0
+        self._roll_pending = False
+
+        self.shards.append({
+            constants.tsv_detail_headers: self.headers,
+            constants.tsv_detail_file: shard_file,
+            constants.tsv_detail_row_count: 0
+        })
+
+        if self.header is not None:
+            self._file.write(self.header)
+
+    def set_header(self, header, headers):
+        self.header = header
+        self.headers = headers
+
+        shard = self.shards[-1]
+        shard[constants.tsv_detail_headers] = headers
+        self._file.write(header)
+
+        if self.profiler is not None:
+            self.profiler.set_headers(TsvHeader.fields(headers))
+
+    def end_part(self):
+        # One shard per downloaded part - the next part starts a new shard once it has rows
+        if self.shard_per_part:
+            self._roll_pending = True
+
+    def write(self, block):
+        if self.profiler is not None:
+            self.profiler.feed(block)
+
+        while len(block) > 0:
+            if self._roll_pending:
+                self._open_shard()
+
+            if self.shard_size <= 0 or self._shard_bytes + len(block) <= self.shard_size:
+                self._write(block)
+                return
+
+            # Cut at the first line end past the target size so no row is split across shards
+            split = block.find(b"\n", max(0, self.shard_size - self._shard_bytes - 1))
+            if split < 0:
+                self._write(block)
+                return
+
+            self._write(block[:split + 1])
+            self._roll_pending = True
+            block = block[split + 1:]
+
+    def _write(self, block):
+        self._file.write(block)
+        self._shard_bytes += len(block)
+        self.shards[-1][constants.tsv_detail_row_count] += block.count(b"\n")
+
+    def close(self) -> dict:
+        self._file.close()
+
+        tsv_details = {
+            constants.tsv_detail_headers: self.headers,
+            constants.tsv_detail_file: self.shards[0][constants.tsv_detail_file],
+            constants.tsv_detail_row_count: self.row_count
+        }
+
+        if self.is_sharded:
+            tsv_details[constants.tsv_detail_shards] = self.shards
+
+        if self.profiler is not None:
+            tsv_details[constants.tsv_detail_profile] = self.profiler.close()
+
+        return tsv_details
+
+    @staticmethod
+    def shard_details(tsv_details) -> list:
+        if tsv_details is None:
+            return []
+
+        return tsv_details.get(constants.tsv_detail_shards, None) or [tsv_details]
+
+
+class TsvPartDecoder:
+
+    # Decompresses one gzip part as its bytes arrive and passes the rows on to the shard writer
+    def __init__(self, writer, parse_headers, source = None):
+        self._writer = writer
+        self._parse_headers = parse_headers
+        self._decompressor = zlib.decompressobj(wbits=31)
+
+        # Checksummed on the way through - the part is never read a second time
+        self.source = source
+        self.compressed_bytes = 0
+        self._checksum = hashlib.sha256()
+        self._start_rows = writer.row_count
+
+        self._header = b""
+        self._in_header = True
+        self._member_open = False
+        self._last_byte = b"\n"
+
+    def feed(self, chunk):
+        self.compressed_bytes += len(chunk)
+        self._checksum.update(chunk)
+
+        while len(chunk) > 0:
+            self._member_open = True
+            self._write(self._decompressor.decompress(chunk))
+            if not self._decompressor.eof:
+                return
+
+            self._member_open = False
+
+            # A part can hold several concatenated gzip members
+            chunk = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(wbits=31)
+
+    def _write(self, data):
+        if len(data) == 0:
+            return
+
+        if self._in_header:
+            self._header += data
+            line_end = self._header.find(b"\n")
+            if line_end < 0:
+                return
+
+            data = self._header[line_end + 1:]
+            self._end_header(self._header[:line_end + 1])
+
+        if len(data) > 0:
+            self._writer.write(data)
+            self._last_byte = data[-1:]
+
+    def _end_header(self, header):
+        self._in_header = False
+        self._header = b""
+
+        # Every part starts with the header line - keep the first one and skip the rest
+        if self._writer.headers is None and len(header) > 0:
+            self._writer.set_header(header, self._parse_headers(header.decode("UTF-8")))
+
+    def close(self):
+        if self._member_open:
+            raise EOFError("Compressed stream ended before the end of the file - the download was cut short")
+
+        if self._in_header:
+            self._end_header(self._header)
+
+        # Terminate a final row without a line feed so it does not run into the next part
+        if self._last_byte != b"\n":
+            self._writer.write(b"\n")
+
+        self._writer.end_part()
+
+    def part_details(self, error = None) -> dict:
+        return {
+            constants.integrity_source: self.source,
+            constants.integrity_bytes: self.compressed_bytes,
+            constants.integrity_sha256: self._checksum.hexdigest(),
+            constants.integrity_rows: self._writer.row_count - self._start_rows,
+            constants.integrity_error: f"{type(error).__name__}: {error}" if error is not None else None
+        }
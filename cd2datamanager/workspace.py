@@ -1,6 +1,8 @@
 import os
 import shutil
 
+import cd2datamanager.constants as constants
+
 
 class Workspace:
 
@@ -10,9 +12,39 @@ class Workspace:
         self._raw_path = settings.raw_workspace or raw_path
         self._tsv_path = settings.tsv_workspace or tsv_path
         self._sql_path = settings.sql_workspace or sql_path
+        self._resume = settings.resume
+        self._output_format = settings.output_format.lower()
 
         self._logger = logger
 
+    @property
+    def root(self) -> str:
+        return self._root_path
+
+    @property
+    def incremental_state(self) -> str:
+        return f"{self._root_path}/{constants.incremental_state_file}"
+
+    @property
+    def run_manifest(self) -> str:
+        return f"{self._root_path}/{constants.run_manifest_file}"
+
+    @property
+    def run_report_json(self) -> str:
+        return f"{self._root_path}/{constants.run_report_json_file}"
+
+    @property
+    def run_report_csv(self) -> str:
+        return f"{self._root_path}/{constants.run_report_csv_file}"
+
+    @property
+    def schema_cache(self) -> str:
+        return f"{self._root_path}/{constants.schema_cache_directory}"
+
+    @property
+    def integrity(self) -> str:
+        return f"{self._root_path}/{constants.integrity_directory}"
+
     @property
     def raw(self) -> str:
         return self._raw_path or f"{self._root_path}/raw"
@@ -21,14 +53,26 @@ class Workspace:
     def tsv(self) -> str:
         return self._tsv_path or f"{self._root_path}/tsv"
 
+    @property
+    def converted(self) -> str:
+        return f"{self._root_path}/{self._output_format}"
+
     @property
     def sql(self) -> str:
         return self._sql_path or f"{self._root_path}/sql_loaders"
 
     def initialize(self):
-        self.clear_workspace(self.raw)
-        self.clear_workspace(self.tsv)
-        self.clear_workspace(self.sql)
+        if self._resume:
+            # Keep the files of the previous run - the run manifest decides what is reused
+            [os.makedirs(workspace_directory, exist_ok=True) for workspace_directory in [self.raw, self.tsv, self.sql, self.integrity]]
+        else:
+            self.clear_workspace(self.raw)
+            self.clear_workspace(self.tsv)
+            self.clear_workspace(self.sql)
+            self.clear_workspace(self.integrity)
+
+        if self._output_format != constants.output_format_tsv:
+            self.clear_workspace(self.converted)
 
     def clear_workspace(self, workspace_directory, create_new = True) -> str:
         if os.path.exists(workspace_directory):
@@ -14,11 +14,17 @@ setup(
     install_requires=[
         "asyncio",
         "instructure-dap-client",
+        "aiohttp",
         "tqdm",
         "PyYaml",
         "typer",
         "tiberlogger"
     ],
+    extras_require={
+        "mysql": ["aiomysql"],
+        "parquet": ["pyarrow"],
+        "zstd": ["zstandard"]
+    },
     entry_points={
         "console_scripts": [
             "cd2datamanager = cd2datamanager:__main__",
@@ -0,0 +1,66 @@
+import gzip
+
+import pytest
+
+from dap.dap_types import VersionedSchema
+
+from cd2datamanager.schema_generator import SchemaGenerator
+from cd2datamanager.tsv_writer import TsvShardWriter, TsvPartDecoder, TsvHeader
+
+
+class RecordingLogger:
+
+    # Keeps the messages instead of printing them, so a test can check what was reported
+    is_debug = False
+
+    def __init__(self):
+        self.messages = []
+
+    def _record(self, level, message):
+        self.messages.append((level, message))
+
+    def debug(self, message):
+        self._record("debug", message)
+
+    def detail(self, message):
+        self._record("detail", message)
+
+    def warning(self, message):
+        self._record("warning", message)
+
+    def error(self, message):
+        self._record("error", message)
+
+    def errors(self) -> list:
+        return [message for level, message in self.messages if level == "error"]
+
+
+@pytest.fixture
+def logger():
+    return RecordingLogger()
+
+
+table_schema = {
+    "type": "object",
+    "properties": {
+        "key": {"type": "object", "properties": {"id": {"type": "integer", "format": "int64"}}, "required": ["id"]},
+        "value": {"type": "object", "properties": {"name": {"type": "string"}, "score": {"type": "number"}}},
+        "meta": {"type": "object", "properties": {"action": {"type": "string", "enum": ["U", "D"]}}}
+    }
+}
+
+table_header = b"key.id\tvalue.name\tvalue.score\tmeta.action\n"
+
+
+def schema_generator(settings, table = "courses", logger = None) -> SchemaGenerator:
+    generator = SchemaGenerator(logger, "canvas", settings, table)
+    generator.schema_object = VersionedSchema(schema=table_schema, version=1)
+    return generator
+
+
+def write_tsv(tsv_file, rows, **writer_options) -> dict:
+    writer = TsvShardWriter(str(tsv_file), **writer_options)
+    decoder = TsvPartDecoder(writer, TsvHeader.parse)
+    decoder.feed(gzip.compress(table_header + b"".join(b"\t".join(row) + b"\n" for row in rows)))
+    decoder.close()
+    return writer.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+from cd2datamanager.download_budget import DownloadBudget
+
+
+def run_downloads(budget, tenants, seconds = 0.01) -> tuple:
+    order = []
+    peak = {"slots": 0}
+
+    async def download(tenant):
+        await budget.acquire(tenant)
+        order.append(tenant)
+        peak["slots"] = max(peak["slots"], budget.active_slots)
+        await asyncio.sleep(seconds)
+        await budget.release(tenant)
+
+    async def run():
+        tasks = []
+        for tenant, count in tenants:
+            tasks += [asyncio.create_task(download(tenant)) for _ in range(count)]
+            # Let the first tenant queue all of its downloads before the others arrive
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    return order, peak["slots"]
+
+
+def test_budget_never_exceeds_limit(logger):
+    budget = DownloadBudget(logger, 3)
+    order, peak = run_downloads(budget, [("a", 10), ("b", 10)])
+
+    assert peak == 3
+    assert len(order) == 20
+    assert budget.active_slots == 0
+    assert all(count == 0 for count in budget.waiting.values())
+
+
+def test_late_tenants_are_not_starved_by_a_busy_one(logger):
+    budget = DownloadBudget(logger, 4)
+    order, _ = run_downloads(budget, [("a", 20), ("b", 4), ("c", 4)])
+
+    # "a" fills the slots first, then every freed slot goes to the tenant with the fewest in use
+    assert order[:4] == ["a"] * 4
+    finished_b = max(index for index, tenant in enumerate(order) if tenant == "b")
+    finished_c = max(index for index, tenant in enumerate(order) if tenant == "c")
+    assert max(finished_b, finished_c) < 16
+    assert order[-4:] == ["a"] * 4
+
+
+def test_single_tenant_uses_every_slot(logger):
+    budget = DownloadBudget(logger, 4)
+    order, peak = run_downloads(budget, [("a", 9)])
+
+    assert peak == 4
+    assert order == ["a"] * 9
+
+
+def test_cancelled_waiter_does_not_hold_the_turn(logger):
+    budget = DownloadBudget(logger, 1)
+
+    async def run() -> list:
+        granted = []
+        await budget.acquire("a")
+
+        # "c" has nothing in use, so it would win the slot if it had not given up
+        waiting_b = asyncio.create_task(budget.acquire("b"))
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(budget.acquire("c"), 0.01)
+        except asyncio.TimeoutError:
+            granted.append("c timed out")
+
+        await budget.release("a")
+        await asyncio.wait_for(waiting_b, 1)
+        granted.append("b")
+        await budget.release("b")
+        return granted
+
+    assert asyncio.run(run()) == ["c timed out", "b"]
+    assert all(count == 0 for count in budget.waiting.values())
+    assert budget.active_slots == 0
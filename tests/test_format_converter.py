@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+import types
+
+from datetime import datetime, timezone
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.format_converter import FormatConverter
+from cd2datamanager.table_lifecycle import TableLifecycle
+from conftest import schema_generator, write_tsv
+
+
+def test_jsonl_keeps_every_decimal_digit(tmp_path):
+    output_file = str(tmp_path / "courses.jsonl")
+    rows = iter([["1", "one", "123456789012345678901234567890.123456789012345678901234567891", "U"]])
+
+    FormatConverter.write_jsonl(rows, ["id", "name", "score", "action"], {"id": "BIGINT", "score": "DECIMAL(63, 30)"}, output_file)
+
+    with open(output_file, encoding="UTF-8") as jsonl_file:
+        record = json.loads(jsonl_file.readline())
+
+    assert record == {"id": 1, "name": "one", "score": "123456789012345678901234567890.123456789012345678901234567891", "action": "U"}
+
+
+def test_failed_conversion_is_recorded_as_failed_table(tmp_path, logger):
+    workspace = types.SimpleNamespace(sql=str(tmp_path / "sql"), converted=str(tmp_path / "jsonl"))
+    [os.makedirs(directory) for directory in [workspace.sql, workspace.converted]]
+    settings = Settings(env_locale="C.UTF-8", output_format=constants.output_format_jsonl, decompress_workers=1)
+
+    tables = {table: write_tsv(tmp_path / f"{table}.tsv", [[b"1", b"one", b"1.5", b"U"]]) for table in ["courses", "users"]}
+
+    # The TSV file of one table is gone by the time it is converted
+    os.remove(tables["users"][constants.tsv_detail_file])
+
+    async def complete() -> TableLifecycle:
+        lifecycle = TableLifecycle(logger, workspace, settings)
+        await lifecycle.start()
+        lifecycle.schedule(list(tables))
+
+        for table, tsv_details in tables.items():
+            asset = types.SimpleNamespace(timestamp=datetime(2026, 2, 1, tzinfo=timezone.utc), downloaded_files=[])
+            lifecycle.schema[table] = schema_generator(settings, table)
+            lifecycle.files[table] = asset
+
+            lifecycle.schema_ready(table)
+            lifecycle.downloaded(table, asset)
+            lifecycle.converted(table, tsv_details)
+
+        await lifecycle.finish()
+        return lifecycle
+
+    lifecycle = asyncio.run(complete())
+
+    assert list(lifecycle.failures) == ["users"]
+    assert any("Unable to convert table users" in message for message in logger.errors())
+
+    # The SQL script is still written, but the watermark of the failed table does not move
+    assert set(lifecycle.sql_files) == {"courses", "users"}
+    assert set(lifecycle.timestamps) == {"courses"}
+    assert os.path.exists(f"{workspace.converted}/courses.jsonl")
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import types
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.tsv_generator import TsvGenerator
+from cd2datamanager.integrity_check import IntegrityCheck
+from conftest import table_header
+
+
+class SizeManifest:
+
+    def __init__(self, sizes):
+        self._sizes = sizes
+
+    def downloaded_sizes(self, table_name) -> dict:
+        return self._sizes
+
+
+def write_parts(tmp_path, part_count = 2) -> list:
+    part_files = []
+    for part in range(part_count):
+        part_file = tmp_path / f"part-{part:05d}.tsv.gz"
+        part_file.write_bytes(gzip.compress(table_header + f"{part}\tname\t1.5\tU\n".encode("UTF-8")))
+        part_files.append(str(part_file))
+
+    return part_files
+
+
+def verify(tmp_path, logger, part_files, source_files = None, manifest = None, expected_parts = None) -> tuple:
+    workspace = types.SimpleNamespace(integrity=str(tmp_path / "integrity"))
+    integrity = IntegrityCheck(logger, workspace, Settings(env_locale="C.UTF-8"), manifest)
+
+    tsv_details = TsvGenerator.decompress_table(str(tmp_path / "courses.tsv"), part_files)
+    if expected_parts is not None:
+        tsv_details[constants.tsv_detail_integrity][constants.integrity_expected_parts] = expected_parts
+
+    problems = integrity.verify("courses", tsv_details, source_files)
+    with open(integrity.integrity_file("courses"), encoding="UTF-8") as json_file:
+        report = json.load(json_file)
+
+    return problems, {check["check"]: check["status"] for check in report["checks"]}, report
+
+
+def test_intact_parts_pass_the_independent_checks(tmp_path, logger):
+    part_files = write_parts(tmp_path)
+    problems, checks, report = verify(tmp_path, logger, part_files, part_files)
+
+    assert problems == [] and report["status"] == "ok"
+    assert checks == {"part_count": "ok", "gzip_stream": "ok", "part_size": "ok", "row_count": "not_checked"}
+
+
+def test_truncated_part_fails_gzip_check(tmp_path, logger):
+    part_files = write_parts(tmp_path)
+    with open(part_files[1], "r+b") as part_file:
+        part_file.truncate(os.path.getsize(part_files[1]) - 6)
+
+    problems, checks, report = verify(tmp_path, logger, part_files, part_files)
+
+    assert checks["gzip_stream"] == "failed" and report["status"] == "corrupt"
+    assert len(problems) == 1 and "part-00001" in problems[0]
+
+
+def test_missing_part_fails_part_count(tmp_path, logger):
+    part_files = write_parts(tmp_path)
+    problems, checks, _ = verify(tmp_path, logger, part_files, part_files, expected_parts=3)
+
+    assert checks["part_count"] == "failed"
+    assert problems == ["2 of 3 parts decompressed"]
+
+
+def test_size_differs_from_recorded_download(tmp_path, logger):
+    part_files = write_parts(tmp_path)
+    manifest = SizeManifest({os.path.abspath(part_files[0]): os.path.getsize(part_files[0]) + 1})
+
+    problems, checks, _ = verify(tmp_path, logger, part_files, part_files, manifest)
+
+    assert checks["part_size"] == "failed"
+    assert len(problems) == 1 and "part-00000" in problems[0]
+
+
+def test_streamed_parts_skip_size_check(tmp_path, logger):
+    part_files = write_parts(tmp_path)
+    problems, checks, _ = verify(tmp_path, logger, part_files)
+
+    assert problems == [] and checks["part_size"] == "not_checked"
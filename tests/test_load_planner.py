@@ -0,0 +1,78 @@
+import json
+import random
+import types
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.load_planner import LoadPlanner
+from cd2datamanager.schema_writer import SchemaWriter
+from cd2datamanager.settings import Settings
+
+
+costs = {"accounts": 70, "courses": 50, "enrollments": 40, "users": 40, "submissions": 30, "quizzes": 20, "roles": 10}
+
+
+def planner(logger, sessions) -> LoadPlanner:
+    return LoadPlanner(logger, Settings(env_locale="C.UTF-8", load_concurrent_limit=sessions))
+
+
+def test_plan_puts_the_largest_table_on_the_least_loaded_session(logger):
+    sessions = planner(logger, 3).plan(costs)
+
+    assert sessions == [["accounts", "quizzes"], ["courses", "submissions", "roles"], ["enrollments", "users"]]
+    assert [sum(costs[table_name] for table_name in session) for session in sessions] == [90, 90, 80]
+
+
+def test_plan_does_not_depend_on_table_order(logger):
+    expected = planner(logger, 3).plan(costs)
+
+    table_names = list(costs)
+    for seed in range(5):
+        random.Random(seed).shuffle(table_names)
+        assert planner(logger, 3).plan({table_name: costs[table_name] for table_name in table_names}) == expected
+
+
+def test_equal_costs_are_planned_by_table_name(logger):
+    sessions = planner(logger, 2).plan({"d": 5, "b": 5, "c": 5, "a": 5})
+
+    assert sessions == [["a", "c"], ["b", "d"]]
+
+
+def test_no_more_sessions_than_tables(logger):
+    assert planner(logger, 8).plan({"a": 1, "b": 2}) == [["b"], ["a"]]
+    assert planner(logger, 8).plan({}) == [[]]
+    assert planner(logger, 0).plan(costs) == [sorted(costs, key=lambda name: (-costs[name], name))]
+
+
+def test_waves_hold_the_nth_script_of_every_session(logger):
+    sessions = planner(logger, 3).plan(costs)
+    waves = LoadPlanner.waves(sessions, costs)
+
+    assert [[entry["table"] for entry in wave] for wave in waves] == [["accounts", "courses", "enrollments"], ["quizzes", "submissions", "users"], ["roles"]]
+    assert waves[1][1] == {"table": "submissions", "session": 2, "cost": 30, "start": 50, "finish": 80}
+    assert waves[2][0] == {"table": "roles", "session": 2, "cost": 10, "start": 80, "finish": 90}
+
+
+def test_control_sql_writes_session_scripts_and_load_plan(tmp_path, logger):
+    workspace = types.SimpleNamespace(sql=str(tmp_path))
+    # A script left by an earlier run with more sessions
+    (tmp_path / f"{constants.load_session_prefix}09.sql").write_text("source old.sql\n")
+
+    writer = SchemaWriter(logger, workspace, Settings(env_locale="C.UTF-8", load_concurrent_limit=3))
+    sources = {table_name: f"/sql/{table_name}.sql" for table_name in costs}
+    writer.write_control_sql(sources, costs)
+
+    session_files = sorted(tmp_path.glob(f"{constants.load_session_prefix}*.sql"))
+    assert [session_file.name for session_file in session_files] == [f"{constants.load_session_prefix}{index:02d}.sql" for index in (1, 2, 3)]
+    assert [line for line in session_files[1].read_text().splitlines() if line.startswith("source ")] == ["source /sql/courses.sql", "source /sql/submissions.sql", "source /sql/roles.sql"]
+
+    load_all = (tmp_path / "load_all.sql").read_text()
+    assert load_all.count("source ") == len(costs)
+    assert load_all.index("# Wave 1") < load_all.index("source /sql/accounts.sql") < load_all.index("# Wave 2")
+
+    with open(tmp_path / constants.load_plan_file, encoding="UTF-8") as json_file:
+        load_plan = json.load(json_file)
+
+    assert [session["cost"] for session in load_plan["sessions"]] == [90, 90, 80]
+    assert load_plan["sessions"][0]["script"] == str(session_files[0])
+    assert [wave["wave"] for wave in load_plan["waves"]] == [1, 2, 3]
@@ -0,0 +1,106 @@
+import asyncio
+import types
+
+from datetime import datetime, timezone
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.mysql_loader import MySqlLoader
+from cd2datamanager.incremental_state import IncrementalState
+from conftest import schema_generator, write_tsv
+
+
+class FakeCursor:
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return None
+
+    async def execute(self, statement):
+        self._pool.statements.append(statement)
+        if statement.startswith("INSERT INTO") and self._pool.fail_merge:
+            raise RuntimeError("Lock wait timeout exceeded")
+
+        return self._pool.loaded_rows if statement.lower().startswith("load data") else 0
+
+
+class FakeConnection:
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return None
+
+    def cursor(self):
+        return FakeCursor(self._pool)
+
+
+class FakePool:
+
+    # Stands in for the aiomysql pool - LOAD DATA reports loaded_rows, the merge upsert can be made to fail
+    def __init__(self, loaded_rows, fail_merge = False):
+        self.loaded_rows = loaded_rows
+        self.fail_merge = fail_merge
+        self.statements = []
+
+    def acquire(self):
+        return FakeConnection(self)
+
+    def merged(self) -> bool:
+        return any(statement.startswith("INSERT INTO") for statement in self.statements)
+
+
+def merge(tmp_path, logger, pool) -> dict:
+    mysql_yaml = tmp_path / "mysql.yaml"
+    mysql_yaml.write_text("user: loader\ndatabase: canvas\n")
+
+    settings = Settings(env_locale="C.UTF-8", incremental=True, mysql_yaml_file=str(mysql_yaml))
+    changes = write_tsv(tmp_path / "courses.tsv", [[b"1", b"one", b"1.5", b"U"], [b"2", b"two", b"2.5", b"D"]])
+
+    loader = MySqlLoader(logger, settings)
+    results = {}
+    asyncio.run(loader.load_table(pool, asyncio.Semaphore(1), schema_generator(settings), changes, results, incremental=True))
+    return results["courses"]
+
+
+def advance_watermark(tmp_path, logger, result) -> dict:
+    workspace = types.SimpleNamespace(incremental_state=str(tmp_path / "incremental_state.yaml"))
+    state = IncrementalState(logger, workspace)
+    state.update("canvas", "courses", datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+    state.update_from_run("canvas", {"courses": datetime(2026, 2, 1, tzinfo=timezone.utc)}, {"courses": result})
+    return state.watermarks["canvas"]
+
+
+def test_merge_success(tmp_path, logger):
+    pool = FakePool(loaded_rows=2)
+    result = merge(tmp_path, logger, pool)
+
+    assert pool.merged() and result["success"]
+    assert advance_watermark(tmp_path, logger, result)["courses"] == "2026-02-01T00:00:00+00:00"
+
+
+def test_failed_merge_keeps_watermark(tmp_path, logger):
+    pool = FakePool(loaded_rows=2, fail_merge=True)
+    result = merge(tmp_path, logger, pool)
+
+    assert pool.merged() and not result["success"]
+    assert any("Lock wait timeout" in message for message in logger.errors())
+    assert advance_watermark(tmp_path, logger, result)["courses"] == "2026-01-01T00:00:00+00:00"
+
+
+def test_staging_row_count_mismatch_skips_merge(tmp_path, logger):
+    pool = FakePool(loaded_rows=1)
+    result = merge(tmp_path, logger, pool)
+
+    assert not pool.merged() and not result["success"]
+    assert result["loaded_rows"] == 1
+    assert advance_watermark(tmp_path, logger, result)["courses"] == "2026-01-01T00:00:00+00:00"
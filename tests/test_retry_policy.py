@@ -0,0 +1,77 @@
+import cd2datamanager.constants as constants
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from aiohttp import ClientResponseError, RequestInfo
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+from dap.api import DownloadError
+from dap.dap_error import AuthenticationError, GatewayTimeoutError, NotFoundError, ProcessingError, ServerError
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.retry_policy import RetryPolicy
+
+
+def response_error(status, headers = None) -> ClientResponseError:
+    url = URL("https://data-access-platform-output.s3.amazonaws.com/part-00000.tsv.gz")
+    request_info = RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url)
+    return ClientResponseError(request_info=request_info, history=(), status=status, message="", headers=CIMultiDict(headers or {}))
+
+
+def download_error(status, headers = None) -> DownloadError:
+    # The resource download client raises for the status, and the stream surfaces it as a DownloadError
+    try:
+        raise response_error(status, headers)
+    except ClientResponseError as e:
+        try:
+            raise DownloadError(f"Request failed with HTTP status code: {status}") from e
+        except DownloadError as download:
+            return download
+
+
+def test_api_throttling_server_error_is_throttled():
+    # What the DAP API raises for a 429 from the gateway - a ServerError holding the body, no status or headers
+    assert RetryPolicy.classify(ServerError({"message": "Too Many Requests"})) == RetryPolicy.retry_throttled
+    assert RetryPolicy.classify(ServerError({"error": {"code": 429, "message": "Slow down"}})) == RetryPolicy.retry_throttled
+    assert RetryPolicy.classify(ServerError({"statusCode": "429"})) == RetryPolicy.retry_throttled
+
+
+def test_other_server_errors_are_retryable():
+    assert RetryPolicy.classify(ServerError({"message": "Internal Server Error"})) == RetryPolicy.retry_retryable
+    assert RetryPolicy.classify(ServerError("upstream connect error")) == RetryPolicy.retry_retryable
+    assert RetryPolicy.classify(GatewayTimeoutError("Gateway timeout")) == RetryPolicy.retry_retryable
+    assert RetryPolicy.classify(ProcessingError("ProcessingError", "uuid", "Job failed")) == RetryPolicy.retry_retryable
+
+
+def test_fatal_dap_errors():
+    assert RetryPolicy.classify(AuthenticationError("AuthenticationError", "uuid", "Bad credentials")) == RetryPolicy.retry_fatal
+    assert RetryPolicy.classify(NotFoundError("NotFoundError", "uuid", "No table", "courses", "table")) == RetryPolicy.retry_fatal
+
+
+def test_download_throttling_reads_response_error():
+    assert RetryPolicy.classify(response_error(429)) == RetryPolicy.retry_throttled
+    assert RetryPolicy.classify(download_error(429)) == RetryPolicy.retry_throttled
+    assert RetryPolicy.classify(download_error(503)) == RetryPolicy.retry_retryable
+
+
+def test_retry_after_from_headers_and_body():
+    assert RetryPolicy.retry_after(response_error(429, {"Retry-After": "12"})) == 12.0
+    assert RetryPolicy.retry_after(download_error(429, {"Retry-After": "7"})) == 7.0
+    assert RetryPolicy.retry_after(ServerError({"message": "Too Many Requests", "retryAfter": 45})) == 45.0
+    assert RetryPolicy.retry_after(ServerError({"message": "Too Many Requests"})) is None
+    assert RetryPolicy.retry_after(response_error(429, {"Retry-After": "soon"})) is None
+
+
+def test_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=120)
+    retry_after = RetryPolicy.retry_after(response_error(429, {"Retry-After": format_datetime(retry_at, usegmt=True)}))
+
+    assert 100 < retry_after <= 120
+
+
+def test_throttled_delay_has_floor():
+    policy = RetryPolicy(None, Settings(env_locale="C.UTF-8", sleep_between_attempts_seconds=1))
+
+    assert policy.delay(1, ServerError({"message": "Too Many Requests"})) >= constants.default_throttle_delay_seconds
+    assert policy.delay(1, download_error(429, {"Retry-After": "90"})) >= 90
+    assert policy.delay(1, ServerError({"message": "Internal Server Error"})) <= 1
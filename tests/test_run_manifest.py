@@ -0,0 +1,125 @@
+import types
+
+from datetime import datetime, timezone
+
+from dap.dap_types import DownloadTableDataResult
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.run_manifest import RunManifest
+from conftest import write_tsv
+
+
+def manifest(tmp_path, logger, resume = True) -> RunManifest:
+    workspace = types.SimpleNamespace(run_manifest=str(tmp_path / "run_manifest.json"))
+    return RunManifest(logger, workspace, Settings(env_locale="C.UTF-8", resume=resume))
+
+
+def download(tmp_path, content = b"compressed part") -> DownloadTableDataResult:
+    part_file = tmp_path / "part-00000.tsv.gz"
+    part_file.write_bytes(content)
+    return DownloadTableDataResult(3, datetime(2026, 2, 1, tzinfo=timezone.utc), "job-1", [str(part_file)])
+
+
+def complete_table(tmp_path, run_manifest) -> tuple:
+    asset = download(tmp_path)
+    run_manifest.record_download("courses", asset)
+
+    tsv_details = write_tsv(tmp_path / "courses.tsv", [[b"1", b"one", b"1.5", b"U"]])
+    run_manifest.record_tsv("courses", tsv_details)
+
+    sql_file = tmp_path / "courses.sql"
+    sql_file.write_text("CREATE TABLE courses;")
+    run_manifest.record_sql("courses", str(sql_file))
+
+    return asset, tsv_details, str(sql_file)
+
+
+def test_resumed_run_reuses_every_stage(tmp_path, logger):
+    asset, tsv_details, sql_file = complete_table(tmp_path, manifest(tmp_path, logger))
+
+    resumed = manifest(tmp_path, logger)
+    downloaded = resumed.downloaded_asset("courses")
+
+    assert downloaded.downloaded_files == asset.downloaded_files
+    assert downloaded.schema_version == 3 and downloaded.timestamp == asset.timestamp
+    assert resumed.tsv_details("courses") == tsv_details
+    assert resumed.sql_file("courses") == sql_file
+
+
+def test_fresh_run_keeps_only_the_sizes(tmp_path, logger):
+    complete_table(tmp_path, manifest(tmp_path, logger))
+
+    fresh = manifest(tmp_path, logger, resume=False)
+
+    assert fresh.downloaded_asset("courses") is None
+    assert fresh.expected_size("courses") == len(b"compressed part")
+
+
+def test_new_download_invalidates_later_stages(tmp_path, logger):
+    run_manifest = manifest(tmp_path, logger)
+    complete_table(tmp_path, run_manifest)
+
+    run_manifest.record_download("courses", download(tmp_path, b"another download"))
+
+    assert run_manifest.tsv_details("courses") is None
+    assert run_manifest.sql_file("courses") is None
+    assert manifest(tmp_path, logger).sql_file("courses") is None
+
+
+def test_new_tsv_invalidates_sql(tmp_path, logger):
+    run_manifest = manifest(tmp_path, logger)
+    _, tsv_details, _ = complete_table(tmp_path, run_manifest)
+
+    run_manifest.record_tsv("courses", tsv_details)
+
+    assert run_manifest.tsv_details("courses") == tsv_details
+    assert run_manifest.sql_file("courses") is None
+
+
+def test_changed_files_are_not_reused(tmp_path, logger):
+    asset, tsv_details, sql_file = complete_table(tmp_path, manifest(tmp_path, logger))
+
+    with open(asset.downloaded_files[0], "ab") as part_file:
+        part_file.write(b"more")
+
+    with open(tsv_details[constants.tsv_detail_file], "ab") as tsv_file:
+        tsv_file.write(b"2\ttwo\t2.5\tU\n")
+
+    resumed = manifest(tmp_path, logger)
+    assert resumed.downloaded_asset("courses") is None
+    assert resumed.tsv_details("courses") is None
+    assert resumed.sql_file("courses") == sql_file
+
+
+def test_streamed_table_needs_complete_tsv(tmp_path, logger):
+    run_manifest = manifest(tmp_path, logger)
+    asset = DownloadTableDataResult(3, datetime(2026, 2, 1, tzinfo=timezone.utc), "job-1", [])
+    run_manifest.record_download("courses", asset)
+
+    # Streamed tables keep no raw files - until the TSV is recorded nothing counts as downloaded
+    assert run_manifest.downloaded_asset("courses") is None
+
+    run_manifest.record_tsv("courses", write_tsv(tmp_path / "courses.tsv", [[b"1", b"one", b"1.5", b"U"]]))
+    assert run_manifest.downloaded_asset("courses").job_id == "job-1"
+
+
+def test_incremental_download_keeps_snapshot_size(tmp_path, logger):
+    run_manifest = manifest(tmp_path, logger)
+    complete_table(tmp_path, run_manifest)
+
+    run_manifest.record_download("courses", download(tmp_path, b"few changes"), incremental=True)
+    run_manifest.record_size("courses", 1)
+
+    assert run_manifest.is_incremental("courses")
+    assert run_manifest.expected_size("courses") == len(b"compressed part")
+
+
+def test_discard_forgets_table(tmp_path, logger):
+    complete_table(tmp_path, manifest(tmp_path, logger))
+
+    run_manifest = manifest(tmp_path, logger)
+    run_manifest.discard("courses")
+
+    assert manifest(tmp_path, logger).downloaded_asset("courses") is None
@@ -0,0 +1,50 @@
+import asyncio
+import types
+
+from dap.dap_types import VersionedSchema
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.schema_cache import SchemaCache
+from cd2datamanager.schema_generator import SchemaGenerator
+from conftest import table_schema
+
+
+class SchemaSession:
+
+    def __init__(self, version):
+        self.version = version
+        self.requests = 0
+
+    async def get_table_schema(self, namespace, table):
+        self.requests += 1
+        return VersionedSchema(schema=table_schema, version=self.version)
+
+
+def initialize(tmp_path, logger, session, **settings) -> SchemaGenerator:
+    settings = Settings(env_locale="C.UTF-8", **settings)
+    schema_cache = SchemaCache(logger, types.SimpleNamespace(schema_cache=str(tmp_path / "schema_cache")), settings)
+    return asyncio.run(SchemaGenerator(logger, "canvas", settings, "courses").initialize(session, schema_cache))
+
+
+def test_cached_schema_is_reused(tmp_path, logger):
+    initialize(tmp_path, logger, SchemaSession(1))
+
+    session = SchemaSession(2)
+    assert initialize(tmp_path, logger, session).version == 1
+    assert session.requests == 0
+
+
+def test_schema_only_run_fetches_current_schema(tmp_path, logger):
+    initialize(tmp_path, logger, SchemaSession(1))
+
+    session = SchemaSession(2)
+    assert initialize(tmp_path, logger, session, schema_only=True).version == 2
+    assert session.requests == 1
+
+    # The fresh schema is cached for the next download run
+    assert initialize(tmp_path, logger, SchemaSession(3)).version == 2
+
+
+def test_refresh_schema_fetches_current_schema(tmp_path, logger):
+    initialize(tmp_path, logger, SchemaSession(1))
+    assert initialize(tmp_path, logger, SchemaSession(2), refresh_schema=True).version == 2
@@ -0,0 +1,45 @@
+import re
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from conftest import schema_generator, write_tsv
+
+
+def column_types(sql) -> list:
+    # Every CREATE TABLE in the script - the column definitions are padded to line up
+    return [dict(re.findall(r"^\s+`(\w+)`\s+(\w+(?:\(\d+(?:, \d+)?\))?)", create_sql, re.MULTILINE)) for create_sql in sql.split("CREATE TABLE")[1:]]
+
+
+def profiled_generator(settings, tsv_details):
+    generator = schema_generator(settings)
+    generator.profile = tsv_details[constants.tsv_detail_profile]
+    return generator
+
+
+def test_profile_sizes_columns_of_full_snapshot(tmp_path):
+    settings = Settings(env_locale="C.UTF-8", profile_tsv=True)
+    snapshot = write_tsv(tmp_path / "snapshot.tsv", [[b"1", b"short", b"1.5", b"U"]], profile=True)
+
+    [columns] = column_types(profiled_generator(settings, snapshot).table_sql())
+    assert columns["name"] == "VARCHAR(7)"
+    assert columns["score"] == "DECIMAL(4, 2)"
+
+
+def test_incremental_merge_keeps_declared_types_of_profiled_snapshot(tmp_path):
+    settings = Settings(env_locale="C.UTF-8", profile_tsv=True, incremental=True)
+
+    # The snapshot only holds short values, the changes merged into its table later are much wider
+    snapshot = write_tsv(tmp_path / "snapshot.tsv", [[b"1", b"short", b"1.5", b"U"]], profile=True)
+    changes = write_tsv(tmp_path / "changes.tsv", [[b"2", b"x" * 500, b"123456.123456", b"U"]], profile=True)
+
+    table_sql = profiled_generator(settings, snapshot).table_sql()
+    merge_sql = profiled_generator(settings, changes).merge_file(changes)
+
+    # The target table of the snapshot and the staging table of the merge
+    tables = column_types(table_sql) + column_types(merge_sql)
+    assert len(tables) == 2
+
+    for columns in tables:
+        assert columns["name"] == "LONGTEXT"
+        assert columns["score"] == "DECIMAL(63, 30)"
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import cd2datamanager.constants as constants
+import cd2datamanager.semaphore_control as semaphore_control
+
+from dap.dap_error import ServerError
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.semaphore_control import SemaphoreControl
+
+megabyte = 1024 * 1024
+throttled = ServerError({"message": "Too Many Requests"})
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(semaphore_control.time, "perf_counter", clock)
+    return clock
+
+
+def control(logger, **settings) -> SemaphoreControl:
+    return SemaphoreControl(Settings(env_locale="C.UTF-8", **settings), logger)
+
+
+def finish_round(semaphore, clock, seconds = 1.0, size = megabyte, errors = 0):
+    # One round is as many finished downloads as there are slots
+    clock.now += seconds
+    for index in range(semaphore.limit):
+        if index < errors:
+            asyncio.run(semaphore.record_error(RuntimeError("Connection reset")))
+        else:
+            asyncio.run(semaphore.record_success(size))
+
+
+def test_default_limit_is_the_ceiling(logger, clock):
+    semaphore = control(logger, concurrent_limit=4)
+    assert semaphore.max_limit == 4
+
+    for _ in range(5):
+        finish_round(semaphore, clock)
+
+    assert semaphore.limit == 4 and semaphore.peak_limit == 4
+
+
+def test_fixed_limit_never_changes(logger, clock):
+    semaphore = control(logger, concurrent_limit=4, max_concurrent_limit=8, adaptive_concurrency=False)
+
+    finish_round(semaphore, clock)
+    asyncio.run(semaphore.record_error(throttled))
+
+    assert not semaphore.is_adaptive
+    assert semaphore.limit == 4 and semaphore.error_count == 1 and semaphore.throttle_count == 0
+
+
+def test_limit_grows_while_throughput_holds(logger, clock):
+    semaphore = control(logger, concurrent_limit=2, max_concurrent_limit=4)
+
+    finish_round(semaphore, clock)
+    assert semaphore.limit == 3
+
+    # Still above 90% of the previous round
+    finish_round(semaphore, clock, seconds=1.05)
+    assert semaphore.limit == 4
+
+    finish_round(semaphore, clock)
+    assert semaphore.limit == 4 and semaphore.peak_limit == 4
+
+
+def test_limit_holds_when_throughput_drops(logger, clock):
+    semaphore = control(logger, concurrent_limit=2, max_concurrent_limit=8)
+
+    finish_round(semaphore, clock)
+    finish_round(semaphore, clock, seconds=3.0)
+
+    assert semaphore.limit == 3
+
+
+def test_throttling_halves_limit_once_per_cooldown(logger, clock):
+    semaphore = control(logger, concurrent_limit=8, min_concurrent_limit=3, max_concurrent_limit=16)
+
+    asyncio.run(semaphore.record_error(throttled))
+    assert semaphore.limit == 4 and semaphore.throttle_count == 1
+
+    # The downloads already in flight fail together - they count once
+    asyncio.run(semaphore.record_error(throttled))
+    assert semaphore.limit == 4 and semaphore.throttle_count == 2
+
+    clock.now += constants.concurrency_cooldown_seconds + 1
+    asyncio.run(semaphore.record_error(throttled))
+    assert semaphore.limit == 3
+
+
+def test_failed_round_lowers_limit(logger, clock):
+    semaphore = control(logger, concurrent_limit=4, max_concurrent_limit=8)
+
+    finish_round(semaphore, clock, errors=3)
+
+    assert semaphore.limit == 2 and semaphore.error_count == 3
+
+
+def test_acquire_waits_for_free_slot(logger):
+    semaphore = control(logger, concurrent_limit=2, adaptive_concurrency=False)
+
+    async def acquire_three() -> bool:
+        await semaphore.acquire()
+        await semaphore.acquire()
+        third = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        waited = not third.done()
+
+        await semaphore.release()
+        await asyncio.wait_for(third, 1)
+        return waited
+
+    assert asyncio.run(acquire_three())
+    assert semaphore.active_semaphores == 2
@@ -0,0 +1,103 @@
+import asyncio
+import types
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.table_lifecycle import TableLifecycle
+
+
+megabyte = 1024 * 1024
+
+
+def lifecycle(logger, tables_in_budget = 2, tsv_generator = None) -> TableLifecycle:
+    settings = Settings(env_locale="C.UTF-8", no_schema=True, output_format=constants.output_format_tsv)
+    table_lifecycle = TableLifecycle(logger, types.SimpleNamespace(), settings, tsv_generator=tsv_generator)
+
+    # Room for the given number of tables but not one more
+    settings.memory_budget_mb = -(-table_lifecycle.table_memory * tables_in_budget // megabyte)
+    assert table_lifecycle.memory_budget < table_lifecycle.table_memory * (tables_in_budget + 1)
+    return table_lifecycle
+
+
+async def admitted(table_lifecycle, table) -> bool:
+    try:
+        await asyncio.wait_for(asyncio.shield(table_lifecycle.admit(table)), 0.05)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def test_admission_waits_until_memory_is_released(logger):
+    table_lifecycle = lifecycle(logger)
+
+    async def run() -> list:
+        steps = [await admitted(table_lifecycle, "a"), await admitted(table_lifecycle, "b")]
+
+        waiting = asyncio.create_task(table_lifecycle.admit("c"))
+        await asyncio.sleep(0.05)
+        steps.append(waiting.done())
+
+        await table_lifecycle.release("a")
+        await asyncio.wait_for(waiting, 1)
+        steps.append(waiting.done())
+        return steps
+
+    assert asyncio.run(run()) == [True, True, False, True]
+    assert table_lifecycle._memory_in_use == table_lifecycle.table_memory * 2
+    assert set(table_lifecycle._admitted) == {"b", "c"}
+
+
+def test_one_table_is_admitted_over_a_small_budget(logger):
+    table_lifecycle = lifecycle(logger)
+    table_lifecycle._settings.memory_budget_mb = 1
+    assert table_lifecycle.table_memory > table_lifecycle.memory_budget
+
+    async def run() -> list:
+        steps = [await admitted(table_lifecycle, "a"), await admitted(table_lifecycle, "b")]
+        await table_lifecycle.discard("a")
+        steps.append(await admitted(table_lifecycle, "b"))
+        return steps
+
+    assert asyncio.run(run()) == [True, False, True]
+
+
+def test_admitting_a_table_twice_counts_it_once(logger):
+    table_lifecycle = lifecycle(logger)
+
+    async def run():
+        await table_lifecycle.admit("a")
+        await table_lifecycle.admit("a")
+        await table_lifecycle.release("a")
+        await table_lifecycle.release("a")
+
+    asyncio.run(run())
+    assert table_lifecycle._memory_in_use == 0
+
+
+def test_no_budget_admits_every_table(logger):
+    table_lifecycle = lifecycle(logger)
+    table_lifecycle._settings.memory_budget_mb = 0
+
+    async def run() -> list:
+        return [await admitted(table_lifecycle, f"table_{index}") for index in range(10)]
+
+    assert asyncio.run(run()) == [True] * 10
+    assert table_lifecycle._memory_in_use == 0
+
+
+def test_corrupt_table_gives_its_memory_back(logger):
+    tsv_generator = types.SimpleNamespace(corrupt_tables={"a"})
+    table_lifecycle = lifecycle(logger, tables_in_budget=1, tsv_generator=tsv_generator)
+
+    async def run() -> list:
+        table_lifecycle.schedule(["a", "b"])
+        steps = [await admitted(table_lifecycle, "a"), await admitted(table_lifecycle, "b")]
+
+        # The corrupt table waits for its download to be retried without holding its slot
+        table_lifecycle.converted("a", None)
+        steps.append(await admitted(table_lifecycle, "b"))
+        steps.append(await admitted(table_lifecycle, "a"))
+        return steps
+
+    assert asyncio.run(run()) == [True, False, True, False]
@@ -0,0 +1,30 @@
+import gzip
+import os
+import stat
+import subprocess
+
+from cd2datamanager.tsv_compression import TsvCompression
+
+
+def system_commands(script) -> list:
+    return [line[len("system "):] for line in script.splitlines() if line.startswith("system ")]
+
+
+def test_fifo_command_creates_fifo_before_load(tmp_path):
+    tsv_file = tmp_path / "table.tsv.gz"
+    tsv_file.write_bytes(gzip.compress(b"key.id\tvalue.name\n1\tone\n"))
+    fifo_file = TsvCompression.fifo_file(str(tsv_file))
+
+    create_fifo, decompress = system_commands(TsvCompression.fifo_command(str(tsv_file)))
+
+    # Only the decompression may run in the background
+    assert "mkfifo" in create_fifo and not create_fifo.rstrip().endswith("&")
+    assert decompress.rstrip().endswith("&") and "mkfifo" not in decompress
+
+    # The mysql client runs the system commands one after the other - the pipe must exist as soon as the first returns
+    subprocess.run(["sh", "-c", create_fifo], check=True)
+    assert stat.S_ISFIFO(os.stat(fifo_file).st_mode)
+
+    subprocess.run(["sh", "-c", decompress], check=True)
+    with open(fifo_file, "rb") as fifo:
+        assert fifo.read() == b"key.id\tvalue.name\n1\tone\n"
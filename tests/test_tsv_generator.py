@@ -0,0 +1,129 @@
+import asyncio
+import gzip
+import os
+import types
+
+import pytest
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.settings import Settings
+from cd2datamanager.tsv_generator import TsvGenerator
+from cd2datamanager.tsv_writer import TsvShardWriter
+from benchmarks.fake_dap import FakeDAPSession, SyntheticDataset
+from conftest import table_header
+
+
+def write_table(directory, table, part_count, rows) -> list:
+    os.makedirs(directory / table, exist_ok=True)
+    part_files = []
+    for part in range(part_count):
+        part_file = directory / table / f"part-{part:05d}.tsv.gz"
+        part_rows = "".join(f"{part * rows + row}\t{table} row {row}\t{row}.25\tU\n" for row in range(rows))
+        part_file.write_bytes(gzip.compress(table_header + part_rows.encode("UTF-8")))
+        part_files.append(str(part_file))
+
+    return part_files
+
+
+def shard_bytes(tsv_details) -> list:
+    shards = []
+    for shard in TsvShardWriter.shard_details(tsv_details):
+        with open(shard[constants.tsv_detail_file], "rb") as shard_file:
+            shards.append(shard_file.read())
+
+    return shards
+
+
+def test_worker_pool_writes_same_tsv_files_as_serial_decompression(tmp_path, logger):
+    tables = {f"table_{index}": write_table(tmp_path / "raw", f"table_{index}", index + 1, 500 + index * 100) for index in range(4)}
+    settings = Settings(env_locale="C.UTF-8", decompress_workers=3, tsv_shard_per_part=True)
+    workspace = types.SimpleNamespace(tsv=str(tmp_path / "pool"), integrity=str(tmp_path / "integrity"))
+    os.makedirs(workspace.tsv)
+    generator = TsvGenerator(logger, workspace, settings)
+
+    serial = {}
+    os.makedirs(tmp_path / "serial")
+    for table, part_files in tables.items():
+        serial[table] = TsvGenerator.decompress_table(str(tmp_path / "serial" / f"{table}.tsv"), part_files, generator.writer_options)
+
+    async def decompress() -> dict:
+        generator.start()
+        for table, part_files in tables.items():
+            generator.submit(table, types.SimpleNamespace(downloaded_files=part_files))
+
+        return await generator.finish()
+
+    pooled = asyncio.run(decompress())
+
+    assert set(pooled) == set(tables)
+    for table, part_files in tables.items():
+        assert pooled[table][constants.tsv_detail_row_count] == serial[table][constants.tsv_detail_row_count]
+        assert shard_bytes(pooled[table]) == shard_bytes(serial[table])
+        assert len(shard_bytes(pooled[table])) == len(part_files)
+
+
+class CountingSession(FakeDAPSession):
+
+    # Counts the URL lookups and the parts read at the same time, and can fail one part
+    def __init__(self, dataset, failing_part = None):
+        super().__init__(dataset, latency_seconds=0.005)
+        self.failing_part = failing_part
+        self.resource_requests = []
+        self.active = 0
+        self.peak = 0
+
+    async def get_resources(self, objects) -> dict:
+        self.resource_requests.append(len(objects))
+        return await super().get_resources(objects)
+
+    async def stream_resource(self, resource):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            if self.failing_part is not None and resource.endswith(self.failing_part):
+                raise ConnectionResetError("Connection reset by peer")
+
+            async for stream in super().stream_resource(resource):
+                yield stream
+
+        finally:
+            self.active -= 1
+
+
+def test_stream_writes_same_tsv_as_downloaded_parts(tmp_path, logger):
+    dataset = SyntheticDataset(str(tmp_path / "data"), tables=1, rows=3000, parts=7).build()
+    table = dataset.tables[0]
+
+    workspace = types.SimpleNamespace(tsv=str(tmp_path / "tsv"), integrity=str(tmp_path / "integrity"))
+    os.makedirs(workspace.tsv)
+    generator = TsvGenerator(logger, workspace, Settings(env_locale="C.UTF-8", stream_tsv=True))
+
+    async def stream(session) -> dict:
+        table_data = await session.get_table_data("canvas", table, None)
+        return await generator.stream(session, table, table_data)
+
+    async def stream_with_retry() -> tuple:
+        generator.start()
+        failing = CountingSession(dataset, "part-00003.tsv.gz")
+        with pytest.raises(ConnectionResetError):
+            await stream(failing)
+
+        # The download retries the whole table
+        session = CountingSession(dataset)
+        tsv_details = await stream(session)
+        total = generator._pbar.total
+        await generator.finish()
+        return session, tsv_details, total
+
+    session, tsv_details, total = asyncio.run(stream_with_retry())
+
+    # Each URL is resolved right before its part is read, a few parts at a time
+    assert session.resource_requests == [1] * dataset.parts
+    assert 1 < session.peak <= constants.stream_part_concurrency
+    assert total == 1
+
+    serial = TsvGenerator.decompress_table(str(tmp_path / "serial.tsv"), dataset.part_files(table))
+    assert shard_bytes(tsv_details) == shard_bytes(serial)
+    assert tsv_details[constants.tsv_detail_row_count] == dataset.rows
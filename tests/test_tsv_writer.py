@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import zlib
+
+import pytest
+
+import cd2datamanager.constants as constants
+
+from cd2datamanager.tsv_writer import TsvShardWriter, TsvPartDecoder, TsvHeader
+
+header = b"key.id\tvalue.name\n"
+rows = [f"{row}\t{'x' * (row % 13)}\n".encode("UTF-8") for row in range(200)]
+
+
+def write(tsv_file, blocks, **writer_options) -> dict:
+    writer = TsvShardWriter(str(tsv_file), **writer_options)
+    writer.set_header(header, TsvHeader.parse(header.decode("UTF-8")))
+    for block in blocks:
+        writer.write(block)
+
+    return writer.close()
+
+
+def shard_contents(tsv_details) -> list:
+    contents = []
+    for shard in TsvShardWriter.shard_details(tsv_details):
+        with open(shard[constants.tsv_detail_file], "rb") as shard_file:
+            contents.append(shard_file.read())
+
+    return contents
+
+
+def chunks(data, size) -> list:
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_unsharded_table_is_one_file(tmp_path):
+    tsv_details = write(tmp_path / "courses.tsv", [b"".join(rows)])
+
+    assert tsv_details[constants.tsv_detail_file] == str(tmp_path / "courses.tsv")
+    assert constants.tsv_detail_shards not in tsv_details
+    assert shard_contents(tsv_details) == [header + b"".join(rows)]
+
+
+def test_shards_split_at_row_boundaries(tmp_path):
+    shard_size = 256
+
+    # Blocks cut in the middle of rows, as they come out of the decompressor
+    tsv_details = write(tmp_path / "courses.tsv", chunks(b"".join(rows), 37), shard_size=shard_size)
+    contents = shard_contents(tsv_details)
+
+    assert len(contents) > 5
+    for content, shard in zip(contents, tsv_details[constants.tsv_detail_shards]):
+        assert content.startswith(header) and content.endswith(b"\n")
+        assert len(content) - len(header) <= shard_size + max(len(row) for row in rows)
+        assert shard[constants.tsv_detail_row_count] == content.count(b"\n") - 1
+
+    assert b"".join(content[len(header):] for content in contents) == b"".join(rows)
+    assert tsv_details[constants.tsv_detail_row_count] == len(rows)
+
+
+def test_row_longer_than_shard_is_kept_whole(tmp_path):
+    long_row = b"1\t" + b"y" * 100 + b"\n"
+    tsv_details = write(tmp_path / "courses.tsv", [long_row, b"2\tz\n"], shard_size=16)
+
+    assert [content[len(header):] for content in shard_contents(tsv_details)] == [long_row, b"2\tz\n"]
+
+
+def test_shard_per_part(tmp_path):
+    writer = TsvShardWriter(str(tmp_path / "courses.tsv"), shard_per_part=True)
+    writer.set_header(header, TsvHeader.parse(header.decode("UTF-8")))
+
+    for part in [rows[:10], rows[10:15], rows[15:40]]:
+        writer.write(b"".join(part))
+        writer.end_part()
+
+    tsv_details = writer.close()
+    shard_files = [shard[constants.tsv_detail_file] for shard in tsv_details[constants.tsv_detail_shards]]
+
+    # No empty shard is opened after the last part
+    assert shard_files == [str(tmp_path / f"courses.{number:04d}.tsv") for number in [1, 2, 3]]
+    assert [shard[constants.tsv_detail_row_count] for shard in tsv_details[constants.tsv_detail_shards]] == [10, 5, 25]
+
+
+def decode(tsv_file, parts, chunk_size = 5) -> tuple:
+    # The parts fed in small chunks, the way they arrive from the network
+    writer = TsvShardWriter(str(tsv_file))
+    details = []
+    for index, part in enumerate(parts):
+        decoder = TsvPartDecoder(writer, TsvHeader.parse, f"part-{index}")
+        for chunk in chunks(part, chunk_size):
+            decoder.feed(chunk)
+
+        decoder.close()
+        details.append(decoder.part_details())
+
+    return writer.close(), details
+
+
+def test_decoder_reads_every_gzip_member(tmp_path):
+    part = gzip.compress(header + b"".join(rows[:50])) + gzip.compress(b"".join(rows[50:]))
+    tsv_details, details = decode(tmp_path / "courses.tsv", [part])
+
+    assert shard_contents(tsv_details) == [header + b"".join(rows)]
+    assert details[0][constants.integrity_rows] == len(rows)
+    assert details[0][constants.integrity_bytes] == len(part)
+    assert details[0][constants.integrity_sha256] == hashlib.sha256(part).hexdigest()
+
+
+def test_decoder_keeps_one_header_and_ends_every_part(tmp_path):
+    parts = [gzip.compress(header + b"1\tone"), gzip.compress(header + b"2\ttwo\n")]
+    tsv_details, details = decode(tmp_path / "courses.tsv", parts)
+
+    assert shard_contents(tsv_details) == [header + b"1\tone\n2\ttwo\n"]
+    assert tsv_details[constants.tsv_detail_headers] == ["key.id", "value.name"]
+    assert [part[constants.integrity_rows] for part in details] == [1, 1]
+
+
+def test_decoder_rejects_truncated_part(tmp_path):
+    part = gzip.compress(header + b"".join(rows))
+
+    with pytest.raises(EOFError):
+        decode(tmp_path / "courses.tsv", [part[:len(part) // 2]])
+
+
+def test_decoder_rejects_bad_crc(tmp_path):
+    part = bytearray(gzip.compress(header + b"".join(rows)))
+    part[-8] ^= 0xff
+
+    with pytest.raises(zlib.error):
+        decode(tmp_path / "courses.tsv", [bytes(part)])